@@ -0,0 +1,27 @@
+"""
+Venue payloads shared by the benchmarks, shaped like the venue API's responses.
+"""
+
+VENUE_SLUG = 'home-assignment-venue-berlin'
+
+VENUE_STATIC = {"venue_raw": {"location": {"coordinates": [13.4536149, 52.5003197]}}}
+VENUE_DYNAMIC = {
+    "venue_raw": {
+        "delivery_specs": {
+            "order_minimum_no_surcharge": 1000,
+            "delivery_pricing": {
+                "base_price": 190,
+                "distance_ranges": [
+                    {"min": 0, "max": 500, "a": 0, "b": 0},
+                    {"min": 500, "max": 1000, "a": 100, "b": 0},
+                    {"min": 1000, "max": 1500, "a": 200, "b": 0},
+                    {"min": 1500, "max": 2000, "a": 200, "b": 1},
+                    {"min": 2000, "max": 0, "a": 0, "b": 0},
+                ],
+            },
+        }
+    }
+}
+
+# A quote about 900 m from the venue.
+QUERY = f'venue_slug={VENUE_SLUG}&cart_value=1000&user_lat=52.5083197&user_lon=13.4536149'
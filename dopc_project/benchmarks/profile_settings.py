@@ -0,0 +1,126 @@
+"""
+Compare the full and the API-only settings profiles.
+
+Cold start is the time a fresh interpreter takes from the first import to the
+first served quote. Per-request time drives the WSGI handler directly, with the
+venue primed in the in-process cache, so it measures the framework and the
+view rather than the venue API. Each profile runs in its own subprocess.
+
+Usage, from the directory containing manage.py:
+
+    python -m benchmarks.profile_settings [--runs 10] [--requests 5000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILES = {
+    'full': 'dopc_project.settings',
+    'api': 'dopc_project.settings_api',
+}
+
+
+def _environ(query):
+    from wsgiref.util import setup_testing_defaults
+
+    environ = {'PATH_INFO': '/api/v1/delivery-order-price', 'QUERY_STRING': query}
+    setup_testing_defaults(environ)
+    return environ
+
+
+def _start_response(status, headers, exc_info=None):
+    if not status.startswith('200'):
+        raise RuntimeError(f"Unexpected response {status}")
+
+
+def _prime_venue():
+    from dopc import utils
+    from benchmarks.fixtures import VENUE_DYNAMIC, VENUE_SLUG, VENUE_STATIC
+
+    utils._warmed = True
+    utils.static_cache.prime(VENUE_SLUG, utils._compile_static(VENUE_STATIC))
+    utils.dynamic_cache.prime(VENUE_SLUG, utils._compile_dynamic(VENUE_DYNAMIC))
+
+
+def measure_cold_start():
+    """
+    :return: Dict with the seconds to the first quote and the number of loaded modules
+    """
+    started = time.perf_counter()
+    import django
+    from django.core.handlers.wsgi import WSGIHandler
+    from benchmarks.fixtures import QUERY
+
+    django.setup(set_prefix=False)
+    handler = WSGIHandler()
+    _prime_venue()
+    b''.join(handler(_environ(QUERY), _start_response))
+    return {'seconds': time.perf_counter() - started, 'modules': len(sys.modules)}
+
+
+def measure_requests(count):
+    """
+    :return: Dict with the mean and median microseconds per request
+    """
+    import django
+    from django.core.handlers.wsgi import WSGIHandler
+    from benchmarks.fixtures import QUERY
+
+    django.setup(set_prefix=False)
+    handler = WSGIHandler()
+    _prime_venue()
+    for _ in range(min(count, 200)):
+        b''.join(handler(_environ(QUERY), _start_response))
+
+    durations = []
+    for _ in range(count):
+        started = time.perf_counter()
+        b''.join(handler(_environ(QUERY), _start_response))
+        durations.append(time.perf_counter() - started)
+    return {
+        'mean_us': statistics.fmean(durations) * 1e6,
+        'median_us': statistics.median(durations) * 1e6,
+    }
+
+
+def _run_child(settings_module, *args):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, DOPC_ASYNC_VIEWS='0')
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.profile_settings', '--child', *args],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10, help="Cold starts per profile (default 10).")
+    parser.add_argument('--requests', type=int, default=5000, help="Requests per profile (default 5000).")
+    parser.add_argument('--child', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child[0] == 'cold':
+            result = measure_cold_start()
+        else:
+            result = measure_requests(int(args.child[1]))
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for name, settings_module in PROFILES.items():
+        cold = [_run_child(settings_module, 'cold') for _ in range(args.runs)]
+        results[name] = {
+            'cold_start_ms': statistics.median(run['seconds'] for run in cold) * 1000,
+            'modules': cold[0]['modules'],
+            **_run_child(settings_module, 'requests', str(args.requests)),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
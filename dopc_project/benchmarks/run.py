@@ -0,0 +1,450 @@
+"""
+Offline benchmark suite for the pricing API.
+
+Starts the stub venue API from benchmarks/stub_server.py and measures, each in
+its own process:
+
+- Load: throughput and p50/p95/p99 latency of the price endpoint, driven through
+  Django's WSGI handler from a thread pool and through its ASGI handler from
+  asyncio tasks, at each concurrency level.
+- Micro: calculate_distance in each distance mode, the PricingTable fee lookup,
+  quotes through the pricing core, quotes at every venue of a city for one
+  user with and without the venue index,
+  JSON encoding of a price response with each available backend, and building
+  price and error responses with JsonResponse and with the views' encoder.
+- Memory: bytes held per venue by the in-process venue caches and the venue
+  index, and what they would hold if the venue API's payloads were kept too.
+
+Usage, from the directory containing manage.py:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --compare baseline.json --threshold 0.2
+
+With ``--compare``, metrics more than ``threshold`` worse than the baseline are
+listed and the command exits with status 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from .fixtures import QUERY, VENUE_DYNAMIC, VENUE_STATIC
+from .stub_server import VenueStubServer
+
+PATH = '/api/v1/delivery-order-price'
+SERVERS = ('wsgi', 'asgi')
+
+
+def _queries(count, venues, seed=0):
+    """
+    Build price queries spread over ``venues`` venue slugs and within 2 km of the venue.
+    """
+    latitude, longitude = VENUE_STATIC['venue_raw']['location']['coordinates'][::-1]
+    rng = random.Random(seed)
+    return [
+        f"venue_slug=venue-{rng.randrange(venues)}&cart_value={rng.randint(100, 3000)}"
+        f"&user_lat={latitude + rng.uniform(-0.012, 0.012):.7f}&user_lon={longitude + rng.uniform(-0.018, 0.018):.7f}"
+        for _ in range(count)
+    ]
+
+
+def _summary(durations, elapsed, errors):
+    """
+    :param durations: Seconds taken by each request
+    :param elapsed: Wall clock seconds for all requests
+    :param errors: Number of non-200 responses
+    :return: Dict with the throughput and latency percentiles in milliseconds
+    """
+    cuts = statistics.quantiles(durations, n=100, method='inclusive')
+    return {
+        'requests': len(durations),
+        'errors': errors,
+        'throughput_rps': len(durations) / elapsed,
+        'p50_ms': cuts[49] * 1000,
+        'p95_ms': cuts[94] * 1000,
+        'p99_ms': cuts[98] * 1000,
+    }
+
+
+def _wsgi_level(handler, queries, concurrency):
+    from wsgiref.util import setup_testing_defaults
+
+    def request(query):
+        environ = {'PATH_INFO': PATH, 'QUERY_STRING': query}
+        setup_testing_defaults(environ)
+        statuses = []
+        started = time.perf_counter()
+        b''.join(handler(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+        return time.perf_counter() - started, statuses[0].startswith('200')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, queries))
+    elapsed = time.perf_counter() - started
+    return _summary([duration for duration, _ in results], elapsed, sum(not ok for _, ok in results))
+
+
+async def _asgi_level(application, queries, concurrency):
+    pending = iter(queries)
+    durations = []
+    errors = 0
+
+    async def request(query):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': PATH, 'raw_path': PATH.encode(),
+            'root_path': '', 'query_string': query.encode(), 'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Future()  # Never disconnects, cancelled by the handler
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await application(scope, receive, send)
+        return status[0] == 200
+
+    async def worker():
+        nonlocal errors
+        for query in pending:
+            started = time.perf_counter()
+            ok = await request(query)
+            durations.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _summary(durations, time.perf_counter() - started, errors)
+
+
+def run_load(server, concurrency_levels, requests, venues):
+    """
+    Measure the price endpoint in this process, after loading every venue once.
+    :return: Dict mapping the concurrency level to the summary of its requests
+    """
+    import django
+
+    django.setup(set_prefix=False)
+    warmup = [QUERY.replace('home-assignment-venue-berlin', f'venue-{venue}') for venue in range(venues)]
+    results = {}
+    if server == 'wsgi':
+        from django.core.handlers.wsgi import WSGIHandler
+
+        handler = WSGIHandler()
+        _wsgi_level(handler, warmup, 1)
+        for level in concurrency_levels:
+            results[str(level)] = _wsgi_level(handler, _queries(requests, venues, level), level)
+    else:
+        from django.core.handlers.asgi import ASGIHandler
+
+        async def main():
+            application = ASGIHandler()
+            await _asgi_level(application, warmup, 1)
+            for level in concurrency_levels:
+                results[str(level)] = await _asgi_level(application, _queries(requests, venues, level), level)
+
+        asyncio.run(main())
+    return results
+
+
+def _per_call_ns(statement, number):
+    """
+    :return: Best of five runs of ``statement``, in nanoseconds per call
+    """
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e9
+
+
+def run_micro(number):
+    """
+    Measure the building blocks of a quote in this process.
+    :return: Dict mapping the benchmark name to nanoseconds per call
+    """
+    import django
+
+    django.setup(set_prefix=False)
+    from django.core.serializers.json import DjangoJSONEncoder
+    from django.http import JsonResponse
+    from dopc import core, encoding, views
+    from dopc.distance import DistanceEngine
+    from dopc.pricing import compile_pricing
+    from dopc.utils import calculate_distance
+    from dopc.venue_index import VenueIndex
+
+    rng = random.Random(0)
+    venue = tuple(VENUE_STATIC['venue_raw']['location']['coordinates'][::-1])
+    points = [(venue[0] + rng.uniform(-0.012, 0.012), venue[1] + rng.uniform(-0.018, 0.018)) for _ in range(1000)]
+    distances = [rng.randrange(0, 2500) for _ in range(1000)]
+    pricing = compile_pricing(VENUE_DYNAMIC)
+    body = {
+        'total_price': 1190, 'small_order_surcharge': 0, 'cart_value': 1000,
+        'delivery': {'fee': 190, 'distance': 177},
+    }
+
+    results = {
+        'calculate_distance': _per_call_ns(
+            lambda: [calculate_distance(point, venue) for point in points], number // 1000) / 1000,
+        'fee_lookup': _per_call_ns(
+            lambda: [pricing.delivery_fee(distance) for distance in distances], number // 1000) / 1000,
+        'json_encode': _per_call_ns(lambda: json.dumps(body, cls=DjangoJSONEncoder), number),
+        # Response construction before and after encoding with the JSON backend
+        'response_jsonresponse': _per_call_ns(lambda: JsonResponse(body), number),
+        'response_encoded': _per_call_ns(lambda: views._json_response(body), number),
+        'error_jsonresponse': _per_call_ns(
+            lambda: JsonResponse({'error': 'Invalid parameter data type'}, status=400), number),
+        'error_preencoded': _per_call_ns(lambda: views._error_response('Invalid parameter data type'), number),
+    }
+    # Quotes through the pricing core, without a request
+    compiled = (venue, pricing)
+    lambert = DistanceEngine('lambert')
+    orders = [(1000, *point) for point in points]
+    results['core_quote'] = _per_call_ns(lambda: core.quote(compiled, 1000, *points[0]), max(number // 100, 1))
+    results['core_quote_lambert'] = _per_call_ns(
+        lambda: core.quote(compiled, 1000, *points[0], engine=lambert), number)
+    results['core_quote_many'] = _per_call_ns(
+        lambda: core.quote_many(compiled, orders), max(number // 1000, 1)) / len(orders)
+    # Quotes at every venue of a city for one user, with and without the venue index
+    city = {f'venue-{number}': ((venue[0] + rng.uniform(-0.1, 0.1), venue[1] + rng.uniform(-0.15, 0.15)), pricing)
+            for number in range(2000)}
+    index = VenueIndex()
+    for venue_slug, city_venue in city.items():
+        index.add(venue_slug, city_venue)
+    results['nearby_scan'] = _per_call_ns(
+        lambda: core.quote_venues(city, 1000, *points[0]), max(number // 1000, 1))
+    results['nearby_index'] = _per_call_ns(
+        lambda: core.quote_venues(index.candidates(*points[0]), 1000, *points[0]), max(number // 100, 1))
+    for backend in encoding.BACKENDS:
+        dumps = encoding.get_backend(backend)[0]
+        results[f'json_encode_{backend}'] = _per_call_ns(lambda: dumps(body), number)
+    for mode in ('geodesic', 'lambert', 'vincenty'):
+        engine = DistanceEngine(mode)
+        results[f'distances_{mode}'] = _per_call_ns(
+            lambda: engine.distances(venue, points), max(number // 10000, 1)) / len(points)
+    return results
+
+
+def run_memory(venues, specs=20):
+    """
+    Measure the memory held per venue once ``venues`` venues are cached.
+
+    Venues get distinct locations and one of ``specs`` delivery specs. Payloads
+    are decoded inside the measurement, as when fetched from the venue API.
+    :return: Dict mapping the measurement name to bytes per venue
+    """
+    import django
+
+    django.setup(set_prefix=False)
+    from dopc import utils
+    from dopc.cache import VenueCache
+    from dopc.venue_index import VenueIndex
+
+    rng = random.Random(0)
+    latitude, longitude = VENUE_STATIC['venue_raw']['location']['coordinates'][::-1]
+    payloads = []
+    for number in range(venues):
+        static_data = {'venue_raw': {'location': {'coordinates': [
+            longitude + rng.uniform(-0.15, 0.15), latitude + rng.uniform(-0.1, 0.1)]}}}
+        dynamic_data = json.loads(json.dumps(VENUE_DYNAMIC))
+        dynamic_data['venue_raw']['delivery_specs']['delivery_pricing']['base_price'] += number % specs
+        payloads.append((f'venue-{number}', json.dumps(static_data), json.dumps(dynamic_data)))
+
+    def held(keep_payloads):
+        static_cache = VenueCache(None, ttl=60, max_entries=venues)
+        dynamic_cache = VenueCache(None, ttl=60, max_entries=venues)
+        index = VenueIndex(max_venues=venues)
+        tracemalloc.start()
+        for venue_slug, static_json, dynamic_json in payloads:
+            static_data, dynamic_data = json.loads(static_json), json.loads(dynamic_json)
+            static_entry, dynamic_entry = utils._compile_static(static_data), utils._compile_dynamic(dynamic_data)
+            if keep_payloads:
+                static_cache.prime(venue_slug, (static_data, static_entry))
+                dynamic_cache.prime(venue_slug, (dynamic_data, dynamic_entry))
+            else:
+                static_cache.prime(venue_slug, static_entry)
+                dynamic_cache.prime(venue_slug, dynamic_entry)
+            index.add(venue_slug, (static_entry, dynamic_entry))
+        del static_data, dynamic_data
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / venues
+
+    return {'venue': held(False), 'venue_with_payloads': held(True)}
+
+
+def _run_child(args, env):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.run', '--child', *args],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def _json_backend():
+    from dopc.encoding import orjson
+
+    return f'orjson {orjson.__version__}' if orjson is not None else 'json'
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    """
+    Run every benchmark against a fresh stub venue API.
+    :return: Results as a JSON-serializable dict
+    """
+    stub = VenueStubServer(latency=args.latency).start()
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE='benchmarks.settings',
+        DOPC_BENCH_UPSTREAM_URL=stub.base_url,
+        DOPC_BENCH_VENUE_TTL=str(args.venue_ttl),
+    )
+    load_args = ['--concurrency', ','.join(map(str, args.concurrency)),
+                 '--requests', str(args.requests), '--venues', str(args.venues)]
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'django': __import__('django').get_version(),
+            'json_backend': _json_backend(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'latency_s': args.latency,
+            'venue_ttl_s': args.venue_ttl,
+            'venues': args.venues,
+        },
+        'load': {},
+    }
+    try:
+        for server in args.servers:
+            upstream_before = stub.requests
+            server_env = dict(env, DOPC_ASYNC_VIEWS='1' if server == 'asgi' else '0')
+            results['load'][server] = {
+                'levels': _run_child(['load', server, *load_args], server_env),
+                'upstream_requests': stub.requests - upstream_before,
+            }
+        results['micro_ns'] = _run_child(['micro', '--number', str(args.number)], env)
+        results['memory_bytes'] = _run_child(['memory', '--memory-venues', str(args.memory_venues)], env)
+    finally:
+        stub.shutdown()
+        stub.server_close()
+    return results
+
+
+def _metrics(results):
+    """
+    Flatten results into {name: (value, higher_is_better)}.
+    """
+    metrics = {}
+    for server, load in results.get('load', {}).items():
+        for level, summary in load['levels'].items():
+            metrics[f'{server}.c{level}.throughput_rps'] = (summary['throughput_rps'], True)
+            for percentile in ('p50_ms', 'p95_ms', 'p99_ms'):
+                metrics[f'{server}.c{level}.{percentile}'] = (summary[percentile], False)
+    for name, value in results.get('micro_ns', {}).items():
+        metrics[f'micro.{name}_ns'] = (value, False)
+    for name, value in results.get('memory_bytes', {}).items():
+        metrics[f'memory.{name}_bytes'] = (value, False)
+    return metrics
+
+
+def compare(baseline, current, threshold):
+    """
+    :return: List of (metric, baseline value, current value) that regressed by more than threshold
+    """
+    current_metrics = _metrics(current)
+    regressions = []
+    for name, (before, higher_is_better) in _metrics(baseline).items():
+        if name not in current_metrics or not before:
+            continue
+        after = current_metrics[name][0]
+        change = (before - after) / before if higher_is_better else (after - before) / before
+        if change > threshold:
+            regressions.append((name, before, after))
+    return regressions
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 8, 32],
+                        help="Comma-separated concurrency levels (default 1,8,32).")
+    parser.add_argument('--requests', type=int, default=2000,
+                        help="Requests per concurrency level (default 2000).")
+    parser.add_argument('--servers', type=lambda value: value.split(','), default=list(SERVERS),
+                        help="Comma-separated handlers to load, wsgi and/or asgi (default both).")
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="Seconds the stub venue API takes per response (default 0.02).")
+    parser.add_argument('--venues', type=int, default=50, help="Number of distinct venues (default 50).")
+    parser.add_argument('--venue-ttl', type=int, default=60,
+                        help="Venue cache TTL in seconds; 0 fetches every quote from the stub (default 60).")
+    parser.add_argument('--number', type=int, default=100000,
+                        help="Calls per microbenchmark run (default 100000).")
+    parser.add_argument('--memory-venues', type=int, default=20000,
+                        help="Venues cached for the memory measurement (default 20000).")
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    parser.add_argument('--compare', help="Baseline JSON file to check the results against.")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative change counted as a regression (default 0.2).")
+    parser.add_argument('--child', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child[0] == 'load':
+            result = run_load(args.child[1], args.concurrency, args.requests, args.venues)
+        elif args.child[0] == 'memory':
+            result = run_memory(args.memory_venues)
+        else:
+            result = run_micro(args.number)
+        print(json.dumps(result))
+        return
+
+    unknown = set(args.servers) - set(SERVERS)
+    if unknown:
+        parser.error(f"Unknown servers: {', '.join(sorted(unknown))}")
+
+    results = run_suite(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), results, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.3f} -> {after:.3f}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
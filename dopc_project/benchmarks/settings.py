@@ -0,0 +1,54 @@
+"""
+Settings for the offline benchmarks.
+
+Based on the API-only profile, with the venue API pointed at the local stub
+from benchmarks/stub_server.py and every cache kept in process memory so runs
+do not affect each other. The variables are set by benchmarks/run.py:
+
+- DOPC_BENCH_UPSTREAM_URL: Base URL of the stub venue API
+- DOPC_BENCH_VENUE_TTL: Venue cache TTL in seconds; 0 fetches every quote from the stub
+"""
+import os
+
+from dopc_project.settings_api import *  # noqa: F401,F403
+from dopc_project.settings_api import DOPC_UPSTREAM, DOPC_VENUE_CACHE
+
+DEBUG = False
+
+ALLOWED_HOSTS = ['*']
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'venues': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dopc-bench-venues',
+    },
+}
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+DOPC_UPSTREAM = {
+    **DOPC_UPSTREAM,
+    'BASE_URL': os.environ.get('DOPC_BENCH_UPSTREAM_URL', 'http://127.0.0.1:8765/'),
+    'RETRIES': 0,
+}
+
+_venue_ttl = int(os.environ.get('DOPC_BENCH_VENUE_TTL', DOPC_VENUE_CACHE['DYNAMIC_TTL']))
+
+DOPC_VENUE_CACHE = {
+    **DOPC_VENUE_CACHE,
+    'STATIC_TTL': _venue_ttl,
+    'DYNAMIC_TTL': _venue_ttl,
+    'STALE_TTL': 0,
+}
+
+DOPC_VENUE_SNAPSHOTS = {
+    'ENABLED': False,
+}
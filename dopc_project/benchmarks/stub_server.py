@@ -0,0 +1,80 @@
+"""
+Local stand-in for the venue API, serving benchmarks/fixtures.py for any venue slug.
+
+    python -m benchmarks.stub_server [--port 8765] [--latency 0.02]
+
+Every response is delayed by ``latency`` seconds to model the network and the
+venue API. Requests are served concurrently, one thread each.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .fixtures import VENUE_DYNAMIC, VENUE_STATIC
+
+PAYLOADS = {
+    'static': json.dumps(VENUE_STATIC).encode(),
+    'dynamic': json.dumps(VENUE_DYNAMIC).encode(),
+}
+
+
+class VenueStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        kind = self.path.rstrip('/').rpartition('/')[2]
+        body = PAYLOADS.get(kind)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+        self.send_response(200 if body else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        self.wfile.write(body or b'')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class VenueStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0):
+        """
+        :param address: Tuple (host, port); port 0 picks a free port
+        :param latency: Seconds to wait before every response
+        """
+        super().__init__(address, VenueStubHandler)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        """Serve from a daemon thread and return the server."""
+        threading.Thread(target=self.serve_forever, name='venue-stub', daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stub venue data.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds per response (default 0).")
+    args = parser.parse_args()
+    server = VenueStubServer((args.host, args.port), args.latency)
+    print(f"Serving stub venue API at {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+from collections import deque
+
+HIGH = 'high'
+LOW = 'low'
+
+# Reasons a request is shed
+QUEUE_FULL = 'queue_full'
+TIMEOUT = 'timeout'
+DISPLACED = 'displaced'
+
+_ADMITTED = 'admitted'
+_CANCELLED = 'cancelled'
+
+
+class _Waiter:
+    __slots__ = ('priority', 'outcome', 'wake')
+
+    def __init__(self, priority, wake):
+        self.priority = priority
+        self.outcome = None  # _ADMITTED or the reason the request was turned away, once decided
+        self.wake = wake
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded wait queue for one process.
+
+    - At most ``max_concurrency`` requests are admitted at once.
+    - Further requests wait in a queue of at most ``max_queue`` requests and
+      are admitted in arrival order as admitted ones are released. A request
+      still queued after ``queue_timeout`` seconds is shed.
+    - A request arriving while the queue is full is shed at once.
+
+    High priority requests are admitted before every queued low priority one,
+    and when the queue is full, a high priority request takes the place of the
+    most recently queued low priority request, which is shed. With
+    ``prioritize`` off, every request has the same priority.
+
+    Threads wait with ``acquire`` and async tasks with ``aacquire``; both share
+    the same slots and queue. Every admitted request must call ``release``.
+    """
+
+    def __init__(self, max_concurrency, max_queue=0, queue_timeout=1.0, prioritize=True):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.prioritize = prioritize
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = {QUEUE_FULL: 0, TIMEOUT: 0, DISPLACED: 0}
+        self._queues = {HIGH: deque(), LOW: deque()}
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=LOW):
+        """
+        Wait for a slot, blocking for up to ``queue_timeout`` seconds.
+        :param priority: HIGH or LOW
+        :return: None if admitted, otherwise the reason the request was shed
+        """
+        if self._admit():
+            return None
+        event = threading.Event()
+        waiter = _Waiter(self._priority(priority), event.set)
+        if self._enter(waiter):
+            event.wait(self.queue_timeout)
+            self._leave(waiter, TIMEOUT)
+        return None if waiter.outcome == _ADMITTED else waiter.outcome
+
+    async def aacquire(self, priority=LOW):
+        """
+        Async version of ``acquire``. A task cancelled while queued gives up its place.
+        """
+        if self._admit():
+            return None
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = _Waiter(self._priority(priority), lambda: loop.call_soon_threadsafe(_resolve, future))
+        if self._enter(waiter):
+            try:
+                await asyncio.wait((future,), timeout=self.queue_timeout)
+            except asyncio.CancelledError:
+                if self._leave(waiter, _CANCELLED) == _ADMITTED:
+                    self.release()
+                raise
+            self._leave(waiter, TIMEOUT)
+        return None if waiter.outcome == _ADMITTED else waiter.outcome
+
+    def release(self):
+        """Free the slot of an admitted request, handing it to the next queued request if any."""
+        with self._lock:
+            for queue in self._queues.values():
+                if queue:
+                    waiter = queue.popleft()
+                    waiter.outcome = _ADMITTED
+                    self.admitted += 1
+                    waiter.wake()
+                    return
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'queued': {priority: len(queue) for priority, queue in self._queues.items()},
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+            }
+
+    def _priority(self, priority):
+        return priority if self.prioritize else LOW
+
+    def _admit(self):
+        """
+        Admit a new request if a slot is free and nobody is queued for one.
+        :return: True if admitted
+        """
+        with self._lock:
+            return self._admit_locked()
+
+    def _admit_locked(self):
+        if self.in_flight < self.max_concurrency and not self._queues[HIGH] and not self._queues[LOW]:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        return False
+
+    def _enter(self, waiter):
+        """
+        Admit, queue or shed a new request that could not be admitted at once.
+        :return: True if the request was queued and must wait for its outcome
+        """
+        with self._lock:
+            if self._admit_locked():
+                waiter.outcome = _ADMITTED
+                return False
+            high, low = self._queues[HIGH], self._queues[LOW]
+            if len(high) + len(low) >= self.max_queue:
+                if waiter.priority != HIGH or not low:
+                    waiter.outcome = QUEUE_FULL
+                    self.shed[QUEUE_FULL] += 1
+                    return False
+                displaced = low.pop()
+                displaced.outcome = DISPLACED
+                self.shed[DISPLACED] += 1
+                displaced.wake()
+            self._queues[waiter.priority].append(waiter)
+            return True
+
+    def _leave(self, waiter, reason):
+        """
+        Take a request that stopped waiting out of the queue, unless it was decided meanwhile.
+        :return: The request's outcome
+        """
+        with self._lock:
+            if waiter.outcome is None:
+                self._queues[waiter.priority].remove(waiter)
+                waiter.outcome = reason
+                if reason in self.shed:
+                    self.shed[reason] += 1
+            return waiter.outcome
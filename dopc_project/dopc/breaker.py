@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one upstream endpoint.
+
+    - Closed: calls go through. Failures and calls slower than ``slow_call``
+      seconds are counted over the last ``window`` seconds, and once at least
+      ``min_calls`` calls were made and ``failure_rate`` of them failed, the
+      circuit opens.
+    - Open: calls are rejected for ``open_seconds``, then the circuit turns half-open.
+    - Half-open: up to ``half_open_calls`` probe calls go through. The circuit
+      closes when all of them succeed and reopens on the first failure.
+
+    Every call asks ``start`` for a ticket and reports its outcome with
+    ``record``. Outcomes of calls admitted before the last state change are
+    ignored, so a slow call from before the circuit opened cannot close it.
+    """
+
+    def __init__(self, name, failure_rate=0.5, min_calls=10, window=30, slow_call=1.0,
+                 open_seconds=10, half_open_calls=1, clock=time.monotonic):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self._state = CLOSED
+        self._generation = 0
+        self._opened_at = 0.0
+        self._calls = deque()  # (finished_at, failed) of closed-state calls within the window
+        self._failures = 0
+        self._probes = 0  # Probe calls admitted while half-open
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._update(self._clock())
+            return self._state
+
+    def start(self):
+        """
+        Ask to make a call.
+        :return: Ticket to pass to ``record``, or None if the circuit rejects the call
+        """
+        with self._lock:
+            self._update(self._clock())
+            if self._state == OPEN:
+                return None
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    return None
+                self._probes += 1
+            return self._generation
+
+    def record(self, ticket, failed, duration):
+        """
+        Report the outcome of a call admitted by ``start``.
+        :param ticket: Value returned by ``start``
+        :param failed: Whether the call failed
+        :param duration: Seconds the call took; slower than ``slow_call`` counts as a failure
+        """
+        failed = failed or duration > self.slow_call
+        with self._lock:
+            now = self._clock()
+            self._update(now)
+            if ticket != self._generation:
+                return
+            if self._state == HALF_OPEN:
+                if failed:
+                    self._transition(OPEN, now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._transition(CLOSED, now)
+            elif self._state == CLOSED:
+                self._calls.append((now, failed))
+                self._failures += failed
+                self._expire(now)
+                if (len(self._calls) >= self.min_calls
+                        and self._failures >= self.failure_rate * len(self._calls)):
+                    self._transition(OPEN, now)
+
+    def reset(self):
+        """Close the circuit and forget every recorded call."""
+        with self._lock:
+            self._transition(CLOSED, self._clock())
+
+    def _update(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, now)
+
+    def _expire(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._failures -= self._calls.popleft()[1]
+
+    def _transition(self, state, now):
+        if state == OPEN:
+            logger.warning("Circuit for %s opened for %s s", self.name, self.open_seconds)
+            self._opened_at = now
+        elif state == CLOSED and self._state != CLOSED:
+            logger.info("Circuit for %s closed", self.name)
+        self._state = state
+        self._generation += 1
+        self._calls.clear()
+        self._failures = 0
+        self._probes = 0
+        self._probe_successes = 0
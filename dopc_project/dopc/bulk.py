@@ -0,0 +1,225 @@
+"""
+Streaming bulk pricing of orders, for offline re-pricing jobs.
+
+Orders are read as NDJSON objects or CSV rows with the ``calculate_price``
+fields (``venue_slug``, ``cart_value``, ``user_lat``, ``user_lon``) plus any
+other fields, which are copied to the output. Every output row adds
+``RESULT_FIELDS``.
+
+The reader process fetches each venue once and sends chunks of orders, with
+the venues they need, to a pool of worker processes. Workers price a chunk with
+the pricing core (dopc/core.py) and return it encoded, and chunks are
+written in input order as they complete. At most ``2 * processes`` chunks are
+in flight, so memory does not grow with the input.
+
+Venues go through the Django caches first, like quotes. Venues those cannot
+serve within a request's budget are loaded again without one, with retries
+and exponential backoff; venues the venue API still fails to serve are listed
+in the returned stats.
+"""
+import csv
+import io
+import itertools
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import core
+from .encoding import get_backend
+
+FORMATS = ('ndjson', 'csv')
+RESULT_FIELDS = ('total_price', 'small_order_surcharge', 'delivery_fee', 'delivery_distance', 'error')
+
+dumps, loads = get_backend()
+
+
+def read_rows(lines, input_format):
+    """
+    :param lines: Iterable of input lines
+    :param input_format: 'ndjson' or 'csv' with a header row
+    :return: Tuple (fieldnames of the CSV header or None, iterator of rows); rows
+        that are not JSON objects are None
+    """
+    if input_format == 'csv':
+        reader = csv.DictReader(lines)
+        return reader.fieldnames, reader
+
+    def rows():
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
+
+    return None, rows()
+
+
+def _venue_slug(row):
+    if row is not None and isinstance(row.get('venue_slug'), str):
+        return row['venue_slug']
+    return None
+
+
+def price_rows(rows, venues, engine=None):
+    """
+    Price orders against fetched venue data.
+    :param rows: List of order dicts, or None for rows that could not be read
+    :param venues: Dict mapping each venue slug of the rows to a tuple
+        ((latitude, longitude), PricingTable), or None if the venue is unavailable
+    :param engine: DistanceEngine, see ``core.quote_orders``
+    :return: List of output dicts in input order
+    """
+    results = [None] * len(rows)
+    indices, orders = [], []
+    for index, row in enumerate(rows):
+        order, error = (None, core.INVALID_PARAMETERS) if _venue_slug(row) is None else core.parse_order(row)
+        if error:
+            results[index] = dict(row or {}, error=error)
+        else:
+            indices.append(index)
+            orders.append(order)
+
+    for index, (body, status) in zip(indices, core.quote_orders(orders, venues, engine)):
+        if status == 200:
+            results[index] = dict(
+                rows[index],
+                total_price=body['total_price'],
+                small_order_surcharge=body['small_order_surcharge'],
+                delivery_fee=body['delivery']['fee'],
+                delivery_distance=body['delivery']['distance'],
+                error=None,
+            )
+        else:
+            results[index] = dict(rows[index], error=body['error'])
+    return results
+
+
+def _price_chunk(rows, venues, engine, output_format, fieldnames):
+    """
+    Price and encode one chunk of orders.
+    :return: Tuple (encoded output rows, number of rows, number of rows with an error)
+    """
+    results = price_rows(rows, venues, engine)
+    errors = sum(result['error'] is not None for result in results)
+    if output_format == 'csv':
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, fieldnames, extrasaction='ignore').writerows(results)
+        return buffer.getvalue(), len(results), errors
+    return b''.join(dumps(result) + b'\n' for result in results).decode(), len(results), errors
+
+
+def _refresh_venue(venue_slug, retries, retry_backoff):
+    """
+    Load a venue from the venue API, retrying failed loads.
+    :return: Tuple ((latitude, longitude), PricingTable), or None if the venue does not exist
+    :raises UpstreamError: If the venue API still fails after ``retries`` retries
+    """
+    from .utils import UpstreamError, refresh_venue
+
+    for attempt in range(retries + 1):
+        try:
+            return refresh_venue(venue_slug)
+        except UpstreamError:
+            if attempt == retries:
+                raise
+            time.sleep(retry_backoff * 2 ** attempt)
+
+
+def _fetch_venues(venue_slugs, fetch_concurrency, retries, retry_backoff):
+    """
+    :return: Tuple (dict mapping venue slug to a tuple ((latitude, longitude),
+        PricingTable) or None, set of the venue slugs the venue API failed to serve)
+    """
+    # Venue data is fetched through the Django caches, by the reading process only
+    from .utils import UpstreamError, fetch_many_venues
+
+    venues = {}
+    venue_slugs = list(venue_slugs)
+    # Small groups stay within the upstream pool and the request budget
+    for start in range(0, len(venue_slugs), fetch_concurrency):
+        venues.update(fetch_many_venues(venue_slugs[start:start + fetch_concurrency]))
+
+    # None also stands for failed loads and loads cut short by the budget,
+    # which an offline job can afford to load again.
+    failed = set()
+    missing = [venue_slug for venue_slug, venue in venues.items() if venue is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=fetch_concurrency) as executor:
+            futures = {venue_slug: executor.submit(_refresh_venue, venue_slug, retries, retry_backoff)
+                       for venue_slug in missing}
+        for venue_slug, future in futures.items():
+            try:
+                venues[venue_slug] = future.result()
+            except UpstreamError:
+                failed.add(venue_slug)
+    return venues, failed
+
+
+def price_stream(lines, output, input_format='ndjson', processes=None, chunk_size=5000, fetch_concurrency=16,
+                 engine=None, retries=3, retry_backoff=1.0):
+    """
+    Price a stream of orders and write the results as they are ready.
+    :param lines: Iterable of input lines
+    :param output: Text stream the output rows are written to, in the input format
+    :param input_format: 'ndjson' or 'csv'
+    :param processes: Number of worker processes; None for one per CPU, 1 to price in this process
+    :param chunk_size: Number of orders sent to a worker at a time
+    :param fetch_concurrency: Maximum number of venues fetched at the same time
+    :param engine: DistanceEngine, see ``core.quote_orders``
+    :param retries: Number of times a venue the venue API failed to serve is loaded again
+    :param retry_backoff: Seconds before the first retry, doubled for every further one
+    :return: Dict with the number of rows, rows with an error and venues fetched, and
+        the sorted list of venues the venue API failed to serve ('failed_venues');
+        their rows have the error 'Unable to fetch venue data'
+    """
+    if input_format not in FORMATS:
+        raise ValueError(f"Unknown format {input_format!r}, expected one of {FORMATS}")
+    processes = processes or os.cpu_count() or 1
+    fieldnames, rows = read_rows(lines, input_format)
+    if input_format == 'csv':
+        fieldnames = list(fieldnames or ()) + [field for field in RESULT_FIELDS if field not in (fieldnames or ())]
+        csv.DictWriter(output, fieldnames).writeheader()
+
+    stats = {'rows': 0, 'errors': 0, 'venues': 0, 'failed_venues': []}
+    venues, failed = {}, set()
+
+    def write(text, row_count, errors):
+        output.write(text)
+        stats['rows'] += row_count
+        stats['errors'] += errors
+
+    executor = None
+    if processes > 1:
+        # Workers start from a fresh interpreter rather than a fork of this
+        # process, which runs the venue fetch threads. They only need the
+        # pricing core, not Django.
+        executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        pending = deque()
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            venue_slugs = {_venue_slug(row) for row in chunk} - {None}
+            missing = venue_slugs - venues.keys()
+            if missing:
+                fetched, fetch_failed = _fetch_venues(missing, fetch_concurrency, retries, retry_backoff)
+                venues.update(fetched)
+                failed |= fetch_failed
+                stats['venues'] += len(missing)
+            chunk_venues = {venue_slug: venues[venue_slug] for venue_slug in venue_slugs}
+            if executor is None:
+                write(*_price_chunk(chunk, chunk_venues, engine, input_format, fieldnames))
+                continue
+            pending.append(executor.submit(_price_chunk, chunk, chunk_venues, engine, input_format, fieldnames))
+            while len(pending) >= 2 * processes:
+                write(*pending.popleft().result())
+        while pending:
+            write(*pending.popleft().result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    stats['failed_venues'] = sorted(failed)
+    return stats
@@ -0,0 +1,251 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Background refreshes of stale entries are shared by every cache instance.
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='dopc-refresh')
+
+
+class VenueCache:
+    """
+    Bounded LRU cache for venue payloads with a time-to-live per entry.
+
+    - Entries younger than ``ttl`` are served directly.
+    - Entries older than ``ttl`` but younger than ``ttl + stale_ttl`` are
+      served as-is while a single background refresh replaces them.
+    - Concurrent misses for the same key share one call to ``loader``; at most
+      ``max_waiters`` lookups queue on it, and further ones are answered at
+      once with the held value, however old, or None.
+    - If ``loader`` raises while an older entry is still held, that entry is
+      served as the last known good value.
+
+    ``loader`` receives the key and returns the value, or None when there
+    is nothing to cache (for example an unknown venue slug). ``async_loader``
+    is its coroutine counterpart used by ``aget``; threads and async tasks
+    missing on the same key share whichever load started first.
+    """
+
+    def __init__(self, loader, ttl, stale_ttl=0, max_entries=1024, clock=time.monotonic, async_loader=None,
+                 max_waiters=None):
+        self.loader = loader
+        self.async_loader = async_loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_waiters = max_waiters
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0  # Misses that joined a load already running
+        self.rejected = 0  # Misses turned away because too many lookups were queued
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (value, loaded_at)
+        self._inflight = {}  # key -> Future shared by every caller waiting on the load
+        self._waiters = {}  # key -> number of lookups queued on the load in _inflight
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for ``key``, loading it if needed.
+        :param key: Cache key (the venue slug)
+        :return: Cached or freshly loaded value, or None
+        """
+        hit, value, future, leader = self._lookup(key)
+        if hit:
+            return value
+        if leader:
+            self._load(key, future)
+        return future.result()
+
+    async def aget(self, key):
+        """
+        Async version of ``get`` that loads misses with ``async_loader``.
+        :param key: Cache key (the venue slug)
+        :return: Cached or freshly loaded value, or None
+        """
+        hit, value, future, leader = self._lookup(key)
+        if hit:
+            return value
+        if leader:
+            await self._aload(key, future)
+        return await asyncio.wrap_future(future)
+
+    def submit(self, key, executor):
+        """
+        Look up ``key`` without blocking, loading it on ``executor`` if needed.
+
+        Callers that stop waiting on the returned future leave the load running,
+        so its result is cached for later lookups.
+        :param key: Cache key (the venue slug)
+        :param executor: Executor running the load on a miss
+        :return: Future of the cached or freshly loaded value, or None
+        """
+        hit, value, future, leader = self._lookup(key)
+        if hit:
+            future = Future()
+            future.set_result(value)
+        elif leader:
+            executor.submit(self._load, key, future)
+        return future
+
+    def peek(self, key):
+        """
+        Return the last value held for ``key``, however old, without loading it.
+        :param key: Cache key (the venue slug)
+        :return: Last known good value, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def refresh(self, key):
+        """
+        Reload ``key`` now, even if a fresh value is cached.
+        :param key: Cache key (the venue slug)
+        :return: Freshly loaded value, or None
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self._waiters[key] = 1
+            else:
+                self.coalesced += 1
+                self._waiters[key] += 1
+        if leader:
+            self._load(key, future)
+        return future.result()
+
+    def invalidate(self, key):
+        """
+        Drop ``key`` so the next lookup goes to the loader. A load already
+        running completes for its waiters but is not cached.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
+            self._waiters.pop(key, None)
+
+    def clear(self):
+        """Drop every entry; loads already running are not cached."""
+        with self._lock:
+            self._entries.clear()
+            self._inflight.clear()
+            self._waiters.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        :return: Dict with the hit, stale hit, miss, coalesced and rejected counters, the
+            number of entries, of loads running and of lookups queued on them
+        """
+        with self._lock:
+            return {'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses,
+                    'coalesced': self.coalesced, 'rejected': self.rejected, 'entries': len(self._entries),
+                    'loading': len(self._inflight), 'waiting': sum(self._waiters.values())}
+
+    def _lookup(self, key):
+        """
+        Serve ``key`` from memory or register interest in its load.
+        :return: Tuple (hit, value, future, leader); the leader must run the load
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = self._clock() - loaded_at
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    if age < self.ttl:
+                        self.hits += 1
+                    else:
+                        self.stale_hits += 1
+                        if key not in self._inflight:
+                            future = self._inflight[key] = Future()
+                            self._waiters[key] = 0
+                            _refresh_executor.submit(self._load, key, future)
+                    return True, value, None, False
+            self.misses += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self._waiters[key] = 1
+            elif self.max_waiters is not None and self._waiters[key] >= self.max_waiters:
+                self.rejected += 1
+                future = Future()
+                future.set_result(entry[0] if entry is not None else None)
+            else:
+                self.coalesced += 1
+                self._waiters[key] += 1
+        return False, None, future, leader
+
+    def _load(self, key, future):
+        try:
+            value = self.loader(key)
+        except BaseException as exc:
+            self._fail(key, future, exc)
+            return
+        self._finish(key, future, value)
+
+    async def _aload(self, key, future):
+        try:
+            value = await self.async_loader(key)
+        except BaseException as exc:
+            # Includes cancellation, so waiters on other threads are never left hanging.
+            self._fail(key, future, exc)
+            raise
+        self._finish(key, future, value)
+
+    def _finish(self, key, future, value):
+        with self._lock:
+            # Loads superseded by ``invalidate`` only answer their own waiters
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                del self._waiters[key]
+                if value is not None:
+                    self._store(key, value)
+                else:
+                    self._entries.pop(key, None)
+        future.set_result(value)
+
+    def _fail(self, key, future, exc):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                del self._waiters[key]
+            entry = self._entries.get(key)
+        if entry is not None and isinstance(exc, Exception):
+            future.set_result(entry[0])
+        else:
+            future.set_exception(exc)
+
+    def prime(self, key, value, age=0):
+        """
+        Insert a value loaded elsewhere, unless ``key`` is already cached.
+        :param key: Cache key (the venue slug)
+        :param value: Value to cache
+        :param age: Seconds since the value was loaded; capped at ``ttl`` so a
+            primed value is always served at least once while it is refreshed
+        """
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, self._clock() - min(age, self.ttl))
+                self._entries.move_to_end(key, last=False)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def _store(self, key, value):
+        self._entries[key] = (value, self._clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,174 @@
+"""
+Framework-free pricing core.
+
+Quotes are computed from compiled venue data, a tuple
+``((latitude, longitude), PricingTable)``, and plain values, with no request or
+settings involved. The price views, the batch and nearby venues endpoints and
+bulk pricing call into this module; in-process callers can use it directly:
+
+    venue = ((52.5003197, 13.4536149), compile_pricing(dynamic_data))
+    body, status = quote(venue, 1000, 52.5112207, 13.4536149)
+
+Bodies and statuses are those of the price endpoint. The exact geodesic
+engine is used unless another ``DistanceEngine`` is passed; with the default
+tolerance of 0 every engine returns the same distances (see dopc/distance.py).
+"""
+import heapq
+import math
+
+from .distance import DistanceEngine
+
+INVALID_PARAMETERS = 'Invalid parameter data type'
+INVALID_CART_VALUE = 'Invalid cart value'
+VENUE_UNAVAILABLE = 'Unable to fetch venue data'
+DISTANCE_EXCEEDED = 'Delivery distance exceeds the allowed range.'
+DISTANCE_UNPRICED = 'Delivery not available for this distance'
+ERRORS = (INVALID_PARAMETERS, INVALID_CART_VALUE, VENUE_UNAVAILABLE, DISTANCE_EXCEEDED, DISTANCE_UNPRICED)
+
+# Sort keys of quotes for several venues, ties broken by the other key and the slug
+ORDERINGS = {
+    'price': lambda item: (item[1]['total_price'], item[1]['delivery']['distance'], item[0]),
+    'distance': lambda item: (item[1]['delivery']['distance'], item[1]['total_price'], item[0]),
+}
+
+default_engine = DistanceEngine('geodesic')
+default_batch_engine = DistanceEngine('vincenty')
+
+
+def parse_order(params):
+    """
+    Parse and validate the parameters of an order.
+    :param params: Mapping with 'venue_slug', 'cart_value', 'user_lat' and 'user_lon',
+        as strings or numbers
+    :return: Tuple (order, error) where order is a tuple (venue_slug, cart_value,
+        user_lat, user_lon) and error is an error message when the parameters are
+        invalid, otherwise None
+    """
+    try:
+        venue_slug = params.get('venue_slug')
+        cart_value = int(float(params.get('cart_value')))
+        user_lat = float(params.get('user_lat'))
+        user_lon = float(params.get('user_lon'))
+    except Exception:
+        return None, INVALID_PARAMETERS
+    # NaN passes every range check below; infinite coordinates fail them
+    if math.isnan(user_lat) or math.isnan(user_lon):
+        return None, INVALID_PARAMETERS
+
+    if cart_value <= 0 or user_lat < -90 or user_lat > 90 or user_lon < -180 or user_lon > 180:
+        return None, INVALID_CART_VALUE
+    return (venue_slug, cart_value, user_lat, user_lon), None
+
+
+def price_order(cart_value, delivery_distance, pricing, range_index=None):
+    """
+    Price an order for a known delivery distance.
+    :param cart_value: Value of the items in the cart
+    :param delivery_distance: Delivery distance in meters, or None if it is known to
+        exceed the allowed range
+    :param pricing: The venue's PricingTable
+    :param range_index: Index of the distance range, if already known
+    :return: Tuple (body, status) of the price response
+    """
+    if delivery_distance is None or delivery_distance > pricing.max_distance:
+        return {'error': DISTANCE_EXCEEDED}, 400
+
+    if range_index is None:
+        delivery_fee = pricing.delivery_fee(delivery_distance)
+    else:
+        delivery_fee = pricing.range_fee(range_index, delivery_distance)
+    if delivery_fee is None:
+        return {'error': DISTANCE_UNPRICED}, 400
+
+    small_order_surcharge = max(0, pricing.order_minimum - cart_value)
+    body = {
+        'total_price': cart_value + small_order_surcharge + delivery_fee,
+        'small_order_surcharge': small_order_surcharge,
+        'cart_value': cart_value,
+        'delivery': {
+            'fee': delivery_fee,
+            'distance': delivery_distance
+        }
+    }
+    return body, 200
+
+
+def quote(venue, cart_value, user_lat, user_lon, engine=None):
+    """
+    Price one order.
+    :param venue: Tuple ((latitude, longitude), PricingTable)
+    :param engine: DistanceEngine, the exact geodesic by default
+    :return: Tuple (body, status) of the price response
+    """
+    delivery_distance = (engine or default_engine).distance((user_lat, user_lon), venue[0])
+    return price_order(cart_value, delivery_distance, venue[1])
+
+
+def quote_many(venue, orders, engine=None):
+    """
+    Price many orders for one venue, with their distances computed in one pass.
+    :param venue: Tuple ((latitude, longitude), PricingTable)
+    :param orders: Sequence of (cart_value, user_lat, user_lon) tuples
+    :param engine: DistanceEngine, the vectorized Vincenty engine by default
+    :return: List of (body, status) tuples in order
+    """
+    venue_coordinates, pricing = venue
+    distances = (engine or default_batch_engine).distances(venue_coordinates, [order[1:] for order in orders])
+    return [
+        price_order(order[0], delivery_distance, pricing)
+        for order, delivery_distance in zip(orders, distances)
+    ]
+
+
+def quote_orders(orders, venues, engine=None):
+    """
+    Price orders for any number of venues, grouped so each venue's distances are computed in one pass.
+    :param orders: Sequence of (venue_slug, cart_value, user_lat, user_lon) tuples, as
+        returned by ``parse_order``
+    :param venues: Mapping of each venue slug to a tuple ((latitude, longitude),
+        PricingTable), or None if the venue is unavailable
+    :param engine: DistanceEngine, the vectorized Vincenty engine by default
+    :return: List of (body, status) tuples in order
+    """
+    indices_by_venue = {}
+    for index, order in enumerate(orders):
+        indices_by_venue.setdefault(order[0], []).append(index)
+
+    results = [None] * len(orders)
+    for venue_slug, indices in indices_by_venue.items():
+        venue = venues.get(venue_slug)
+        if not venue:
+            for index in indices:
+                results[index] = {'error': VENUE_UNAVAILABLE}, 400
+            continue
+        quotes = quote_many(venue, [orders[index][1:] for index in indices], engine)
+        for index, result in zip(indices, quotes):
+            results[index] = result
+    return results
+
+
+def quote_venues(venues, cart_value, user_lat, user_lon, order_by='price', limit=None, engine=None):
+    """
+    Price one cart at several venues for one user, with the distances computed in one pass.
+    :param venues: Mapping of venue slug to a tuple ((latitude, longitude), PricingTable),
+        or None if the venue is unavailable
+    :param order_by: Key of ``ORDERINGS``: 'price' for the cheapest first, 'distance' for the nearest
+    :param limit: Maximum number of quotes returned, or None for all of them
+    :param engine: DistanceEngine, the vectorized Vincenty engine by default
+    :return: List of (venue_slug, body) tuples for the venues delivering to the user,
+        in order; unavailable venues and venues out of range are left out
+    """
+    venues = [(venue_slug, venue) for venue_slug, venue in venues.items() if venue]
+    if not venues:
+        return []
+    distances = (engine or default_batch_engine).distances(
+        (user_lat, user_lon), [venue[0] for _, venue in venues])
+    quotes = []
+    for (venue_slug, venue), delivery_distance in zip(venues, distances):
+        body, status = price_order(cart_value, delivery_distance, venue[1])
+        if status == 200:
+            quotes.append((venue_slug, body))
+    key = ORDERINGS[order_by]
+    if limit is not None and limit < len(quotes):
+        return heapq.nsmallest(limit, quotes, key=key)
+    return sorted(quotes, key=key)
@@ -0,0 +1,210 @@
+"""
+Distance engines for delivery distances on the WGS-84 ellipsoid.
+
+Every mode returns whole meters, truncated the same way as the original
+``int(geopy.distance.geodesic(...).meters)``.
+
+=========  ==========================================  ==============================
+Mode       Method                                      Max error vs geodesic (<=200 km)
+=========  ==========================================  ==============================
+geodesic   Karney's algorithm (geographiclib), exact   0
+lambert    Lambert's closed-form ellipsoidal formula   2e-6 * distance (2 cm at 10 km)
+vincenty   Vincenty's inverse formula, NumPy arrays    0.1 mm
+=========  ==========================================  ==============================
+
+The approximate modes never change an integer result by more than the
+engine's ``tolerance`` (in meters): when the approximation is within its
+error bound of a whole meter that would push the result further than
+that, the point is recomputed with the exact geodesic. With the default
+tolerance of 0 the results are identical to the geodesic mode, so fee
+bands never flip. Points further apart than ``MAX_APPROXIMATE_DISTANCE``
+are always computed exactly.
+"""
+import math
+
+import numpy as np
+from geographiclib.geodesic import Geodesic
+
+# WGS-84 ellipsoid, as used by geopy's geodesic.
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+MAX_APPROXIMATE_DISTANCE = 200_000
+
+_geodesic = Geodesic.WGS84
+
+
+def geodesic_meters(lat1, lon1, lat2, lon2):
+    """
+    Exact geodesic distance, as computed by geopy but without building a geopy object.
+    :return: Distance in meters (float)
+    """
+    return _geodesic.Inverse(lat1, lon1, lat2, lon2, Geodesic.DISTANCE)['s12']
+
+
+def lambert_meters(lat1, lon1, lat2, lon2):
+    """
+    Lambert's formula for long lines on the ellipsoid.
+    :return: Distance in meters (float)
+    """
+    f = WGS84_F
+    beta1 = math.atan((1 - f) * math.tan(math.radians(lat1)))
+    beta2 = math.atan((1 - f) * math.tan(math.radians(lat2)))
+    h = (math.sin((beta2 - beta1) / 2) ** 2
+         + math.cos(beta1) * math.cos(beta2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    if h == 0:
+        return 0.0
+    sigma = 2 * math.asin(math.sqrt(min(1.0, h)))
+    p, q = (beta1 + beta2) / 2, (beta2 - beta1) / 2
+    x = (sigma - math.sin(sigma)) * math.sin(p) ** 2 * math.cos(q) ** 2 / math.cos(sigma / 2) ** 2
+    y = (sigma + math.sin(sigma)) * math.cos(p) ** 2 * math.sin(q) ** 2 / math.sin(sigma / 2) ** 2
+    return WGS84_A * (sigma - f / 2 * (x + y))
+
+
+def lambert_meters_array(lat1, lon1, lats, lons):
+    """
+    NumPy version of ``lambert_meters`` from one point to arrays of points.
+    :return: Array of distances in meters
+    """
+    f = WGS84_F
+    beta1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    beta2 = np.arctan((1 - f) * np.tan(np.radians(lats)))
+    h = (np.sin((beta2 - beta1) / 2) ** 2
+         + np.cos(beta1) * np.cos(beta2) * np.sin(np.radians(lons - lon1) / 2) ** 2)
+    sigma = 2 * np.arcsin(np.sqrt(np.minimum(1.0, h)))
+    p, q = (beta1 + beta2) / 2, (beta2 - beta1) / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(sigma / 2) ** 2
+        meters = WGS84_A * (sigma - f / 2 * (x + y))
+    return np.where(h == 0, 0.0, meters)
+
+
+def vincenty_meters_array(lat1, lon1, lats, lons, max_iterations=200):
+    """
+    Vincenty's inverse formula from one point to arrays of points.
+    :return: Array of distances in meters, NaN where the iteration did not
+        converge (nearly antipodal points)
+    """
+    f = WGS84_F
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lats)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+    L = np.radians(lons - lon1)
+    lam = L
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sinLam, cosLam = np.sin(lam), np.cos(lam)
+            sinSigma = np.hypot(cosU2 * sinLam, cosU1 * sinU2 - sinU1 * cosU2 * cosLam)
+            cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLam
+            sigma = np.arctan2(sinSigma, cosSigma)
+            sinAlpha = np.where(sinSigma == 0, 0.0, cosU1 * cosU2 * sinLam / sinSigma)
+            cos2Alpha = 1 - sinAlpha ** 2
+            # Points on the equator have cos2Alpha == 0
+            cos2SigmaM = np.where(cos2Alpha == 0, 0.0, cosSigma - 2 * sinU1 * sinU2 / cos2Alpha)
+            C = f / 16 * cos2Alpha * (4 + f * (4 - 3 * cos2Alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sinAlpha * (
+                sigma + C * sinSigma * (cos2SigmaM + C * cosSigma * (-1 + 2 * cos2SigmaM ** 2))
+            )
+            converged = np.abs(lam - lam_prev) < 1e-12
+            if converged.all():
+                break
+
+        u2 = cos2Alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (
+            cosSigma * (-1 + 2 * cos2SigmaM ** 2)
+            - B / 6 * cos2SigmaM * (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)
+        ))
+        meters = WGS84_B * A * (sigma - deltaSigma)
+    return np.where(converged, meters, np.nan)
+
+
+def _lambert_error(meters):
+    return 2e-6 * meters + 1e-6
+
+
+def _vincenty_error(meters):
+    return 1e-4
+
+
+# mode -> (scalar function, array function, error bound in meters as a function of distance)
+MODES = {
+    'geodesic': (geodesic_meters, None, None),
+    'lambert': (lambert_meters, lambert_meters_array, _lambert_error),
+    'vincenty': (None, vincenty_meters_array, _vincenty_error),
+}
+
+
+class DistanceEngine:
+    """
+    Computes delivery distances in whole meters with a selectable mode.
+
+    ``tolerance`` is the largest difference in meters allowed between the
+    returned distance and the exact geodesic one; see the module docstring.
+    """
+
+    def __init__(self, mode='geodesic', tolerance=0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown distance mode {mode!r}, expected one of {sorted(MODES)}")
+        self.mode = mode
+        self.tolerance = tolerance
+        self._scalar, self._array, self._error = MODES[mode]
+
+    def distance(self, coord1, coord2):
+        """
+        Calculate the distance between two coordinates.
+        :param coord1: Tuple (latitude, longitude)
+        :param coord2: Tuple (latitude, longitude)
+        :return: Distance in meters (int)
+        """
+        if self._scalar is None:
+            return self.distances(coord1, [coord2])[0]
+        meters = self._scalar(coord1[0], coord1[1], coord2[0], coord2[1])
+        if self._error is not None and not self._scalar_within_tolerance(meters):
+            meters = geodesic_meters(coord1[0], coord1[1], coord2[0], coord2[1])
+        return int(meters)
+
+    def distances(self, origin, points):
+        """
+        Calculate the distances from one coordinate to many.
+        :param origin: Tuple (latitude, longitude)
+        :param points: Sequence of (latitude, longitude) tuples
+        :return: List of distances in meters (int)
+        """
+        if not len(points):
+            return []
+        if self._array is None:
+            return [self.distance(origin, point) for point in points]
+        coords = np.asarray(points, dtype=float).reshape(-1, 2)
+        meters = self._array(origin[0], origin[1], coords[:, 0], coords[:, 1])
+        exact = ~self._within_tolerance(meters)
+
+        distances = np.where(exact, 0, meters).astype(int).tolist()
+        for index in np.flatnonzero(exact):
+            distances[index] = int(geodesic_meters(origin[0], origin[1], coords[index, 0], coords[index, 1]))
+        return distances
+
+    def _scalar_within_tolerance(self, meters):
+        """
+        Whether truncating the approximate distance is guaranteed to land within
+        ``tolerance`` meters of the truncated exact distance.
+        """
+        error = self._error(meters)
+        whole = math.floor(meters)
+        return (meters <= MAX_APPROXIMATE_DISTANCE
+                and math.floor(meters + error) - whole <= self.tolerance
+                and whole - math.floor(meters - error) <= self.tolerance)
+
+    def _within_tolerance(self, meters):
+        """Array version of ``_scalar_within_tolerance``; NaN is never within tolerance."""
+        error = self._error(meters)
+        with np.errstate(invalid='ignore'):
+            whole = np.floor(meters)
+            return ((meters <= MAX_APPROXIMATE_DISTANCE)
+                    & (np.floor(meters + error) - whole <= self.tolerance)
+                    & (whole - np.floor(meters - error) <= self.tolerance))
@@ -0,0 +1,142 @@
+"""
+Per-venue index of delivery distance bands over a grid of user locations.
+
+User coordinates are quantized into cells of ``cell_size`` degrees. The first
+quote in a cell computes the exact distance from the cell's center to the
+venue; by the triangle inequality every point of the cell is within the
+cell's half-extent of that distance, which classifies the cell as
+
+- out of range: every point is further than the venue delivers, so quotes are
+  rejected without computing a distance;
+- in band ``i``: every point falls in distance range ``i``, so quotes skip the
+  range lookup and use the fast distance engine;
+- straddling: the cell crosses a range boundary or the maximum distance, so
+  quotes take the exact path.
+
+Quotes report the delivery distance and fees grow with it, so in-range cells
+still compute a distance; the fast engine returns the same whole meters as the
+geodesic (see dopc/distance.py). Cells are classified lazily, each venue keeps
+at most ``max_cells`` of them (about 80 bytes each) and at most
+``max_venues`` venues are indexed. A venue's cells are discarded when its
+location or pricing changes.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+from .distance import geodesic_meters
+
+OUT_OF_RANGE = -1
+STRADDLES = -2
+
+# Upper bound of the length of one degree of latitude, and of longitude at the
+# equator, on the WGS-84 ellipsoid, in meters.
+_METERS_PER_DEGREE = 111_700
+
+
+class VenueDistanceBands:
+    """Distance bands of the cells around one venue."""
+
+    __slots__ = ('venue', 'cell_size', 'max_cells', 'margin', '_cells')
+
+    def __init__(self, venue, cell_size, max_cells, margin=0):
+        """
+        :param venue: Tuple ((latitude, longitude), PricingTable)
+        :param cell_size: Cell edge in degrees
+        :param max_cells: Maximum number of classified cells kept
+        :param margin: Meters added to the extent of every cell, to cover the
+            tolerance of the distance engine used for in-band quotes
+        """
+        self.venue = venue
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.margin = margin
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._cells)
+
+    def band(self, latitude, longitude):
+        """
+        :return: Index of the distance range of every point in the cell, OUT_OF_RANGE or STRADDLES
+        """
+        row = math.floor(latitude / self.cell_size)
+        column = math.floor(longitude / self.cell_size)
+        key = row << 32 | column & 0xFFFFFFFF
+        band = self._cells.get(key)
+        if band is None:
+            # Once the venue's budget is spent, new cells take the exact path
+            # rather than paying for a classification that is not kept.
+            if len(self._cells) >= self.max_cells:
+                return STRADDLES
+            band = self._cells[key] = self._classify(row, column)
+        return band
+
+    def _classify(self, row, column):
+        (venue_latitude, venue_longitude), pricing = self.venue
+        size = self.cell_size
+        south, north = row * size, (row + 1) * size
+        center = geodesic_meters(venue_latitude, venue_longitude, (south + north) / 2, (column + 0.5) * size)
+
+        # Any point of the cell is reached from its center along a meridian
+        # and then a parallel no longer than the cell's edges there.
+        widest = 1.0 if south <= 0 <= north else math.cos(math.radians(min(abs(south), abs(north))))
+        radius = size / 2 * _METERS_PER_DEGREE * (1 + widest) + 1 + self.margin
+        nearest = max(0, math.floor(center - radius))
+        furthest = math.floor(center + radius)
+
+        if nearest > pricing.max_distance:
+            return OUT_OF_RANGE
+        if furthest > pricing.max_distance:
+            return STRADDLES
+        index = pricing.range_index(nearest)
+        if (index is None or nearest < pricing.range_mins[index]
+                or (pricing.range_maxs[index] != 0 and furthest >= pricing.range_maxs[index])):
+            return STRADDLES
+        return index
+
+
+class DistanceIndex:
+    """
+    Distance bands of the most recently quoted venues, built lazily per venue.
+
+    Safe to use from any thread; concurrent first quotes in a cell may both
+    classify it, with the same result.
+    """
+
+    def __init__(self, cell_size=0.0005, max_cells=4096, max_venues=256, margin=0):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.max_venues = max_venues
+        self.margin = margin
+        self._venues = OrderedDict()  # venue_slug -> VenueDistanceBands
+        self._lock = threading.Lock()
+
+    def band(self, venue_slug, venue, latitude, longitude):
+        """
+        :param venue_slug: Venue slug identifier
+        :param venue: Tuple ((latitude, longitude), PricingTable) the quote is priced with
+        :return: Index of the distance range of the user's cell, OUT_OF_RANGE or STRADDLES
+        """
+        with self._lock:
+            bands = self._venues.get(venue_slug)
+            if bands is None or bands.venue != venue:
+                bands = self._venues[venue_slug] = VenueDistanceBands(
+                    venue, self.cell_size, self.max_cells, self.margin)
+            # Reloads of unchanged venue data keep the cells
+            bands.venue = venue
+            self._venues.move_to_end(venue_slug)
+            while len(self._venues) > self.max_venues:
+                self._venues.popitem(last=False)
+        return bands.band(latitude, longitude)
+
+    def clear(self):
+        with self._lock:
+            self._venues.clear()
+
+    def cells(self):
+        """
+        :return: Total number of classified cells held
+        """
+        with self._lock:
+            return sum(len(bands) for bands in self._venues.values())
@@ -0,0 +1,46 @@
+"""
+JSON encoding of API responses.
+
+``orjson`` is used when it is installed; otherwise the standard library
+encoder produces the same compact UTF-8 output. Both backends take the plain
+dicts, lists, strings and numbers the views build, and return bytes ready to
+be sent.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def _orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # orjson only encodes 64-bit integers; huge cart values are valid input
+        return _json_dumps(obj)
+
+
+BACKENDS = {'json': (_json_dumps, json.loads)}
+if orjson is not None:
+    BACKENDS['orjson'] = (_orjson_dumps, orjson.loads)
+
+
+def get_backend(name='auto'):
+    """
+    :param name: 'orjson', 'json', or 'auto' for orjson when it is installed
+    :return: Tuple (dumps, loads); dumps returns bytes, loads accepts bytes or str
+        and raises ValueError on invalid JSON
+    :raises ValueError: If the backend is unknown or not installed
+    """
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"JSON backend {name!r} is not available, expected one of {sorted(BACKENDS)}")
@@ -0,0 +1,164 @@
+"""
+Broadcast of venue invalidations to every worker process.
+
+A message is a dict, either ``{'venue_slugs': [...]}`` to evict some venues or
+``{'version': stamp}`` to evict every venue loaded before a new version of the
+venue data. Subscribers receive None when messages may have been lost, and
+should then evict everything.
+"""
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class LocalPublisher:
+    """Delivers messages to the subscribers of this process only, for single-process deployments and tests."""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """
+        :param callback: Called with each message, or None when messages were lost
+        """
+        self._subscribers.append(callback)
+
+    def publish(self, message):
+        self._deliver(message)
+
+    def poll(self):
+        """Deliver messages published by other processes; nothing to do locally."""
+
+    async def apoll(self):
+        """Async version of ``poll``."""
+
+    def reset(self):
+        """Forget what was read so far; nothing to do locally."""
+
+    def _deliver(self, message):
+        for callback in self._subscribers:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("Venue invalidation subscriber failed")
+
+
+class CachePublisher(LocalPublisher):
+    """
+    Broadcast through a Django cache shared by every worker process.
+
+    Messages are appended to a numbered log in the cache and delivered to the
+    publishing process right away. Other processes read the log from ``poll``,
+    which is called on their request path and reads the cache at most every
+    ``poll_interval`` seconds, so they apply an invalidation within that
+    interval; async callers use ``apoll``, which keeps the event loop free
+    while the cache is read. A process that finds a gap in the log, because messages expired
+    or the cache was cleared, reports the loss with None.
+    """
+
+    SEQUENCE_KEY = 'dopc:invalidation:sequence'
+
+    def __init__(self, alias, poll_interval=1.0, message_ttl=3600, clock=time.monotonic):
+        """
+        :param alias: Alias of the shared cache in settings.CACHES
+        :param poll_interval: Seconds between reads of the log
+        :param message_ttl: Seconds messages are kept in the log
+        """
+        super().__init__()
+        self.alias = alias
+        self.poll_interval = poll_interval
+        self.message_ttl = message_ttl
+        self._clock = clock
+        self._seen = None  # Sequence number of the last message read from the log
+        self._polled_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def message_key(sequence):
+        return f'dopc:invalidation:{sequence}'
+
+    def publish(self, message):
+        try:
+            self.cache.add(self.SEQUENCE_KEY, 0, None)
+            sequence = self.cache.incr(self.SEQUENCE_KEY)
+            self.cache.set(self.message_key(sequence), message, self.message_ttl)
+        except Exception as exc:
+            logger.warning("Unable to broadcast venue invalidation: %s", exc)
+        else:
+            with self._lock:
+                # Skip our own message when reading the log, unless others came first
+                if self._seen == sequence - 1:
+                    self._seen = sequence
+        self._deliver(message)
+
+    def reset(self):
+        """Start reading the log again from its current end."""
+        with self._lock:
+            self._seen = None
+            self._polled_at = None
+
+    def poll(self):
+        seen = self._start_poll()
+        if seen is False:
+            return
+        try:
+            sequence = self.cache.get(self.SEQUENCE_KEY, 0)
+            keys = self._message_keys(seen, sequence)
+            found = self.cache.get_many(keys) if keys else {}
+        except Exception as exc:
+            logger.warning("Unable to read venue invalidations: %s", exc)
+            return
+        self._finish_poll(seen, sequence, keys, found)
+
+    async def apoll(self):
+        seen = self._start_poll()
+        if seen is False:
+            return
+        try:
+            sequence = await self.cache.aget(self.SEQUENCE_KEY, 0)
+            keys = self._message_keys(seen, sequence)
+            found = await self.cache.aget_many(keys) if keys else {}
+        except Exception as exc:
+            logger.warning("Unable to read venue invalidations: %s", exc)
+            return
+        self._finish_poll(seen, sequence, keys, found)
+
+    def _start_poll(self):
+        """
+        Claim the next read of the log, so concurrent callers skip it. The cache
+        is read without the lock held.
+        :return: The sequence number of the last message read, or False if a read is not due
+        """
+        now = self._clock()
+        with self._lock:
+            if self._polled_at is not None and now - self._polled_at < self.poll_interval:
+                return False
+            self._polled_at = now
+            return self._seen
+
+    def _message_keys(self, seen, sequence):
+        if seen is None or sequence < seen:
+            # Start from the current end of the log, or from its restart if the
+            # cache was cleared.
+            return []
+        return [self.message_key(number) for number in range(seen + 1, sequence + 1)]
+
+    def _finish_poll(self, seen, sequence, keys, found):
+        with self._lock:
+            if self._seen != seen:
+                # Reset or published to meanwhile; the next read starts from there
+                return
+            self._seen = sequence
+        if len(found) < len(keys) or (seen is not None and sequence < seen):
+            self._deliver(None)
+        for key in keys:
+            if key in found:
+                self._deliver(found[key])
@@ -0,0 +1,83 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dopc.snapshots import flush_snapshots
+from dopc.utils import UpstreamError, refresh_venue
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch and compile venue data ahead of traffic so the first quotes never wait on the "
+        "venue API. Venue slugs are read one per line from a file or stdin."
+    )
+    stealth_options = ('stdin',)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'slug_file', nargs='?', default='-',
+            help="File with one venue slug per line, or '-' for stdin (default).",
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help="Maximum number of venues fetched at the same time (default 8).",
+        )
+        parser.add_argument(
+            '--max-failure-rate', type=float, default=0.1,
+            help="Exit with an error if a larger fraction of venues fails (default 0.1).",
+        )
+
+    def handle(self, *args, **options):
+        venue_slugs = self.read_slugs(options['slug_file'], options.get('stdin') or sys.stdin)
+        if not venue_slugs:
+            raise CommandError("No venue slugs given")
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(self.prewarm, venue_slugs))
+        flush_snapshots()
+        elapsed = time.perf_counter() - started
+
+        failures = 0
+        for venue_slug, error, duration in results:
+            if error:
+                failures += 1
+                self.stderr.write(f"{venue_slug}: FAILED in {duration * 1000:.0f} ms ({error})")
+            else:
+                self.stdout.write(f"{venue_slug}: ok in {duration * 1000:.0f} ms")
+        summary = f"Prewarmed {len(results) - failures}/{len(results)} venues in {elapsed:.2f} s"
+
+        if failures > options['max_failure_rate'] * len(results):
+            raise CommandError(f"{summary}; too many failures")
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def read_slugs(self, slug_file, stdin):
+        """
+        Read unique venue slugs, skipping blank lines and # comments.
+        """
+        if slug_file == '-':
+            lines = stdin.read().splitlines()
+        else:
+            try:
+                with open(slug_file) as file:
+                    lines = file.read().splitlines()
+            except OSError as exc:
+                raise CommandError(f"Unable to read {slug_file}: {exc}")
+        venue_slugs = (line.strip() for line in lines)
+        return list(dict.fromkeys(slug for slug in venue_slugs if slug and not slug.startswith('#')))
+
+    def prewarm(self, venue_slug):
+        """
+        Load one venue into the caches and the snapshot store.
+        :return: Tuple (venue_slug, error or None, seconds taken)
+        """
+        started = time.perf_counter()
+        try:
+            error = None if refresh_venue(venue_slug) else "venue not found or invalid"
+        except UpstreamError:
+            error = "venue API unavailable"
+        return venue_slug, error, time.perf_counter() - started
@@ -0,0 +1,85 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dopc.bulk import FORMATS, price_stream
+from dopc.utils import batch_distance_engine
+
+
+class Command(BaseCommand):
+    help = (
+        "Price orders in bulk with the same logic as the price endpoint. Orders are read as "
+        "NDJSON or CSV from a file or stdin and written with their prices in the same format."
+    )
+    stealth_options = ('stdin',)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input', nargs='?', default='-',
+            help="File with one order per row, or '-' for stdin (default).",
+        )
+        parser.add_argument(
+            '--output', '-o', default='-',
+            help="File to write the priced orders to, or '-' for stdout (default).",
+        )
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help="Format of the input and output (default: from the input file extension, else ndjson).",
+        )
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help="Number of worker processes (default: one per CPU; 1 prices in this process).",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help="Number of orders sent to a worker at a time (default 5000).",
+        )
+        parser.add_argument(
+            '--retries', type=int, default=3,
+            help="Times a venue the venue API failed to serve is fetched again (default 3).",
+        )
+        parser.add_argument(
+            '--retry-backoff', type=float, default=1.0,
+            help="Seconds before the first retry, doubled for every further one (default 1).",
+        )
+
+    def handle(self, *args, **options):
+        if options['processes'] is not None and options['processes'] < 1:
+            raise CommandError("--processes must be at least 1")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        if options['retries'] < 0:
+            raise CommandError("--retries must be at least 0")
+        input_path = options['input']
+        input_format = options['format'] or ('csv' if input_path.endswith('.csv') else 'ndjson')
+
+        try:
+            input_file = (options.get('stdin') or sys.stdin) if input_path == '-' else open(input_path, newline='')
+            output_file = self.stdout if options['output'] == '-' else open(options['output'], 'w', newline='')
+        except OSError as exc:
+            raise CommandError(f"Unable to open {exc.filename}: {exc.strerror}")
+
+        started = time.perf_counter()
+        try:
+            stats = price_stream(
+                input_file, output_file, input_format,
+                processes=options['processes'], chunk_size=options['chunk_size'], engine=batch_distance_engine,
+                retries=options['retries'], retry_backoff=options['retry_backoff'],
+            )
+        finally:
+            for file in (input_file, output_file):
+                if file not in (sys.stdin, options.get('stdin'), self.stdout):
+                    file.close()
+        elapsed = time.perf_counter() - started
+
+        summary = (
+            f"Priced {stats['rows']} orders ({stats['errors']} with errors) for {stats['venues']} venues "
+            f"in {elapsed:.2f} s ({stats['rows'] / elapsed if elapsed else 0:.0f} orders/s)"
+        )
+        if stats['failed_venues']:
+            raise CommandError(
+                f"{summary}; the venue API failed to serve {len(stats['failed_venues'])} venues, "
+                f"whose orders were not priced: {', '.join(stats['failed_venues'])}"
+            )
+        self.stderr.write(summary, style_func=self.style.SUCCESS)
@@ -0,0 +1,254 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from inspect import iscoroutinefunction
+
+# Upper bounds in seconds, from a cached quote to a slow venue API call.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Stage timings of the current request, or None outside an instrumented view.
+# Context variables are per thread and per async task, so requests never mix.
+_request_timings = ContextVar('dopc_request_timings', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def samples(self):
+        """
+        :return: List of (name suffix, label names, label values, value)
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        return [('_total', self.labelnames, labelvalues, value) for labelvalues, value in values]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations per combination of label values."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labelvalues -> [counts per bucket and +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labelvalues):
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        """
+        :return: List of (name suffix, label names, label values, value)
+        """
+        with self._lock:
+            values = sorted((labelvalues, list(counts), total)
+                            for labelvalues, (counts, total) in self._values.items())
+        samples = []
+        bucket_labels = self.labelnames + ('le',)
+        for labelvalues, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', bucket_labels, labelvalues + (_format_value(bound),), cumulative))
+            samples.append(('_sum', self.labelnames, labelvalues, total))
+            samples.append(('_count', self.labelnames, labelvalues, cumulative))
+        return samples
+
+
+class CallbackMetric:
+    """A counter or gauge read from ``callback`` at scrape time."""
+
+    def __init__(self, name, documentation, type, labelnames, callback):
+        """
+        :param callback: Function returning a dict mapping a tuple of label values to a value
+        """
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        suffix = '_total' if self.type == 'counter' else ''
+        return [(suffix, self.labelnames, labelvalues, value)
+                for labelvalues, value in sorted(self.callback().items())]
+
+
+class Registry:
+    """
+    Metrics of this process, rendered in the Prometheus text exposition format.
+
+    Updates take a per-metric lock, so they are safe from any thread or async task.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, type, labelnames, callback):
+        return self.register(CallbackMetric(name, documentation, type, labelnames, callback))
+
+    def render(self):
+        """
+        :return: Every metric in the Prometheus text format, version 0.0.4
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labelnames, labelvalues, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labelnames, labelvalues)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    'dopc_stage_seconds', "Time spent in each stage of a quote.", ('view', 'stage'))
+request_seconds = registry.histogram(
+    'dopc_request_seconds', "Time spent in each view.", ('view',))
+responses = registry.counter(
+    'dopc_responses', "Responses by view and status code.", ('view', 'status'))
+upstream_seconds = registry.histogram(
+    'dopc_upstream_request_seconds', "Duration of venue API requests.", ('endpoint',))
+upstream_errors = registry.counter(
+    'dopc_upstream_errors', "Failed venue API requests.", ('endpoint', 'reason'))
+
+
+class timed:
+    """
+    Context manager timing a stage of the current request.
+
+    The duration is recorded in ``dopc_stage_seconds`` and, inside an
+    instrumented view, added to the request's Server-Timing entries.
+    """
+
+    __slots__ = ('stage', 'started')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.started
+        timings = _request_timings.get()
+        if timings is None:
+            stage_seconds.observe(duration, '', self.stage)
+        else:
+            timings[1].append((self.stage, duration))
+            stage_seconds.observe(duration, timings[0], self.stage)
+
+
+def _server_timing(timings, total):
+    entries = [f"{stage};dur={duration * 1000:.3f}" for stage, duration in timings]
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ', '.join(entries)
+
+
+def instrument(view_name, server_timing=False):
+    """
+    Decorate a sync or async view to record its duration, stages and status codes.
+    :param view_name: Value of the ``view`` label
+    :param server_timing: Add a Server-Timing header with the stage durations to every response
+    """
+    def finish(response, timings, started):
+        total = time.perf_counter() - started
+        request_seconds.observe(total, view_name)
+        responses.inc(view_name, str(response.status_code))
+        if server_timing:
+            response['Server-Timing'] = _server_timing(timings, total)
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(*args, **kwargs):
+                timings = []
+                token = _request_timings.set((view_name, timings))
+                started = time.perf_counter()
+                try:
+                    response = await view(*args, **kwargs)
+                finally:
+                    _request_timings.reset(token)
+                return finish(response, timings, started)
+        else:
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                timings = []
+                token = _request_timings.set((view_name, timings))
+                started = time.perf_counter()
+                try:
+                    response = view(*args, **kwargs)
+                finally:
+                    _request_timings.reset(token)
+                return finish(response, timings, started)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,101 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+
+from .admission import HIGH, LOW, AdmissionController
+from .encoding import get_backend
+from .metrics import registry
+from .utils import venue_is_cached
+
+OVERLOADED = 'Server is overloaded'
+
+_admission_settings = getattr(settings, 'DOPC_ADMISSION', {})
+
+# One controller per process, shared by every handler the middleware is loaded in.
+controller = None
+if _admission_settings.get('ENABLED', True):
+    controller = AdmissionController(
+        max_concurrency=_admission_settings.get('MAX_CONCURRENCY', 64),
+        max_queue=_admission_settings.get('MAX_QUEUE', 128),
+        queue_timeout=_admission_settings.get('QUEUE_TIMEOUT', 0.5),
+        prioritize=_admission_settings.get('PRIORITIZE_CACHED', True),
+    )
+    registry.callback(
+        'dopc_admission_in_flight', "Requests admitted by admission control and still running.", 'gauge',
+        (), lambda: {(): controller.stats()['in_flight']},
+    )
+    registry.callback(
+        'dopc_admission_queued', "Requests waiting for admission, by priority.", 'gauge',
+        ('priority',), lambda: {(priority,): queued for priority, queued in controller.stats()['queued'].items()},
+    )
+    registry.callback(
+        'dopc_admission_shed', "Requests turned away by admission control, by reason.", 'counter',
+        ('reason',), lambda: {(reason,): shed for reason, shed in controller.stats()['shed'].items()},
+    )
+
+_paths = tuple(_admission_settings.get('PATHS', ('/api/v1/delivery-order-price',)))
+_status = _admission_settings.get('STATUS', 503)
+_retry_after = str(_admission_settings.get('RETRY_AFTER', 1))
+dumps, _ = get_backend(getattr(settings, 'DOPC_JSON', {}).get('BACKEND', 'auto'))
+_overloaded_body = dumps({'error': OVERLOADED})
+
+
+def _priority(request):
+    """
+    Quotes for venues held in process are served first, as they do not wait on the venue API.
+    """
+    if not controller.prioritize:
+        return LOW
+    return HIGH if venue_is_cached(request.GET.get('venue_slug')) else LOW
+
+
+def _shed_response():
+    response = HttpResponse(_overloaded_body, status=_status, content_type='application/json')
+    response['Retry-After'] = _retry_after
+    return response
+
+
+class AdmissionMiddleware:
+    """
+    Limit the quote requests each process handles at once (``DOPC_ADMISSION``).
+
+    Requests to the configured paths wait for a slot of the process's
+    ``AdmissionController``; requests it sheds are answered at once with
+    ``{"error": "Server is overloaded"}``, the configured status and a
+    Retry-After header. Other paths are passed through. Works under both
+    WSGI and ASGI handlers.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if controller is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not request.path.startswith(_paths):
+            return self.get_response(request)
+        if controller.acquire(_priority(request)):
+            return _shed_response()
+        try:
+            return self.get_response(request)
+        finally:
+            controller.release()
+
+    async def __acall__(self, request):
+        if not request.path.startswith(_paths):
+            return await self.get_response(request)
+        if await controller.aacquire(_priority(request)):
+            return _shed_response()
+        try:
+            return await self.get_response(request)
+        finally:
+            controller.release()
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-17 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VenueSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('venue_slug', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('static', 'Static'), ('dynamic', 'Dynamic')], max_length=7)),
+                ('payload', models.JSONField()),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fetched_at'], name='dopc_venues_fetched_e4db3f_idx')],
+                'constraints': [models.UniqueConstraint(fields=('venue_slug', 'kind'), name='unique_venue_snapshot')],
+            },
+        ),
+    ]
@@ -1,3 +1,32 @@
 from django.db import models
 
-# Create your models here.
+
+class VenueSnapshot(models.Model):
+    """
+    Last known upstream payload for the static or dynamic half of a venue's data.
+
+    Snapshots let a freshly started worker serve venues immediately, and keep
+    venues available while the venue API is down.
+    """
+    STATIC = 'static'
+    DYNAMIC = 'dynamic'
+    KIND_CHOICES = [
+        (STATIC, 'Static'),
+        (DYNAMIC, 'Dynamic'),
+    ]
+
+    venue_slug = models.CharField(max_length=255)
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES)
+    payload = models.JSONField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['venue_slug', 'kind'], name='unique_venue_snapshot'),
+        ]
+        indexes = [
+            models.Index(fields=['fetched_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.venue_slug} ({self.kind})"
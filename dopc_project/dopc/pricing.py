@@ -0,0 +1,127 @@
+import weakref
+from bisect import bisect_right
+from dataclasses import dataclass
+
+
+class PricingSpecError(ValueError):
+    """Raised when a venue's delivery specs cannot be compiled."""
+
+
+@dataclass(frozen=True, slots=True, weakref_slot=True)
+class PricingTable:
+    """
+    A venue's delivery pricing, validated and compiled once per load of its dynamic data.
+
+    ``range_mins`` is sorted, so the distance range for a delivery is found with
+    a bisect instead of a scan over the raw ``distance_ranges``. Venues with the
+    same delivery specs share one table (see ``compile_pricing``).
+    """
+    base_price: int
+    order_minimum: int
+    max_distance: int
+    range_mins: tuple
+    range_maxs: tuple
+    range_a: tuple
+    range_b: tuple
+    # Index of the open-ended range (max == 0), which also prices distances
+    # falling in gaps between ranges, or None.
+    open_range: int
+
+    def delivery_fee(self, delivery_distance):
+        """
+        Calculate the delivery fee for a distance.
+        :param delivery_distance: Delivery distance in meters
+        :return: Delivery fee, or None if no range covers the distance
+        """
+        index = self.range_index(delivery_distance)
+        return None if index is None else self.range_fee(index, delivery_distance)
+
+    def range_index(self, delivery_distance):
+        """
+        :param delivery_distance: Delivery distance in meters
+        :return: Index of the distance range pricing the distance, or None if no range covers it
+        """
+        index = bisect_right(self.range_mins, delivery_distance) - 1
+        if index < 0 or (delivery_distance >= self.range_maxs[index] and self.range_maxs[index] != 0):
+            return self.open_range
+        return index
+
+    def range_fee(self, index, delivery_distance):
+        """
+        :param index: Index of the distance range, as returned by ``range_index``
+        :param delivery_distance: Delivery distance in meters
+        :return: Delivery fee
+        """
+        return self.base_price + self.range_a[index] + round(self.range_b[index] * delivery_distance / 10)
+
+    def delivery_specs(self):
+        """
+        :return: The ``delivery_specs`` of the venue's dynamic data this table was compiled from
+        """
+        return {
+            'order_minimum_no_surcharge': self.order_minimum,
+            'delivery_pricing': {
+                'base_price': self.base_price,
+                'distance_ranges': [
+                    {'min': min_, 'max': max_, 'a': a, 'b': b}
+                    for min_, max_, a, b in zip(self.range_mins, self.range_maxs, self.range_a, self.range_b)
+                ],
+            },
+        }
+
+
+# Tables of the delivery specs in use, keyed by their numbers and types. Most
+# venues of a city share a handful of specs, so each worker holds one table per
+# distinct spec rather than one per venue.
+_tables = weakref.WeakValueDictionary()
+
+
+def compile_pricing(dynamic_data):
+    """
+    Compile the delivery specs of a venue's dynamic data into a PricingTable.
+    :param dynamic_data: Dynamic venue data
+    :return: PricingTable
+    :raises PricingSpecError: If the specs are missing, mistyped, unsorted or overlapping
+    """
+    try:
+        delivery_specs = dynamic_data['venue_raw']['delivery_specs']
+        order_minimum = delivery_specs['order_minimum_no_surcharge']
+        base_price = delivery_specs['delivery_pricing']['base_price']
+        distance_ranges = delivery_specs['delivery_pricing']['distance_ranges']
+        ranges = [(range_['min'], range_['max'], range_['a'], range_['b']) for range_ in distance_ranges]
+    except (KeyError, TypeError) as exc:
+        raise PricingSpecError(f"Incomplete delivery specs: {exc!r}") from exc
+
+    numbers = [order_minimum, base_price] + [value for range_ in ranges for value in range_]
+    if any(isinstance(value, bool) or not isinstance(value, (int, float)) for value in numbers):
+        raise PricingSpecError("Delivery specs must be numeric")
+    if not ranges:
+        raise PricingSpecError("Delivery specs have no distance ranges")
+    # 1 and 1.0 price alike but are encoded differently in responses
+    key = tuple((type(value), value) for value in numbers)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+
+    open_range = None
+    for index, (min_, max_, a, b) in enumerate(ranges):
+        if min_ < 0 or (max_ != 0 and max_ <= min_):
+            raise PricingSpecError(f"Distance range {index} is empty or negative")
+        if max_ == 0:
+            if index != len(ranges) - 1:
+                raise PricingSpecError("Only the last distance range may be open-ended")
+            open_range = index
+        if index and min_ < ranges[index - 1][1]:
+            raise PricingSpecError(f"Distance range {index} is unsorted or overlaps the previous one")
+
+    table = PricingTable(
+        base_price=base_price,
+        order_minimum=order_minimum,
+        max_distance=ranges[-1][0],
+        range_mins=tuple(range_[0] for range_ in ranges),
+        range_maxs=tuple(range_[1] for range_ in ranges),
+        range_a=tuple(range_[2] for range_ in ranges),
+        range_b=tuple(range_[3] for range_ in ranges),
+        open_range=open_range,
+    )
+    return _tables.setdefault(key, table)
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Short-lived LRU cache of encoded price responses.
+
+    Keys are the normalized request parameters with coordinates rounded to
+    ``precision`` decimals, so retries and polls of the same quote share an
+    entry. Each entry remembers the version of the venue data it was priced
+    with and is ignored once the venue's location or pricing changes.
+    """
+
+    def __init__(self, ttl, precision=6, max_entries=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.precision = precision
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (version, content, status, expires_at)
+        self._lock = threading.Lock()
+
+    def key(self, venue_slug, cart_value, user_lat, user_lon):
+        return venue_slug, cart_value, round(user_lat, self.precision), round(user_lon, self.precision)
+
+    def get(self, key, version):
+        """
+        :param key: Result of ``key``
+        :param version: Venue data the response must have been priced with, compared with ==
+        :return: Tuple (content, status), or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[3] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+            return None
+
+    def set(self, key, version, content, status):
+        with self._lock:
+            self._entries[key] = (version, content, status, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: Dict with the hit and miss counters and the number of entries
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
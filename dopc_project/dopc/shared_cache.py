@@ -0,0 +1,211 @@
+import json
+import logging
+import time
+import zlib
+from hashlib import sha1
+from urllib.parse import quote
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+def _pack(payload):
+    """
+    Serialize a payload as compressed compact JSON, stamped with the fetch time.
+    """
+    return time.time(), zlib.compress(json.dumps(payload, separators=(',', ':')).encode())
+
+
+def _unpack(record):
+    """
+    :return: Tuple (payload, age in seconds)
+    """
+    fetched_at, blob = record
+    return json.loads(zlib.decompress(blob)), time.time() - fetched_at
+
+
+class SharedVenueStore:
+    """
+    Venue payloads shared by every worker process through a Django cache.
+
+    Values are stored per venue and kind (static or dynamic) so each half keeps
+    its own timeout, and both halves of a venue are read with one ``get_many``.
+    Backend errors are logged and treated as misses.
+
+    Keys include the current version stamp of the venue data, so setting a new
+    version makes every stored venue unreachable; old values expire on their own.
+
+    Workers that miss the same venue at the same time coordinate through a
+    lease: the worker that claims it loads the venue from upstream, and the
+    others wait for its result to be stored (see ``dopc.utils._load``).
+    """
+
+    VERSION_KEY = 'dopc:venue:version'
+
+    def __init__(self, alias, timeouts):
+        """
+        :param alias: Alias of the cache in settings.CACHES
+        :param timeouts: Dict mapping kind to the timeout of its values in seconds
+        """
+        self.alias = alias
+        self.timeouts = timeouts
+        self._version = None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def version(self):
+        """The version stamp of the stored venue data, read from the cache once per process."""
+        if self._version is None:
+            try:
+                self._version = self.cache.get(self.VERSION_KEY, '')
+            except Exception as exc:
+                logger.warning("Shared venue cache unavailable: %s", exc)
+                return ''
+        return self._version
+
+    @version.setter
+    def version(self, version):
+        self._version = version
+
+    def set_version(self, version):
+        """Store ``version`` as the current version, read by worker processes when they start."""
+        self._version = version
+        try:
+            self.cache.set(self.VERSION_KEY, version, None)
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+
+    def key(self, kind, venue_slug):
+        slug = quote(str(venue_slug), safe='')
+        if len(slug) > 200:
+            slug = sha1(slug.encode()).hexdigest()
+        version = self.version
+        if version:
+            return f"dopc:venue:{quote(version, safe='')}:{kind}:{slug}"
+        return f"dopc:venue:{kind}:{slug}"
+
+    def lease_key(self, kind, venue_slug):
+        return f"{self.key(kind, venue_slug)}:lease"
+
+    def lease(self, kind, venue_slug, timeout):
+        """
+        Claim the upstream load of one half of a venue for up to ``timeout`` seconds.
+        :return: True if claimed, or if the cache is unavailable; False if another worker holds it
+        """
+        try:
+            return self.cache.add(self.lease_key(kind, venue_slug), 1, timeout)
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+            return True
+
+    def release(self, kind, venue_slug):
+        try:
+            self.cache.delete(self.lease_key(kind, venue_slug))
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+
+    def get_leased(self, kind, venue_slug):
+        """
+        Read one half of a venue and whether its lease is held, in one round trip.
+        :return: Tuple (record or None, leased); a record is (payload, age in seconds)
+        """
+        key, lease_key = self.key(kind, venue_slug), self.lease_key(kind, venue_slug)
+        try:
+            records = self.cache.get_many([key, lease_key])
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+            return None, False
+        return (_unpack(records[key]) if key in records else None), lease_key in records
+
+    def get(self, kind, venue_slug):
+        """
+        :return: Tuple (payload, age in seconds), or None
+        """
+        try:
+            record = self.cache.get(self.key(kind, venue_slug))
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+            return None
+        return _unpack(record) if record else None
+
+    def get_many(self, venue_slugs):
+        """
+        Read both halves of several venues in one round trip.
+        :return: Dict mapping (kind, venue_slug) to a tuple (payload, age in seconds)
+        """
+        keys = {self.key(kind, venue_slug): (kind, venue_slug)
+                for venue_slug in venue_slugs for kind in self.timeouts}
+        try:
+            records = self.cache.get_many(list(keys))
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+            return {}
+        return {keys[key]: _unpack(record) for key, record in records.items()}
+
+    def set(self, kind, venue_slug, payload):
+        try:
+            self.cache.set(self.key(kind, venue_slug), _pack(payload), self.timeouts[kind])
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+
+    def delete(self, kind, venue_slug):
+        try:
+            self.cache.delete(self.key(kind, venue_slug))
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+
+    async def aget(self, kind, venue_slug):
+        """Async version of ``get``."""
+        try:
+            record = await self.cache.aget(self.key(kind, venue_slug))
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+            return None
+        return _unpack(record) if record else None
+
+    async def aget_many(self, venue_slugs):
+        """Async version of ``get_many``."""
+        keys = {self.key(kind, venue_slug): (kind, venue_slug)
+                for venue_slug in venue_slugs for kind in self.timeouts}
+        try:
+            records = await self.cache.aget_many(list(keys))
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+            return {}
+        return {keys[key]: _unpack(record) for key, record in records.items()}
+
+    async def alease(self, kind, venue_slug, timeout):
+        """Async version of ``lease``."""
+        try:
+            return await self.cache.aadd(self.lease_key(kind, venue_slug), 1, timeout)
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+            return True
+
+    async def arelease(self, kind, venue_slug):
+        """Async version of ``release``."""
+        try:
+            await self.cache.adelete(self.lease_key(kind, venue_slug))
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+
+    async def aget_leased(self, kind, venue_slug):
+        """Async version of ``get_leased``."""
+        key, lease_key = self.key(kind, venue_slug), self.lease_key(kind, venue_slug)
+        try:
+            records = await self.cache.aget_many([key, lease_key])
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
+            return None, False
+        return (_unpack(records[key]) if key in records else None), lease_key in records
+
+    async def aset(self, kind, venue_slug, payload):
+        """Async version of ``set``."""
+        try:
+            await self.cache.aset(self.key(kind, venue_slug), _pack(payload), self.timeouts[kind])
+        except Exception as exc:
+            logger.warning("Shared venue cache unavailable: %s", exc)
@@ -0,0 +1,83 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import VenueSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Snapshot writes happen off the request path, one at a time.
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dopc-snapshot')
+
+
+def save_snapshot(venue_slug, kind, payload):
+    """
+    Persist the latest payload of a venue in the background.
+    :param venue_slug: Venue slug identifier
+    :param kind: VenueSnapshot.STATIC or VenueSnapshot.DYNAMIC
+    :param payload: Upstream JSON payload
+    :return: Future of the write
+    """
+    return _write_executor.submit(_write_snapshot, venue_slug, kind, payload, timezone.now())
+
+
+def delete_snapshots(venue_slugs=None):
+    """
+    Delete the snapshots of some venues, or of every venue, after the writes queued so far.
+    :param venue_slugs: Iterable of venue slug identifiers, or None for every venue
+    :return: Future of the deletion
+    """
+    venue_slugs = None if venue_slugs is None else list(venue_slugs)
+    return _write_executor.submit(_delete_snapshots, venue_slugs)
+
+
+def flush_snapshots():
+    """Wait until every snapshot queued so far has been written."""
+    _write_executor.submit(lambda: None).result()
+
+
+def _write_snapshot(venue_slug, kind, payload, fetched_at):
+    try:
+        VenueSnapshot.objects.bulk_create(
+            [VenueSnapshot(venue_slug=venue_slug, kind=kind, payload=payload, fetched_at=fetched_at)],
+            update_conflicts=True,
+            unique_fields=['venue_slug', 'kind'],
+            update_fields=['payload', 'fetched_at'],
+        )
+    except DatabaseError as exc:
+        logger.warning("Unable to save %s snapshot of venue %s: %s", kind, venue_slug, exc)
+
+
+def _delete_snapshots(venue_slugs):
+    try:
+        snapshots = VenueSnapshot.objects.all()
+        if venue_slugs is not None:
+            snapshots = snapshots.filter(venue_slug__in=venue_slugs)
+        snapshots.delete()
+    except DatabaseError as exc:
+        logger.warning("Unable to delete venue snapshots: %s", exc)
+
+
+def load_snapshots(max_age, limit):
+    """
+    Load the most recent snapshots in bulk.
+    :param max_age: Ignore snapshots older than this many seconds
+    :param limit: Maximum number of snapshots of each kind
+    :return: Dict mapping kind to a list of (venue_slug, payload, age in seconds), newest first
+    """
+    now = timezone.now()
+    snapshots = {VenueSnapshot.STATIC: [], VenueSnapshot.DYNAMIC: []}
+    try:
+        for kind, rows in snapshots.items():
+            query = (VenueSnapshot.objects
+                     .filter(kind=kind, fetched_at__gte=now - timedelta(seconds=max_age))
+                     .order_by('-fetched_at')
+                     .values_list('venue_slug', 'payload', 'fetched_at')[:limit])
+            rows.extend((venue_slug, payload, (now - fetched_at).total_seconds())
+                        for venue_slug, payload, fetched_at in query)
+    except DatabaseError as exc:
+        logger.warning("Unable to load venue snapshots: %s", exc)
+    return snapshots
@@ -1,5 +1,109 @@
+import asyncio
+import csv
+import importlib.util
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from django.test import Client
+from unittest import mock
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import Client, RequestFactory, TransactionTestCase, override_settings
+from django.utils import timezone
+from dopc_project import settings as project_settings
+from geopy.distance import geodesic
+
+from . import bulk, core, encoding, metrics, middleware, snapshots, utils, views
+from .admission import DISPLACED, HIGH, LOW, QUEUE_FULL, TIMEOUT, AdmissionController
+from .breaker import CircuitBreaker
+from .cache import VenueCache
+from .distance import DistanceEngine, geodesic_meters
+from .distance_index import OUT_OF_RANGE, STRADDLES, DistanceIndex
+from .invalidation import CachePublisher
+from .models import VenueSnapshot
+from .pricing import PricingSpecError, compile_pricing
+from .response_cache import ResponseCache
+from .venue_index import VenueIndex
+
+VENUE_STATIC = {"venue_raw": {"location": {"coordinates": [13.4536149, 52.5003197]}}}
+VENUE_DYNAMIC = {
+    "venue_raw": {
+        "delivery_specs": {
+            "order_minimum_no_surcharge": 1000,
+            "delivery_pricing": {
+                "base_price": 190,
+                "distance_ranges": [
+                    {"min": 0, "max": 500, "a": 0, "b": 0},
+                    {"min": 500, "max": 1000, "a": 100, "b": 0},
+                    {"min": 1000, "max": 1500, "a": 200, "b": 0},
+                    {"min": 1500, "max": 2000, "a": 200, "b": 1},
+                    {"min": 2000, "max": 0, "a": 0, "b": 0},
+                ],
+            },
+        }
+    }
+}
+VENUE = ((52.5003197, 13.4536149), compile_pricing(VENUE_DYNAMIC))
+
+def fake_venue_api(venues=None, delay=0):
+    """
+    Build a stand-in for ``utils.session.get`` serving VENUE_STATIC and VENUE_DYNAMIC for every venue.
+    :param venues: Dict mapping a venue slug to an exception to raise, a status code to
+        answer with, or a dict of the "static" and/or "dynamic" payloads to serve instead;
+        read on every call, so tests can change it
+    :param delay: Seconds every response takes
+    """
+    venues = {} if venues is None else venues
+
+    def get(url, timeout):
+        time.sleep(delay)
+        venue_slug, kind = url.rsplit("/", 2)[-2:]
+        override = venues.get(venue_slug, {})
+        if isinstance(override, (BaseException, type)):
+            raise override
+        if isinstance(override, int):
+            return mock.Mock(status_code=override)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = override.get(kind, VENUE_STATIC if kind == "static" else VENUE_DYNAMIC)
+        return response
+
+    return get
+
+# The venue cache defaults to a file cache shared by the workers of this host
+test_caches = override_settings(CACHES=dict(settings.CACHES, venues={
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'dopc-tests',
+}))
+
+def setUpModule():
+    test_caches.enable()
+
+def tearDownModule():
+    test_caches.disable()
+
+def clear_venue_caches():
+    # Snapshot writes queued by earlier tests would land in the middle of this one
+    snapshots.flush_snapshots()
+    snapshots.delete_snapshots().result()
+    utils.static_cache.clear()
+    utils.dynamic_cache.clear()
+    caches["venues"].clear()
+    for breaker in utils.breakers.values():
+        breaker.reset()
+    if utils.shared_store:
+        utils.shared_store.version = ""
+    utils.invalidations.reset()
+    utils.venue_index.clear()
 
 class dopc_test_cases(unittest.TestCase):
     
@@ -245,5 +349,1470 @@ class dopc_test_cases(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 400)
 
+
+class venue_cache_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.calls = []
+
+    def clock(self):
+        return self.now
+
+    def loader(self, key):
+        self.calls.append(key)
+        return f"{key}-{len(self.calls)}"
+
+    def test_fresh_entry_is_served_from_cache(self):
+        cache = VenueCache(self.loader, ttl=10, clock=self.clock)
+        self.assertEqual(cache.get("a"), "a-1")
+        self.now = 9
+        self.assertEqual(cache.get("a"), "a-1")
+        self.assertEqual(self.calls, ["a"])
+
+    def test_expired_entry_is_reloaded(self):
+        cache = VenueCache(self.loader, ttl=10, clock=self.clock)
+        cache.get("a")
+        self.now = 10
+        self.assertEqual(cache.get("a"), "a-2")
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        cache = VenueCache(self.loader, ttl=10, stale_ttl=5, clock=self.clock)
+        cache.get("a")
+        self.now = 12
+        self.assertEqual(cache.get("a"), "a-1")
+        for _ in range(100):
+            if len(self.calls) == 2 and cache.get("a") == "a-2":
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get("a"), "a-2")
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = VenueCache(self.loader, ttl=10, max_entries=2, clock=self.clock)
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        cache.get("c")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+
+    def test_load_running_during_invalidation_is_not_cached(self):
+        started, release = threading.Event(), threading.Event()
+
+        def loader(key):
+            started.set()
+            release.wait(5)
+            return self.loader(key)
+
+        cache = VenueCache(loader, ttl=10, clock=self.clock)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(cache.get("a")))
+        thread.start()
+        started.wait(5)
+        cache.invalidate("a")
+        release.set()
+        thread.join(5)
+        self.assertEqual(results, ["a-1"])
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.get("a"), "a-2")
+
+    def test_missing_values_are_not_cached(self):
+        cache = VenueCache(lambda key: self.calls.append(key), ttl=10, clock=self.clock)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(self.calls, ["a", "a"])
+
+    def test_last_known_value_is_served_when_reload_fails(self):
+        def failing_loader(key):
+            raise requests.ConnectionError()
+
+        cache = VenueCache(self.loader, ttl=10, clock=self.clock)
+        cache.get("a")
+        cache.loader = failing_loader
+        self.now = 1000
+        self.assertEqual(cache.get("a"), "a-1")
+        with self.assertRaises(requests.ConnectionError):
+            cache.get("b")
+
+    def test_primed_values_are_served_and_refreshed(self):
+        cache = VenueCache(self.loader, ttl=10, stale_ttl=5, clock=self.clock)
+        cache.prime("a", "snapshot", age=1000)
+        self.assertEqual(cache.get("a"), "snapshot")
+        for _ in range(100):
+            if self.calls:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.calls, ["a"])
+
+    def test_concurrent_misses_share_one_load(self):
+        release = threading.Event()
+
+        def slow_loader(key):
+            self.calls.append(key)
+            release.wait(5)
+            return key
+
+        cache = VenueCache(slow_loader, ttl=10, clock=self.clock)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("a"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["a"] * 8)
+        self.assertEqual(self.calls, ["a"])
+        self.assertEqual(cache.stats()["coalesced"], 7)
+
+    def test_lookups_beyond_max_waiters_get_the_held_value(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_loader(key):
+            self.calls.append(key)
+            started.set()
+            release.wait(5)
+            return f"{key}-{len(self.calls)}"
+
+        cache = VenueCache(self.loader, ttl=10, max_waiters=2, clock=self.clock)
+        cache.get("a")
+        cache.loader = slow_loader
+        self.now = 1000
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("a"))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        for _ in range(100):
+            if cache.stats()["waiting"] == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get("a"), "a-1")
+        self.assertEqual(cache.stats()["loading"], 1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ["a-2", "a-2"])
+        stats = cache.stats()
+        self.assertEqual((stats["coalesced"], stats["rejected"], stats["waiting"]), (1, 1, 0))
+        self.assertEqual(self.calls, ["a", "a"])
+
+class fetch_venue_data_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        clear_venue_caches()
+
+    def test_static_and_dynamic_are_fetched_concurrently(self):
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api(delay=0.2)) as get:
+            started = time.perf_counter()
+            static_data, dynamic_data = utils.fetch_venue_data("venue")
+            elapsed = time.perf_counter() - started
+        self.assertEqual(static_data, VENUE_STATIC)
+        self.assertEqual(dynamic_data, VENUE_DYNAMIC)
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual(
+            sorted(call.args[0] for call in get.call_args_list),
+            [f"{utils.BASE_URL}venue/dynamic", f"{utils.BASE_URL}venue/static"],
+        )
+        for call in get.call_args_list:
+            self.assertEqual(call.kwargs["timeout"], utils.TIMEOUT)
+
+    def test_venue_is_compiled_once_per_load(self):
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api()):
+            with mock.patch.object(utils, "compile_pricing", wraps=compile_pricing) as compile_:
+                first = utils.fetch_venue("venue")
+                second = utils.fetch_venue("venue")
+        self.assertEqual(first, VENUE)
+        self.assertIs(first[1], second[1])
+        compile_.assert_called_once()
+
+    def test_caches_hold_compiled_venue_only(self):
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api()):
+            utils.fetch_venue("venue")
+        self.assertEqual(utils.static_cache.peek("venue"), VENUE[0])
+        self.assertEqual(utils.dynamic_cache.peek("venue"), VENUE[1])
+
+    def test_not_found_returns_no_data(self):
+        with mock.patch.object(utils.session, "get", return_value=mock.Mock(status_code=404)):
+            self.assertEqual(utils.fetch_venue_data("venue"), (None, None))
+
+    def test_upstream_error_returns_no_data(self):
+        with mock.patch.object(utils.session, "get", side_effect=requests.Timeout):
+            self.assertEqual(utils.fetch_venue_data("venue"), (None, None))
+
+    def test_async_fetch_uses_async_client(self):
+        def handler(request):
+            return httpx.Response(200, json=VENUE_STATIC if request.url.path.endswith("/static") else VENUE_DYNAMIC)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with mock.patch.object(utils, "_get_async_client", return_value=client):
+            static_data, dynamic_data = asyncio.run(utils.afetch_venue_data("venue"))
+        self.assertEqual((static_data, dynamic_data), (VENUE_STATIC, VENUE_DYNAMIC))
+
+    def test_async_client_pool_has_the_configured_size(self):
+        async def pool():
+            return utils._get_async_client()._transport.transport._pool
+
+        pool_size = settings.DOPC_UPSTREAM["POOL_SIZE"]
+        connection_pool = asyncio.run(pool())
+        self.assertEqual((connection_pool._max_connections, connection_pool._max_keepalive_connections),
+                         (pool_size, pool_size))
+
+    def test_async_fetch_retries_like_the_sync_session(self):
+        failures = {"/static": [httpx.ConnectError("refused")], "/dynamic": [httpx.Response(503)]}
+
+        def handler(request):
+            kind = request.url.path[request.url.path.rindex("/"):]
+            if failures[kind]:
+                failure = failures[kind].pop()
+                if isinstance(failure, Exception):
+                    raise failure
+                return failure
+            return httpx.Response(200, json=VENUE_STATIC if kind == "/static" else VENUE_DYNAMIC)
+
+        client = httpx.AsyncClient(transport=utils._RetryTransport(httpx.MockTransport(handler), backoff_factor=0))
+        with mock.patch.object(utils, "_get_async_client", return_value=client):
+            static_data, dynamic_data = asyncio.run(utils.afetch_venue_data("venue"))
+        self.assertEqual((static_data, dynamic_data), (VENUE_STATIC, VENUE_DYNAMIC))
+
+    def test_async_fetch_gives_up_after_the_retries(self):
+        requests_made = []
+
+        def handler(request):
+            requests_made.append(request)
+            return httpx.Response(502)
+
+        client = httpx.AsyncClient(transport=utils._RetryTransport(httpx.MockTransport(handler), retries=2, backoff_factor=0))
+        with mock.patch.object(utils, "_get_async_client", return_value=client), \
+                self.assertRaises(utils.UpstreamError):
+            asyncio.run(utils._afetch_json(f"{utils.BASE_URL}venue/static"))
+        self.assertEqual(len(requests_made), 3)
+
+class shared_venue_cache_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        clear_venue_caches()
+
+    def test_other_workers_read_venue_from_shared_cache(self):
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api()):
+            utils.fetch_venue("venue")
+        fetched_at, blob = caches["venues"].get(utils.shared_store.key("dynamic", "venue"))
+        self.assertIsInstance(blob, bytes)
+
+        # A second worker starts with empty in-process caches.
+        utils.static_cache.clear()
+        utils.dynamic_cache.clear()
+        with mock.patch.object(utils.session, "get", side_effect=requests.ConnectionError) as get, \
+                mock.patch.object(utils.shared_store, "get_many", wraps=utils.shared_store.get_many) as get_many:
+            self.assertEqual(utils.fetch_venue("venue"), VENUE)
+        get.assert_not_called()
+        get_many.assert_called_once_with(["venue"])
+
+    def test_default_venue_cache_keeps_the_invalidation_log_past_300_keys(self):
+        venue_cache = project_settings.CACHES["venues"]
+        if venue_cache["BACKEND"] != "django.core.cache.backends.filebased.FileBasedCache":
+            self.skipTest("DOPC_VENUE_CACHE_URL selects another backend")
+        venue_slugs = [f"venue-{index}" for index in range(400)]
+        with tempfile.TemporaryDirectory() as location, \
+                override_settings(CACHES=dict(settings.CACHES, venues=dict(venue_cache, LOCATION=location))):
+            CachePublisher("venues").publish({"venue_slugs": ["venue"]})
+            for venue_slug in venue_slugs:
+                utils.shared_store.set("static", venue_slug, VENUE_STATIC)
+                utils.shared_store.set("dynamic", venue_slug, VENUE_DYNAMIC)
+            self.assertEqual(caches["venues"].get(CachePublisher.SEQUENCE_KEY), 1)
+            self.assertEqual(len(utils.shared_store.get_many(venue_slugs)), 800)
+
+    def test_async_path_reads_shared_cache(self):
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api()):
+            utils.fetch_venue("venue")
+        utils.static_cache.clear()
+        utils.dynamic_cache.clear()
+        with mock.patch.object(utils, "_afetch_json", side_effect=AssertionError("upstream called")):
+            self.assertEqual(asyncio.run(utils.afetch_venue("venue")), VENUE)
+
+    def test_worker_waits_for_the_lease_holder_to_load_the_venue(self):
+        self.assertTrue(utils.shared_store.lease("dynamic", "venue", 5))
+
+        def other_worker():
+            time.sleep(0.05)
+            utils.shared_store.set("dynamic", "venue", VENUE_DYNAMIC)
+            utils.shared_store.release("dynamic", "venue")
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        before = utils.shared_waits.value("dynamic", "loaded")
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api()) as get:
+            self.assertEqual(utils.fetch_venue("venue"), VENUE)
+        thread.join()
+        self.assertEqual([call.args[0] for call in get.call_args_list], [f"{utils.BASE_URL}venue/static"])
+        self.assertEqual(utils.shared_waits.value("dynamic", "loaded"), before + 1)
+
+    def test_worker_fetches_once_the_lease_is_released_without_a_result(self):
+        self.assertTrue(utils.shared_store.lease("dynamic", "venue", 5))
+        timer = threading.Timer(0.05, utils.shared_store.release, ("dynamic", "venue"))
+        timer.start()
+        before = utils.shared_waits.value("dynamic", "released")
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api()) as get:
+            self.assertEqual(utils.fetch_venue("venue"), VENUE)
+        timer.join()
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(utils.shared_waits.value("dynamic", "released"), before + 1)
+        self.assertIsNotNone(utils.shared_store.get("dynamic", "venue"))
+        self.assertFalse(utils.shared_store.get_leased("dynamic", "venue")[1])
+
+    def test_unsafe_slugs_get_valid_keys(self):
+        key = utils.shared_store.key("static", "a venue/" + "x" * 300)
+        self.assertLess(len(key), 250)
+        self.assertNotIn(" ", key)
+
+class venue_invalidation_test_cases(TransactionTestCase):
+
+    url = "/api/v1/venues/invalidate"
+
+    def setUp(self):
+        clear_venue_caches()
+        # Before the tables are flushed at teardown
+        self.addCleanup(snapshots.flush_snapshots)
+        self.venues = {}
+        patcher = mock.patch.dict(views._invalidation_settings, {"TOKEN": "secret"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self):
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api(self.venues)) as get:
+            venue = utils.fetch_venue("venue")
+        return venue, get.call_count
+
+    def post(self, body, token="secret"):
+        return Client().post(self.url, body, content_type="application/json",
+                             HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_requests_are_authenticated_and_validated(self):
+        self.assertEqual(self.post({"venue_slugs": ["venue"]}, token="wrong").status_code, 401)
+        self.assertEqual(Client().post(self.url, {}, content_type="application/json").status_code, 401)
+        self.assertEqual(Client().get(self.url).status_code, 405)
+        for body in ({}, {"venue_slugs": []}, {"venue_slugs": "venue"}, {"venue_slugs": [1]}, {"version": ""}, []):
+            self.assertEqual(self.post(body).status_code, 400, body)
+        with mock.patch.dict(views._invalidation_settings, {"TOKEN": ""}):
+            self.assertEqual(self.post({"venue_slugs": ["venue"]}, token="").status_code, 403)
+
+    def test_venues_are_evicted_from_every_tier(self):
+        self.assertEqual(self.fetch(), (VENUE, 2))
+        self.assertEqual(self.fetch()[1], 0)
+        snapshots.flush_snapshots()
+        self.assertTrue(VenueSnapshot.objects.filter(venue_slug="venue").exists())
+
+        response = self.post({"venue_slugs": ["venue"]})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {"venue_slugs": ["venue"]})
+        self.assertNotIn("venue", utils.dynamic_cache)
+        self.assertIsNone(caches["venues"].get(utils.shared_store.key("dynamic", "venue")))
+        snapshots.flush_snapshots()
+        self.assertFalse(VenueSnapshot.objects.filter(venue_slug="venue").exists())
+
+        dynamic = json.loads(json.dumps(VENUE_DYNAMIC))
+        dynamic["venue_raw"]["delivery_specs"]["delivery_pricing"]["base_price"] = 290
+        self.venues["venue"] = {"dynamic": dynamic}
+        venue, calls = self.fetch()
+        self.assertEqual((venue[1].base_price, calls), (290, 2))
+
+    def test_refresh_reloads_evicted_venues(self):
+        self.fetch()
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api(self.venues)) as get:
+            futures = utils.invalidate_venues(["venue"], refresh=True)
+            for future in futures:
+                future.result(5)
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(self.fetch(), (VENUE, 0))
+
+    def test_refreshing_more_venues_than_fetch_threads_completes(self):
+        venue_slugs = [f"venue-{index}" for index in range(utils._fetch_executor._max_workers * 2)]
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api(delay=0.02)):
+            futures = utils.invalidate_venues(venue_slugs, refresh=True)
+            for future in futures:
+                future.result(10)
+        self.assertEqual(len(futures), 2 * len(venue_slugs))
+        for venue_slug in venue_slugs:
+            self.assertEqual(utils.fetch_venue(venue_slug), VENUE)
+
+    def test_version_stamp_evicts_every_venue(self):
+        self.fetch()
+        old_key = utils.shared_store.key("dynamic", "venue")
+        response = self.post({"version": "pricing-2"})
+        self.assertEqual(response.json(), {"version": "pricing-2"})
+        self.assertEqual(len(utils.dynamic_cache), 0)
+        self.assertNotEqual(utils.shared_store.key("dynamic", "venue"), old_key)
+        self.assertEqual(caches["venues"].get(utils.SharedVenueStore.VERSION_KEY), "pricing-2")
+        self.assertEqual(self.fetch()[1], 2)
+
+    def test_lost_invalidations_reread_the_version_stamp(self):
+        self.fetch()
+        caches["venues"].set(utils.SharedVenueStore.VERSION_KEY, "pricing-3", None)
+        utils._apply_invalidation(None)
+        self.assertEqual(len(utils.dynamic_cache), 0)
+        self.assertEqual(utils.shared_store.version, "pricing-3")
+        self.assertEqual(self.fetch()[1], 2)
+
+    def test_cache_publisher_broadcasts_to_other_workers(self):
+        publisher, worker = CachePublisher("venues", poll_interval=0), CachePublisher("venues", poll_interval=0)
+        published, received = [], []
+        publisher.subscribe(published.append)
+        worker.subscribe(received.append)
+        worker.poll()
+        publisher.poll()
+
+        publisher.publish({"venue_slugs": ["a"]})
+        publisher.publish({"version": "2"})
+        publisher.poll()
+        worker.poll()
+        self.assertEqual(published, [{"venue_slugs": ["a"]}, {"version": "2"}])
+        self.assertEqual(received, published)
+
+        # Messages that expired before being read are reported as lost.
+        publisher.publish({"venue_slugs": ["b"]})
+        caches["venues"].delete(CachePublisher.message_key(3))
+        worker.poll()
+        self.assertEqual(received[2:], [None])
+
+    def test_async_poll_reads_the_log_with_the_async_cache_api(self):
+        publisher, worker = CachePublisher("venues", poll_interval=0), CachePublisher("venues", poll_interval=0)
+        received, locked = [], []
+        worker.subscribe(received.append)
+        worker.poll()
+        publisher.publish({"venue_slugs": ["a"]})
+
+        cache = caches["venues"]
+
+        async def aget(key, default=None):
+            locked.append(worker._lock.locked())
+            return cache.get(key, default)
+
+        async def aget_many(keys):
+            locked.append(worker._lock.locked())
+            return cache.get_many(keys)
+
+        with mock.patch.object(cache, "aget", side_effect=aget), \
+                mock.patch.object(cache, "aget_many", side_effect=aget_many):
+            asyncio.run(worker.apoll())
+        self.assertEqual(received, [{"venue_slugs": ["a"]}])
+        self.assertEqual(locked, [False, False])
+
+class venue_snapshot_test_cases(TransactionTestCase):
+
+    def setUp(self):
+        clear_venue_caches()
+        # Before the tables are flushed at teardown
+        self.addCleanup(snapshots.flush_snapshots)
+
+    def test_loaded_venues_are_snapshotted(self):
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api()):
+            utils.fetch_venue("venue")
+        snapshots.flush_snapshots()
+        self.assertEqual(VenueSnapshot.objects.get(venue_slug="venue", kind="static").payload, VENUE_STATIC)
+        self.assertEqual(VenueSnapshot.objects.get(venue_slug="venue", kind="dynamic").payload, VENUE_DYNAMIC)
+
+    def test_cold_worker_serves_snapshots_while_upstream_is_down(self):
+        now = timezone.now()
+        VenueSnapshot.objects.create(venue_slug="venue", kind="static", payload=VENUE_STATIC, fetched_at=now)
+        VenueSnapshot.objects.create(venue_slug="venue", kind="dynamic", payload=VENUE_DYNAMIC, fetched_at=now)
+        with mock.patch.object(utils, "_warmed", False), \
+                mock.patch.object(utils.session, "get", side_effect=requests.ConnectionError):
+            self.assertEqual(utils.fetch_venue("venue"), VENUE)
+            self.assertIsNone(utils.fetch_venue("other-venue"))
+
+    def test_concurrent_first_lookups_wait_for_the_snapshots(self):
+        now = timezone.now()
+        VenueSnapshot.objects.create(venue_slug="venue", kind="static", payload=VENUE_STATIC, fetched_at=now)
+        VenueSnapshot.objects.create(venue_slug="venue", kind="dynamic", payload=VENUE_DYNAMIC, fetched_at=now)
+        loading = threading.Event()
+
+        def slow_load(**kwargs):
+            loading.set()
+            time.sleep(0.2)
+            return snapshots.load_snapshots(**kwargs)
+
+        results = []
+        with mock.patch.object(utils, "_warmed", False), \
+                mock.patch.object(utils, "load_snapshots", side_effect=slow_load), \
+                mock.patch.object(utils.session, "get", side_effect=requests.ConnectionError):
+            first = threading.Thread(target=lambda: results.append(utils.fetch_venue("venue")))
+            first.start()
+            self.assertTrue(loading.wait(2))
+            results.append(utils.fetch_venue("venue"))
+            first.join()
+        self.assertEqual(results, [VENUE, VENUE])
+
+class prewarm_command_test_cases(TransactionTestCase):
+
+    def setUp(self):
+        clear_venue_caches()
+        # Before the tables are flushed at teardown
+        self.addCleanup(snapshots.flush_snapshots)
+
+    def prewarm(self, slugs, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        venues = {"broken-venue": requests.ConnectionError, "missing-venue": 404}
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api(venues)):
+            call_command("prewarm_venues", *args, stdin=io.StringIO(slugs), stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_prewarm_populates_caches_and_snapshots(self):
+        stdout, stderr = self.prewarm("venue-a\n\n# comment\nvenue-b\nvenue-a\n")
+        self.assertIn("venue-a: ok", stdout)
+        self.assertIn("Prewarmed 2/2 venues", stdout)
+        self.assertIn("venue-b", utils.static_cache)
+        self.assertIn("venue-b", utils.dynamic_cache)
+        self.assertEqual(VenueSnapshot.objects.filter(venue_slug="venue-a").count(), 2)
+
+    def test_prewarm_fails_when_too_many_venues_fail(self):
+        with self.assertRaises(CommandError):
+            self.prewarm("venue-a\nbroken-venue\nmissing-venue\n")
+        stdout, stderr = self.prewarm("venue-a\nbroken-venue\n", "--max-failure-rate", "0.5")
+        self.assertIn("broken-venue: FAILED", stderr)
+        self.assertIn("Prewarmed 1/2 venues", stdout)
+
+class async_view_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def get_both(self, params, venue=VENUE, method="get"):
+        async def afetch(venue_slug):
+            return venue
+
+        request = getattr(self.factory, method)("/api/v1/delivery-order-price", params)
+        with mock.patch.object(views, "fetch_venue", return_value=venue), \
+                mock.patch.object(views, "afetch_venue", afetch):
+            sync_response = views.calculate_price(request)
+            async_response = asyncio.run(views.calculate_price_async(request))
+        return sync_response, async_response
+
+    def test_async_view_matches_sync_view(self):
+        cases = [
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149},
+            {"venue_slug": "venue", "cart_value": 800, "user_lat": 52.5112207, "user_lon": 13.4536149},
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.6, "user_lon": 13.4536149},
+            {"venue_slug": "venue", "cart_value": -1, "user_lat": 52.5, "user_lon": 13.4},
+            {"venue_slug": "venue", "cart_value": "test", "user_lat": 52.5, "user_lon": 13.4},
+        ]
+        for params in cases:
+            sync_response, async_response = self.get_both(params)
+            self.assertEqual(sync_response.status_code, async_response.status_code)
+            self.assertEqual(sync_response.content, async_response.content)
+
+    def test_async_view_unknown_venue(self):
+        params = {"venue_slug": "nope", "cart_value": 1000, "user_lat": 52.5, "user_lon": 13.4}
+        sync_response, async_response = self.get_both(params, venue=None)
+        self.assertEqual(async_response.status_code, 400)
+        self.assertEqual(sync_response.content, async_response.content)
+
+    def test_async_view_rejects_other_methods(self):
+        sync_response, async_response = self.get_both({}, method="post")
+        self.assertEqual(async_response.status_code, 405)
+
+class response_cache_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.cache = ResponseCache(ttl=5, precision=6)
+        self.params = {"venue_slug": "venue", "cart_value": 800, "user_lat": 52.5112207, "user_lon": 13.4536149}
+
+    def get(self, params, venue=VENUE):
+        request = self.factory.get("/api/v1/delivery-order-price", params)
+        with mock.patch.object(views, "response_cache", self.cache), \
+                mock.patch.object(views, "fetch_venue", return_value=venue), \
+                mock.patch.object(views, "calculate_delivery_distance", wraps=views.calculate_delivery_distance) as distance:
+            response = views.calculate_price(request)
+        return response, distance.call_count
+
+    def test_identical_quotes_are_served_from_cache(self):
+        first, first_calls = self.get(self.params)
+        second, second_calls = self.get(dict(self.params, user_lat=52.51122071))
+        self.assertEqual((first["X-Cache"], second["X-Cache"]), ("MISS", "HIT"))
+        self.assertEqual((first_calls, second_calls), (1, 0))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "entries": 1})
+
+    def test_pricing_change_invalidates_cached_quotes(self):
+        self.get(self.params)
+        changed = dict(VENUE_DYNAMIC["venue_raw"]["delivery_specs"], order_minimum_no_surcharge=2000)
+        venue = (VENUE[0], compile_pricing({"venue_raw": {"delivery_specs": changed}}))
+        response, calls = self.get(self.params, venue=venue)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(json.loads(response.content)["small_order_surcharge"], 1200)
+
+    def test_venues_with_equal_hashes_do_not_share_quotes(self):
+        class colliding_venue(tuple):
+            def __hash__(self):
+                return 0
+
+        self.get(self.params, venue=colliding_venue(VENUE))
+        moved = colliding_venue(((52.51, 13.45), VENUE[1]))
+        response, calls = self.get(self.params, venue=moved)
+        self.assertEqual((response["X-Cache"], calls), ("MISS", 1))
+
+    def test_error_quotes_keep_their_status(self):
+        far = dict(self.params, user_lat=53.5)
+        self.get(far)
+        response, calls = self.get(far)
+        self.assertEqual((response.status_code, response["X-Cache"]), (400, "HIT"))
+
+class batch_view_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.base_url = "/api/v1/delivery-order-price/batch"
+
+    def post(self, items):
+        def fetch_many(venue_slugs):
+            return {slug: VENUE if slug == "venue" else None for slug in venue_slugs}
+
+        with mock.patch.object(views, "fetch_many_venues", side_effect=fetch_many) as fetch:
+            response = self.client.post(self.base_url, items, content_type="application/json")
+        return response, fetch
+
+    def test_batch_matches_single_quotes_in_input_order(self):
+        items = [
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149},
+            {"venue_slug": "venue", "cart_value": 800, "user_lat": 52.5112207, "user_lon": 13.4536149},
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5140, "user_lon": 13.4700},
+        ]
+        response, fetch = self.post(items)
+        self.assertEqual(response.status_code, 200)
+        fetch.assert_called_once()
+        factory = RequestFactory()
+        for item, result in zip(items, response.json()["results"]):
+            with mock.patch.object(views, "fetch_venue", return_value=VENUE):
+                single = views.calculate_price(factory.get("/api/v1/delivery-order-price", item))
+            self.assertEqual(result, json.loads(single.content))
+
+    def test_batch_prices_the_valid_orders_through_the_core(self):
+        items = [
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149},
+            {"venue_slug": "venue", "cart_value": -1, "user_lat": 52.5, "user_lon": 13.4},
+            {"venue_slug": "missing", "cart_value": 800, "user_lat": 52.5, "user_lon": 13.4},
+        ]
+        with mock.patch.object(core, "quote_orders", wraps=core.quote_orders) as quote_orders:
+            response, fetch = self.post(items)
+        quote_orders.assert_called_once_with(
+            [("venue", 1000, 52.5003197, 13.4536149), ("missing", 800, 52.5, 13.4)],
+            {"venue": VENUE, "missing": None}, utils.batch_distance_engine)
+        self.assertEqual([result.get("status") for result in response.json()["results"]], [None, 400, 400])
+
+    def test_batch_reports_errors_per_item(self):
+        items = [
+            {"venue_slug": "venue", "cart_value": -1, "user_lat": 52.5, "user_lon": 13.4},
+            {"venue_slug": "missing", "cart_value": 1000, "user_lat": 52.5, "user_lon": 13.4},
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": 85.0, "user_lon": 179.0},
+            "not an object",
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149},
+        ]
+        response, fetch = self.post(items)
+        results = response.json()["results"]
+        self.assertEqual([result.get("status") for result in results], [400, 400, 400, 400, None])
+        self.assertEqual(results[1]["error"], "Unable to fetch venue data")
+        self.assertEqual(results[4]["delivery"]["distance"], 0)
+
+    def test_batch_reports_nan_coordinates_per_item(self):
+        items = [
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": "nan", "user_lon": 13.4536149},
+            {"venue_slug": "venue", "cart_value": "nan", "user_lat": 52.5003197, "user_lon": 13.4536149},
+            {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149},
+        ]
+        response, fetch = self.post(items)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(results[:2], [{"error": "Invalid parameter data type", "status": 400}] * 2)
+        self.assertEqual(results[2]["delivery"]["distance"], 0)
+
+    def test_batch_rejects_invalid_body(self):
+        response, fetch = self.post({"venue_slug": "venue"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.base_url)
+        self.assertEqual(response.status_code, 405)
+class pricing_core_test_cases(unittest.TestCase):
+
+    points = [(52.5003197, 13.4536149), (52.5112207, 13.4536149), (52.5140, 13.4700), (52.52, 13.40)]
+
+    def test_quotes_match_the_price_view(self):
+        factory = RequestFactory()
+        for cart_value, (user_lat, user_lon) in zip((1000, 800, 1000, 1000), self.points):
+            params = {"venue_slug": "venue", "cart_value": cart_value, "user_lat": user_lat, "user_lon": user_lon}
+            with mock.patch.object(views, "fetch_venue", return_value=VENUE):
+                response = views.calculate_price(factory.get("/api/v1/delivery-order-price", params))
+            body, status = core.quote(VENUE, cart_value, user_lat, user_lon)
+            self.assertEqual((body, status), (json.loads(response.content), response.status_code))
+
+    def test_batch_apis_match_single_quotes(self):
+        orders = [(1000 + index, *point) for index, point in enumerate(self.points)]
+        expected = [core.quote(VENUE, *order) for order in orders]
+        self.assertEqual(core.quote_many(VENUE, orders), expected)
+        self.assertEqual(core.quote_many(VENUE, orders, engine=DistanceEngine("lambert")), expected)
+
+        mixed = [("venue", *orders[0]), ("missing", *orders[1]), ("venue", *orders[2])]
+        self.assertEqual(core.quote_orders(mixed, {"venue": VENUE, "missing": None}), [
+            expected[0], ({"error": core.VENUE_UNAVAILABLE}, 400), expected[2],
+        ])
+
+    def test_parse_order_validates_parameters(self):
+        params = {"venue_slug": "venue", "cart_value": "1000.7", "user_lat": "52.5", "user_lon": "13.4"}
+        self.assertEqual(core.parse_order(params), (("venue", 1000, 52.5, 13.4), None))
+        self.assertEqual(core.parse_order(dict(params, user_lat="north")), (None, core.INVALID_PARAMETERS))
+        self.assertEqual(core.parse_order(dict(params, cart_value="0")), (None, core.INVALID_CART_VALUE))
+        self.assertEqual(core.parse_order(dict(params, user_lon="181")), (None, core.INVALID_CART_VALUE))
+        self.assertEqual(core.parse_order(dict(params, user_lat="nan")), (None, core.INVALID_PARAMETERS))
+        self.assertEqual(core.parse_order(dict(params, user_lon="-inf")), (None, core.INVALID_CART_VALUE))
+
+    def test_core_does_not_import_django(self):
+        code = "import sys, dopc.bulk, dopc.core; sys.exit('django' in sys.modules)"
+        subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__)), check=True)
+
+class price_orders_command_test_cases(unittest.TestCase):
+
+    orders = [
+        {"order_id": 1, "venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149},
+        {"order_id": 2, "venue_slug": "venue", "cart_value": 800, "user_lat": 52.5112207, "user_lon": 13.4536149},
+        {"order_id": 3, "venue_slug": "missing", "cart_value": 1000, "user_lat": 52.5, "user_lon": 13.4},
+        {"order_id": 4, "venue_slug": "venue", "cart_value": -1, "user_lat": 52.5, "user_lon": 13.4},
+        {"order_id": 5, "venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5140, "user_lon": 13.4700},
+    ]
+
+    def price(self, text, *args):
+        def fetch_many(venue_slugs):
+            return {slug: VENUE if slug == "venue" else None for slug in venue_slugs}
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(utils, "fetch_many_venues", side_effect=fetch_many) as fetch, \
+                mock.patch.object(utils, "refresh_venue", return_value=None):
+            call_command("price_orders", *args, stdin=io.StringIO(text), stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue(), fetch
+
+    def single_quote(self, order):
+        with mock.patch.object(views, "fetch_venue", return_value=VENUE if order["venue_slug"] == "venue" else None):
+            response = views.calculate_price(RequestFactory().get("/api/v1/delivery-order-price", order))
+        return json.loads(response.content)
+
+    def assert_matches_single_quotes(self, results):
+        self.assertEqual([int(result["order_id"]) for result in results], [order["order_id"] for order in self.orders])
+        for order, result in zip(self.orders, results):
+            quote = self.single_quote(order)
+            if "error" in quote:
+                self.assertEqual(result["error"], quote["error"])
+            else:
+                self.assertEqual(int(result["total_price"]), quote["total_price"])
+                self.assertEqual(int(result["delivery_fee"]), quote["delivery"]["fee"])
+                self.assertEqual(int(result["delivery_distance"]), quote["delivery"]["distance"])
+
+    def test_ndjson_orders_are_priced_in_input_order(self):
+        text = "".join(json.dumps(order) + "\n" for order in self.orders) + "not json\n\n[1]\n"
+        stdout, stderr, fetch = self.price(text, "--processes", "1", "--chunk-size", "2")
+        results = [json.loads(line) for line in stdout.splitlines()]
+        self.assert_matches_single_quotes(results[:5])
+        self.assertEqual(results[5:], [{"error": "Invalid parameter data type"}] * 2)
+        self.assertIsNone(results[0]["error"])
+        # Each venue is fetched once, in the first chunk that needs it
+        self.assertEqual(sorted(slug for call in fetch.call_args_list for slug in call.args[0]), ["missing", "venue"])
+        self.assertIn("Priced 7 orders (4 with errors) for 2 venues", stderr)
+
+    def test_csv_orders_are_priced_by_worker_processes(self):
+        header = "order_id,venue_slug,cart_value,user_lat,user_lon\n"
+        text = header + "".join(
+            f"{order['order_id']},{order['venue_slug']},{order['cart_value']},{order['user_lat']},{order['user_lon']}\n"
+            for order in self.orders
+        )
+        stdout, stderr, fetch = self.price(text, "--format", "csv", "--processes", "2", "--chunk-size", "2")
+        results = list(csv.DictReader(io.StringIO(stdout)))
+        self.assertEqual(list(results[0]), ["order_id", "venue_slug", "cart_value", "user_lat", "user_lon",
+                                            *bulk.RESULT_FIELDS])
+        self.assert_matches_single_quotes(results)
+        self.assertEqual(results[0]["error"], "")
+
+    def test_venues_are_fetched_again_after_upstream_failures(self):
+        clear_venue_caches()
+        self.addCleanup(clear_venue_caches)
+        venues = {"flaky": requests.ConnectionError, "down": requests.ConnectionError}
+        venue_api = fake_venue_api(venues)
+
+        def fake_get(url, timeout):
+            try:
+                return venue_api(url, timeout)
+            finally:
+                venues.pop("flaky", None)  # Fails once
+
+        orders = [dict(self.orders[0], venue_slug=venue_slug) for venue_slug in ("flaky", "down", "flaky")]
+        text = "".join(json.dumps(order) + "\n" for order in orders)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(utils.session, "get", side_effect=fake_get), \
+                self.assertRaisesRegex(CommandError, "failed to serve 1 venues, whose orders were not priced: down$"):
+            call_command("price_orders", "--processes", "1", "--retries", "2", "--retry-backoff", "0",
+                         stdin=io.StringIO(text), stdout=stdout, stderr=stderr)
+        results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([result["error"] for result in results], [None, "Unable to fetch venue data", None])
+
+class json_encoding_test_cases(unittest.TestCase):
+
+    def test_backends_encode_the_same_json(self):
+        body = {"results": [{"total_price": 1190, "delivery": {"fee": 190, "distance": 177}},
+                            {"error": "Délivery", "status": 400}]}
+        encoded = [dumps(body) for dumps, _ in encoding.BACKENDS.values()]
+        for data in encoded:
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(json.loads(data), body)
+        self.assertEqual(len(set(encoded)), 1)
+        for _, loads in encoding.BACKENDS.values():
+            self.assertEqual(loads(encoded[0]), body)
+            with self.assertRaises(ValueError):
+                loads(b"[1,")
+
+        # orjson only encodes 64-bit integers
+        huge = [dumps({"cart_value": 10 ** 30}) for dumps, _ in encoding.BACKENDS.values()]
+        self.assertEqual({json.loads(data)["cart_value"] for data in huge}, {10 ** 30})
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            encoding.get_backend("simplejson")
+
+    def test_json_backend_is_used_without_orjson(self):
+        spec = importlib.util.spec_from_file_location("dopc.encoding_without_orjson", encoding.__file__)
+        without_orjson = importlib.util.module_from_spec(spec)
+        with mock.patch.dict(sys.modules, {"orjson": None}):
+            spec.loader.exec_module(without_orjson)
+        self.assertEqual(sorted(without_orjson.BACKENDS), ["json"])
+        dumps, loads = without_orjson.get_backend("auto")
+        self.assertEqual(dumps({"error": "Délivery", "total_price": 1190}), '{"error":"Délivery","total_price":1190}'.encode())
+        self.assertEqual(loads(b'{"total_price":1190}'), {"total_price": 1190})
+        with self.assertRaises(ValueError):
+            without_orjson.get_backend("orjson")
+
+    def test_error_responses_reuse_encoded_bodies(self):
+        response = views._error_response("Invalid parameter data type")
+        self.assertIs(response.content, views._error_bodies["Invalid parameter data type"])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(response.content), {"error": "Invalid parameter data type"})
+
+        response = views._error_response("Something else", 500)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.content), {"error": "Something else"})
+
+class distance_engine_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1234)
+        self.origin = (52.5003197, 13.4536149)
+        self.points = [
+            (self.origin[0] + rng.uniform(-0.1, 0.1), self.origin[1] + rng.uniform(-0.15, 0.15))
+            for _ in range(2000)
+        ] + [self.origin, (85.0, 179.0), (-52.5003197, -166.5463851)]
+        self.expected = [int(geodesic(self.origin, point).meters) for point in self.points]
+
+    def test_modes_match_geodesic_exactly_with_zero_tolerance(self):
+        for mode in ("geodesic", "lambert", "vincenty"):
+            engine = DistanceEngine(mode)
+            self.assertEqual(engine.distances(self.origin, self.points), self.expected, mode)
+            self.assertEqual(
+                [engine.distance(self.origin, point) for point in self.points[:50]], self.expected[:50], mode
+            )
+
+    def test_tolerance_bounds_the_difference(self):
+        engine = DistanceEngine("lambert", tolerance=1)
+        for distance, expected in zip(engine.distances(self.origin, self.points), self.expected):
+            self.assertLessEqual(abs(distance - expected), 1)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            DistanceEngine("flat-earth")
+class distance_index_test_cases(unittest.TestCase):
+
+    def points(self, count, spread=0.03):
+        rng = random.Random(7)
+        latitude, longitude = VENUE[0]
+        return [(latitude + rng.uniform(-spread, spread), longitude + rng.uniform(-1.5 * spread, 1.5 * spread))
+                for _ in range(count)]
+
+    def test_quotes_match_exact_path(self):
+        exact = DistanceEngine("geodesic")
+        index = DistanceIndex(cell_size=0.001, max_cells=100000)
+        bands = set()
+        with mock.patch.object(utils, "distance_index", index):
+            for point in self.points(3000):
+                delivery_distance, range_index = utils.calculate_delivery_distance("venue", VENUE, point)
+                bands.add(index.band("venue", VENUE, *point))
+                self.assertEqual(
+                    core.price_order(1000, delivery_distance, VENUE[1], range_index),
+                    core.quote(VENUE, 1000, *point, engine=exact),
+                )
+        self.assertTrue({OUT_OF_RANGE, STRADDLES, 0, 1, 2, 3} <= bands)
+
+    def test_classified_cells_skip_the_distance(self):
+        index = DistanceIndex(cell_size=0.001)
+        far = (VENUE[0][0] + 0.1, VENUE[0][1])
+        with mock.patch("dopc.distance_index.geodesic_meters", wraps=geodesic_meters) as geodesic:
+            self.assertEqual(index.band("venue", VENUE, *far), OUT_OF_RANGE)
+            self.assertEqual(index.band("venue", VENUE, far[0] + 0.0001, far[1]), OUT_OF_RANGE)
+        self.assertEqual(geodesic.call_count, 1)
+
+    def test_changed_venue_is_rebuilt_and_budgets_are_enforced(self):
+        index = DistanceIndex(cell_size=0.001, max_cells=2, max_venues=1)
+        points = self.points(50, spread=0.01)
+        for point in points:
+            index.band("venue", VENUE, *point)
+        self.assertEqual(index.cells(), 2)
+        self.assertEqual(index.band("venue", VENUE, VENUE[0][0] + 0.5, VENUE[0][1]), STRADDLES)
+
+        reloaded = (tuple(VENUE[0]), compile_pricing(VENUE_DYNAMIC))
+        index.band("venue", reloaded, *points[0])
+        self.assertEqual(index.cells(), 2)
+        moved = ((VENUE[0][0] + 0.01, VENUE[0][1]), VENUE[1])
+        index.band("venue", moved, *points[0])
+        self.assertEqual(index.cells(), 1)
+        index.band("other-venue", VENUE, *points[0])
+        self.assertEqual(index.cells(), 1)
+
+def venue_with_reach(coordinates, max_distance, base_price=190):
+    dynamic = {"venue_raw": {"delivery_specs": {
+        "order_minimum_no_surcharge": 1000,
+        "delivery_pricing": {"base_price": base_price, "distance_ranges": [
+            {"min": 0, "max": max_distance, "a": 0, "b": 0},
+            {"min": max_distance, "max": 0, "a": 0, "b": 0},
+        ]},
+    }}}
+    return tuple(coordinates), compile_pricing(dynamic)
+
+class venue_index_test_cases(unittest.TestCase):
+
+    def test_candidates_include_every_venue_in_range(self):
+        rng = random.Random(3)
+        index = VenueIndex(cell_size=0.05, max_cells=16)
+        venues = {}
+        # A city, the antimeridian and the far north, with small and large delivery areas
+        for number, (latitude, longitude) in enumerate([(52.5, 13.4), (-16.5, 179.97), (78.2, 15.6)] * 40):
+            coordinates = (latitude + rng.uniform(-0.1, 0.1), (longitude + rng.uniform(-0.1, 0.1) + 180) % 360 - 180)
+            venues[f"venue-{number}"] = venue_with_reach(coordinates, rng.choice([500, 2000, 8000]))
+            index.add(f"venue-{number}", venues[f"venue-{number}"])
+
+        pruned = 0
+        for _ in range(300):
+            (latitude, longitude), _ = rng.choice(list(venues.values()))
+            point = (latitude + rng.uniform(-0.08, 0.08), (longitude + rng.uniform(-0.2, 0.2) + 180) % 360 - 180)
+            candidates = index.candidates(*point)
+            pruned += len(venues) - len(candidates)
+            for venue_slug, ((venue_latitude, venue_longitude), pricing) in venues.items():
+                if abs(venue_latitude - point[0]) < 1:
+                    if geodesic_meters(venue_latitude, venue_longitude, *point) <= pricing.max_distance:
+                        self.assertIn(venue_slug, candidates)
+        self.assertGreater(pruned / 300, 0.9 * len(venues))
+
+    def test_venues_are_moved_removed_and_evicted(self):
+        index = VenueIndex(cell_size=0.05, max_cells=16, max_venues=2)
+        near, moved = VENUE[0], (VENUE[0][0] + 1, VENUE[0][1])
+        index.add("venue", VENUE)
+        self.assertEqual(list(index.candidates(*near)), ["venue"])
+        index.add("venue", (moved, VENUE[1]))
+        self.assertEqual(index.candidates(*near), {})
+        self.assertEqual(list(index.candidates(*moved)), ["venue"])
+
+        # Delivery areas spanning more than max_cells are checked on every lookup
+        index.add("wide", venue_with_reach(near, 50000))
+        self.assertIn("wide", index.candidates(near[0] + 0.3, near[1]))
+        index.add("other", VENUE)
+        self.assertNotIn("venue", index)
+        index.remove("wide")
+        self.assertEqual(len(index), 1)
+        with self.assertRaises(ValueError):
+            VenueIndex(cell_size=0.07)
+
+class nearby_venues_test_cases(unittest.TestCase):
+
+    url = "/api/v1/venues/nearby"
+
+    def setUp(self):
+        clear_venue_caches()
+        latitude, longitude = VENUE[0]
+        # (latitude, longitude, base price) of each venue
+        self.venues = {
+            "venue": (latitude, longitude, 190),
+            "pricier-venue": (latitude + 0.002, longitude, 290),
+            "far-venue": (latitude + 0.5, longitude, 190),
+        }
+        payloads = {}
+        for venue_slug, (latitude, longitude, base_price) in self.venues.items():
+            dynamic = json.loads(json.dumps(VENUE_DYNAMIC))
+            dynamic["venue_raw"]["delivery_specs"]["delivery_pricing"]["base_price"] = base_price
+            payloads[venue_slug] = {
+                "static": {"venue_raw": {"location": {"coordinates": [longitude, latitude]}}},
+                "dynamic": dynamic,
+            }
+        with mock.patch.object(utils.session, "get", side_effect=fake_venue_api(payloads)):
+            for venue_slug in self.venues:
+                utils.fetch_venue(venue_slug)
+
+    def get(self, **params):
+        query = {"cart_value": 800, "user_lat": VENUE[0][0] + 0.003, "user_lon": VENUE[0][1], **params}
+        with mock.patch.object(utils, "fetch_many_venues", wraps=utils.fetch_many_venues) as fetch_many:
+            response = Client().get(self.url, query)
+        return response, fetch_many
+
+    def test_quotes_match_single_quotes_and_skip_venues_out_of_range(self):
+        response, fetch_many = self.get()
+        self.assertEqual(response.status_code, 200)
+        venues = response.json()["venues"]
+        self.assertEqual([venue["venue_slug"] for venue in venues], ["venue", "pricier-venue"])
+        self.assertEqual(sorted(fetch_many.call_args.args[0]), ["pricier-venue", "venue"])
+        for venue in venues:
+            body, status = core.quote(utils.fetch_venue(venue["venue_slug"]), 800, VENUE[0][0] + 0.003, VENUE[0][1])
+            self.assertEqual(venue, dict(venue_slug=venue["venue_slug"], **body))
+
+    def test_nearest_and_top_venues(self):
+        response, _ = self.get(order_by="distance", limit=1)
+        self.assertEqual([venue["venue_slug"] for venue in response.json()["venues"]], ["pricier-venue"])
+        response, _ = self.get(user_lat=0, user_lon=0)
+        self.assertEqual(response.json(), {"venues": []})
+
+    def test_invalidated_venues_leave_the_index(self):
+        utils.invalidate_venues(["venue"])
+        self.assertNotIn("venue", utils.venue_index)
+        self.assertIn("pricier-venue", utils.venue_index)
+
+    def test_invalid_parameters(self):
+        for params in ({"order_by": "rating"}, {"limit": 0}, {"limit": "x"}, {"cart_value": -1}, {"user_lat": "nan"}):
+            self.assertEqual(self.get(**params)[0].status_code, 400, params)
+        self.assertEqual(Client().post(self.url).status_code, 405)
+
+class pricing_table_test_cases(unittest.TestCase):
+
+    def dynamic_data(self, distance_ranges):
+        return {
+            "venue_raw": {
+                "delivery_specs": {
+                    "order_minimum_no_surcharge": 1000,
+                    "delivery_pricing": {"base_price": 190, "distance_ranges": distance_ranges},
+                }
+            }
+        }
+
+    def scan_fee(self, distance_ranges, delivery_distance):
+        for range_ in distance_ranges:
+            if range_["min"] <= delivery_distance < range_["max"] or range_["max"] == 0:
+                return 190 + range_["a"] + round(range_["b"] * delivery_distance / 10)
+        return None
+
+    def test_bisect_lookup_matches_linear_scan(self):
+        distance_ranges = VENUE_DYNAMIC["venue_raw"]["delivery_specs"]["delivery_pricing"]["distance_ranges"]
+        with_gap = [
+            {"min": 100, "max": 500, "a": 10, "b": 2},
+            {"min": 700, "max": 1000, "a": 20, "b": 0},
+            {"min": 1000, "max": 0, "a": 30, "b": 1},
+        ]
+        closed = with_gap[:2]
+        for ranges in (distance_ranges, with_gap, closed):
+            pricing = compile_pricing(self.dynamic_data(ranges))
+            self.assertEqual(pricing.max_distance, ranges[-1]["min"])
+            for delivery_distance in range(0, 2100, 7):
+                self.assertEqual(pricing.delivery_fee(delivery_distance), self.scan_fee(ranges, delivery_distance))
+
+    def test_equal_specs_share_one_table(self):
+        distance_ranges = VENUE_DYNAMIC["venue_raw"]["delivery_specs"]["delivery_pricing"]["distance_ranges"]
+        first = compile_pricing(self.dynamic_data(distance_ranges))
+        second = compile_pricing(json.loads(json.dumps(self.dynamic_data(distance_ranges))))
+        self.assertIs(first, second)
+        floats = [{**range_, "a": float(range_["a"])} for range_ in distance_ranges]
+        self.assertIsNot(compile_pricing(self.dynamic_data(floats)), first)
+
+    def test_malformed_specs_are_rejected(self):
+        malformed = [
+            [],
+            [{"min": 500, "max": 1000, "a": 0, "b": 0}, {"min": 0, "max": 500, "a": 0, "b": 0}],
+            [{"min": 0, "max": 600, "a": 0, "b": 0}, {"min": 500, "max": 0, "a": 0, "b": 0}],
+            [{"min": 0, "max": 0, "a": 0, "b": 0}, {"min": 500, "max": 0, "a": 0, "b": 0}],
+            [{"min": 0, "max": 500, "a": "1", "b": 0}],
+            [{"min": 0, "max": 500, "a": 0}],
+        ]
+        for ranges in malformed:
+            with self.assertRaises(PricingSpecError):
+                compile_pricing(self.dynamic_data(ranges))
+        with self.assertRaises(PricingSpecError):
+            compile_pricing({"venue_raw": {}})
+
+class api_settings_test_cases(unittest.TestCase):
+
+    SCRIPT = """
+import json, sys
+import django
+django.setup()
+from django.test import Client
+from dopc import utils
+from benchmarks.fixtures import QUERY, VENUE_DYNAMIC, VENUE_SLUG, VENUE_STATIC
+utils._warmed = True
+utils.static_cache.prime(VENUE_SLUG, utils._compile_static(VENUE_STATIC))
+utils.dynamic_cache.prime(VENUE_SLUG, utils._compile_dynamic(VENUE_DYNAMIC))
+response = Client(SERVER_NAME='localhost').get('/api/v1/delivery-order-price?' + QUERY)
+print(json.dumps([response.status_code, response.json(), sorted(
+    name for name in sys.modules if name.startswith('django.contrib.'))]))
+"""
+
+    def run_profile(self, settings_module):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, DOPC_ASYNC_VIEWS="0")
+        output = subprocess.run([sys.executable, "-c", self.SCRIPT], env=env, check=True,
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        return json.loads(output.splitlines()[-1])
+
+    def test_api_profile_serves_same_quote_without_contrib_apps(self):
+        full_status, full_body, full_modules = self.run_profile("dopc_project.settings")
+        api_status, api_body, api_modules = self.run_profile("dopc_project.settings_api")
+        self.assertEqual((api_status, api_body), (full_status, full_body))
+        self.assertEqual(api_status, 200)
+        self.assertIn("django.contrib.sessions", full_modules)
+        for app in ("admin", "auth", "sessions", "messages"):
+            self.assertNotIn(f"django.contrib.{app}", api_modules)
+
+class circuit_breaker_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=4, window=30, slow_call=1.0,
+                                      open_seconds=10, half_open_calls=1, clock=lambda: self.now)
+        clear_venue_caches()
+
+    def call(self, failed=False, duration=0.01):
+        ticket = self.breaker.start()
+        self.assertIsNotNone(ticket)
+        self.breaker.record(ticket, failed, duration)
+
+    def test_opens_on_failure_rate_and_recovers_through_half_open(self):
+        self.call()
+        self.call(failed=True)
+        self.call()
+        self.assertEqual(self.breaker.state, "closed")
+        self.call(duration=2.0)  # Slow calls count as failures
+        self.assertEqual(self.breaker.state, "open")
+        self.assertIsNone(self.breaker.start())
+
+        self.now = 10
+        self.assertEqual(self.breaker.state, "half_open")
+        probe = self.breaker.start()
+        self.assertIsNotNone(probe)
+        self.assertIsNone(self.breaker.start())
+        self.breaker.record(probe, True, 0.01)
+        self.assertEqual(self.breaker.state, "open")
+
+        self.now = 20
+        self.call()
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_old_failures_leave_the_window(self):
+        for _ in range(3):
+            self.call(failed=True)
+        self.now = 31
+        for _ in range(3):
+            self.call()
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_calls_from_before_a_state_change_are_ignored(self):
+        late = self.breaker.start()
+        for _ in range(4):
+            self.call(failed=True)
+        self.now = 10
+        probe = self.breaker.start()
+        self.breaker.record(late, False, 0.01)
+        self.assertEqual(self.breaker.state, "half_open")
+        self.breaker.record(probe, False, 0.01)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_open_circuit_fails_fast(self):
+        breaker = utils.breakers["static"]
+        for _ in range(breaker.min_calls):
+            breaker.record(breaker.start(), True, 0.01)
+        with mock.patch.object(utils.session, "get") as get:
+            with self.assertRaises(utils.UpstreamError):
+                utils._fetch_json(f"{utils.BASE_URL}venue/static")
+        get.assert_not_called()
+
+    def test_request_budget_bounds_wait_and_serves_last_known_good(self):
+        utils.static_cache.prime("venue", VENUE[0])
+        utils.dynamic_cache.prime("venue", VENUE[1])
+        loaded = threading.Event()
+
+        def slow_get(url, timeout):
+            time.sleep(0.5)
+            loaded.set()
+            return mock.Mock(status_code=404)
+
+        with mock.patch.object(utils, "REQUEST_BUDGET", 0.1), \
+                mock.patch.object(utils.dynamic_cache, "ttl", 0), \
+                mock.patch.object(utils.session, "get", side_effect=slow_get):
+            started = time.perf_counter()
+            self.assertEqual(utils.fetch_venue("venue"), VENUE)
+            self.assertLess(time.perf_counter() - started, 0.4)
+            self.assertTrue(loaded.wait(2))
+
+        loaded.clear()
+        with mock.patch.object(utils, "REQUEST_BUDGET", 0.1), \
+                mock.patch.object(utils.session, "get", side_effect=slow_get):
+            started = time.perf_counter()
+            self.assertIsNone(utils.fetch_venue("other-venue"))
+            self.assertLess(time.perf_counter() - started, 0.4)
+            self.assertTrue(loaded.wait(2))
+
+class admission_controller_test_cases(unittest.TestCase):
+
+    def queue(self, controller, priority, outcomes):
+        """Start a thread acquiring ``controller`` and return once its request is queued or decided."""
+        def acquire():
+            outcomes.append((priority, controller.acquire(priority)))
+
+        def waiting():
+            return sum(controller.stats()["queued"].values()) + len(outcomes)
+
+        before = waiting()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        deadline = time.monotonic() + 2
+        while waiting() == before and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return thread
+
+    def test_requests_beyond_the_queue_are_shed(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=2)
+        self.assertIsNone(controller.acquire())
+        outcomes = []
+        waiting = self.queue(controller, LOW, outcomes)
+        self.assertEqual(controller.acquire(), QUEUE_FULL)
+        controller.release()
+        waiting.join()
+        self.assertEqual(outcomes, [(LOW, None)])
+        self.assertEqual(controller.stats()["in_flight"], 1)
+        controller.release()
+        self.assertEqual(controller.stats()["in_flight"], 0)
+        self.assertEqual(controller.stats()["shed"][QUEUE_FULL], 1)
+
+    def test_queued_requests_are_shed_at_their_deadline(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=0.05)
+        controller.acquire()
+        started = time.perf_counter()
+        self.assertEqual(controller.acquire(), TIMEOUT)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(controller.stats()["queued"], {HIGH: 0, LOW: 0})
+        controller.release()
+        self.assertIsNone(controller.acquire())
+
+    def test_cached_venues_are_admitted_first(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=2, queue_timeout=2)
+        controller.acquire()
+        outcomes = []
+        threads = [self.queue(controller, LOW, outcomes), self.queue(controller, LOW, outcomes),
+                   self.queue(controller, HIGH, outcomes)]
+        threads[1].join()
+        self.assertEqual(outcomes, [(LOW, DISPLACED)])
+        controller.release()
+        threads[2].join()
+        controller.release()
+        threads[0].join()
+        controller.release()
+        self.assertEqual(outcomes, [(LOW, DISPLACED), (HIGH, None), (LOW, None)])
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+    def test_without_priorities_requests_are_admitted_in_arrival_order(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=2, prioritize=False)
+        controller.acquire()
+        outcomes = []
+        waiting = self.queue(controller, LOW, outcomes)
+        self.assertEqual(controller.acquire(HIGH), QUEUE_FULL)
+        controller.release()
+        waiting.join()
+        self.assertEqual(outcomes, [(LOW, None)])
+
+    def test_async_waiters_share_the_slots(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=2, queue_timeout=2)
+
+        async def scenario():
+            self.assertIsNone(await controller.aacquire())
+            admitted = asyncio.ensure_future(controller.aacquire())
+            cancelled = asyncio.ensure_future(controller.aacquire())
+            await asyncio.sleep(0.01)
+            cancelled.cancel()
+            await asyncio.sleep(0.01)
+            self.assertEqual(controller.stats()["queued"][LOW], 1)
+            threading.Thread(target=controller.release).start()
+            self.assertIsNone(await admitted)
+            controller.release()
+
+        asyncio.run(scenario())
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+class admission_middleware_test_cases(unittest.TestCase):
+
+    def setUp(self):
+        clear_venue_caches()
+
+    def test_shed_quotes_get_retry_after(self):
+        params = {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149}
+        controller = AdmissionController(max_concurrency=0, max_queue=0)
+        with mock.patch.object(middleware, "controller", controller), \
+                mock.patch.object(views, "fetch_venue", return_value=VENUE) as fetch:
+            response = Client().get("/api/v1/delivery-order-price", params)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(json.loads(response.content), {"error": middleware.OVERLOADED})
+        fetch.assert_not_called()
+        self.assertEqual(controller.stats()["shed"][QUEUE_FULL], 1)
+
+    def test_admitted_quotes_release_their_slot(self):
+        params = {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149}
+        controller = AdmissionController(max_concurrency=1)
+        with mock.patch.object(middleware, "controller", controller), \
+                mock.patch.object(views, "fetch_venue", return_value=VENUE):
+            for _ in range(3):
+                self.assertEqual(Client().get("/api/v1/delivery-order-price", params).status_code, 200)
+        self.assertEqual(controller.stats()["admitted"], 3)
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+    def test_async_handler_sheds_while_the_slot_is_held(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=0)
+        started = asyncio.Event()
+
+        async def get_response(request):
+            started.set()
+            await asyncio.sleep(0.05)
+            return views._json_response({})
+
+        async def scenario():
+            admission = middleware.AdmissionMiddleware(get_response)
+            request = RequestFactory().get("/api/v1/delivery-order-price")
+            first = asyncio.ensure_future(admission(request))
+            await started.wait()
+            shed = await admission(request)
+            return (await first).status_code, shed.status_code
+
+        with mock.patch.object(middleware, "controller", controller):
+            self.assertEqual(asyncio.run(scenario()), (200, 503))
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+    def test_priority_follows_the_venue_cache(self):
+        request = RequestFactory().get("/api/v1/delivery-order-price", {"venue_slug": "venue"})
+        self.assertEqual(middleware._priority(request), LOW)
+        utils.static_cache.prime("venue", VENUE[0])
+        utils.dynamic_cache.prime("venue", VENUE[1])
+        self.assertEqual(middleware._priority(request), HIGH)
+
+    def test_metrics_report_admission(self):
+        lines = metrics.registry.render().splitlines()
+        self.assertIn("# TYPE dopc_admission_in_flight gauge", lines)
+        self.assertTrue(any(line.startswith('dopc_admission_queued{priority="high"}') for line in lines))
+        self.assertTrue(any(line.startswith('dopc_admission_shed_total{reason="timeout"}') for line in lines))
+
+class metrics_test_cases(unittest.TestCase):
+
+    def test_render_prometheus_text(self):
+        registry = metrics.Registry()
+        counter = registry.counter("test_events", "Events.", ("kind",))
+        histogram = registry.histogram("test_seconds", "Durations.", ("stage",), buckets=(0.1, 1))
+        registry.callback("test_entries", "Entries.", "gauge", (), lambda: {(): 3})
+        counter.inc('a"b')
+        counter.inc('a"b', amount=2)
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value, "fetch")
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE test_events counter", lines)
+        self.assertIn('test_events_total{kind="a\\"b"} 3', lines)
+        self.assertIn("# TYPE test_seconds histogram", lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{stage="fetch"} 4', lines)
+        self.assertIn("test_entries 3", lines)
+        with self.assertRaises(ValueError):
+            registry.counter("test_events", "Again.")
+
+    def test_updates_are_thread_safe(self):
+        counter = metrics.Counter("test_threads", "Increments.")
+        histogram = metrics.Histogram("test_threads_seconds", "Observations.")
+
+        def work():
+            for _ in range(2000):
+                counter.inc()
+                histogram.observe(0.001)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.value(), 16000)
+        self.assertEqual(histogram.count(), 16000)
+
+    def test_server_timing_lists_stages_per_request(self):
+        def view(request):
+            with metrics.timed("fetch"):
+                pass
+            with metrics.timed("serialize"):
+                return views._json_response({})
+
+        async def aview(request):
+            with metrics.timed("fetch"):
+                await asyncio.sleep(0)
+            return views._json_response({}, 400)
+
+        request = RequestFactory().get("/")
+        before = metrics.responses.value("test-view", "400")
+        response = metrics.instrument("test-view", server_timing=True)(view)(request)
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        self.assertEqual(stages, ["fetch", "serialize", "total"])
+
+        async def concurrent():
+            wrapped = metrics.instrument("test-view", server_timing=True)(aview)
+            return await asyncio.gather(*(wrapped(request) for _ in range(3)))
+
+        for response in asyncio.run(concurrent()):
+            self.assertEqual([entry.split(";")[0] for entry in response["Server-Timing"].split(", ")],
+                             ["fetch", "total"])
+        self.assertEqual(metrics.responses.value("test-view", "400"), before + 3)
+        self.assertNotIn("Server-Timing", metrics.instrument("test-view")(view)(request))
+
+    def test_metrics_endpoint_counts_quotes(self):
+        params = {"venue_slug": "venue", "cart_value": 1000, "user_lat": 52.5003197, "user_lon": 13.4536149}
+        before = metrics.responses.value("price", "200")
+        with mock.patch.object(views, "fetch_venue", return_value=VENUE):
+            Client().get("/api/v1/delivery-order-price", params)
+        self.assertEqual(metrics.responses.value("price", "200"), before + 1)
+
+        response = Client().get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn('dopc_responses_total{view="price",status="200"}', body)
+        self.assertIn('dopc_stage_seconds_count{view="price",stage="distance"}', body)
+        self.assertIn('dopc_venue_cache_lookups_total{kind="static",result="hit"}', body)
+
+class benchmark_test_cases(unittest.TestCase):
+
+    def test_stub_server_serves_venue_payloads(self):
+        from benchmarks.stub_server import VenueStubServer
+
+        stub = VenueStubServer(latency=0.01).start()
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+        started = time.perf_counter()
+        self.assertEqual(utils._fetch_json(f"{stub.base_url}any-venue/static"), VENUE_STATIC)
+        self.assertEqual(utils._fetch_json(f"{stub.base_url}any-venue/dynamic"), VENUE_DYNAMIC)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.02)
+        self.assertIsNone(utils._fetch_json(f"{stub.base_url}any-venue/menu"))
+        self.assertEqual(stub.requests, 3)
+
+    def test_compare_reports_regressions(self):
+        from benchmarks.run import compare
+
+        def results(throughput, p99, fee_lookup):
+            summary = {"throughput_rps": throughput, "p50_ms": 1, "p95_ms": 2, "p99_ms": p99}
+            return {"load": {"wsgi": {"levels": {"8": summary}}}, "micro_ns": {"fee_lookup": fee_lookup}}
+
+        baseline = results(1000, 10, 500)
+        self.assertEqual(compare(baseline, results(900, 11, 590), 0.2), [])
+        self.assertEqual(
+            sorted(name for name, _, _ in compare(baseline, results(700, 13, 400), 0.2)),
+            ["wsgi.c8.p99_ms", "wsgi.c8.throughput_rps"],
+        )
+
 if __name__ == "__main__":
     unittest.main()
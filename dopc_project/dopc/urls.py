@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# ASGI deployments serve the native async view; WSGI keeps the sync one.
+calculate_price = views.calculate_price_async if settings.DOPC_ASYNC_VIEWS else views.calculate_price
+
 urlpatterns = [
-    path('delivery-order-price', views.calculate_price, name='delivery-order-price'),
+    path('delivery-order-price', calculate_price, name='delivery-order-price'),
+    path('delivery-order-price/batch', views.calculate_price_batch, name='delivery-order-price-batch'),
+    path('venues/nearby', views.nearby_venues, name='venues-nearby'),
+    path('venues/invalidate', views.invalidate, name='venues-invalidate'),
 ]
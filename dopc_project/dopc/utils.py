@@ -1,5 +1,39 @@
-from geopy.distance import geodesic
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .breaker import CircuitBreaker
+from .cache import VenueCache
+from .distance import DistanceEngine
+from .distance_index import OUT_OF_RANGE, DistanceIndex
+from .invalidation import CachePublisher, LocalPublisher
+from .metrics import registry, upstream_errors, upstream_seconds
+from .models import VenueSnapshot
+from .pricing import PricingSpecError, compile_pricing
+from .shared_cache import SharedVenueStore
+from .snapshots import delete_snapshots, load_snapshots, save_snapshot
+from .venue_index import VenueIndex
+
+logger = logging.getLogger(__name__)
+
+_distance_settings = getattr(settings, 'DOPC_DISTANCE', {})
+
+# Single quotes default to the exact geodesic; arrays use a vectorized mode.
+distance_engine = DistanceEngine(
+    _distance_settings.get('MODE', 'geodesic'), tolerance=_distance_settings.get('TOLERANCE', 0)
+)
+batch_distance_engine = DistanceEngine(
+    _distance_settings.get('BATCH_MODE', 'vincenty'), tolerance=_distance_settings.get('TOLERANCE', 0)
+)
 
 def calculate_distance(coord1, coord2):
     """
@@ -8,23 +42,872 @@ def calculate_distance(coord1, coord2):
     :param coord2: Tuple (latitude, longitude)
     :return: Distance in meters
     """
-    return int(geodesic(coord1, coord2).meters)
+    return distance_engine.distance(coord1, coord2)
 
-BASE_URL = "https://consumer-api.development.dev.woltapi.com/home-assignment-api/v1/venues/"
+_index_settings = getattr(settings, 'DOPC_DISTANCE_INDEX', {})
 
-def fetch_venue_data(venue_slug):
+# Optional grid of distance bands per venue; quotes in cells that lie within
+# one band use the faster engine, quotes in cells out of range skip the distance.
+distance_index = None
+if _index_settings.get('ENABLED', False):
+    distance_index = DistanceIndex(
+        cell_size=_index_settings.get('CELL_SIZE', 0.0005),
+        max_cells=_index_settings.get('MAX_CELLS_PER_VENUE', 4096),
+        max_venues=_index_settings.get('MAX_VENUES', 256),
+        margin=_distance_settings.get('TOLERANCE', 0),
+    )
+band_distance_engine = DistanceEngine(
+    _index_settings.get('MODE', 'lambert'), tolerance=_distance_settings.get('TOLERANCE', 0)
+)
+
+def calculate_delivery_distance(venue_slug, venue, user_coordinates):
     """
-    Fetch static and dynamic data for a given venue.
+    Calculate the delivery distance of a quote, through the distance band index when enabled.
     :param venue_slug: Venue slug identifier
-    :return: Tuple (static_data, dynamic_data)
+    :param venue: Tuple ((latitude, longitude), PricingTable)
+    :param user_coordinates: Tuple (latitude, longitude)
+    :return: Tuple (distance in meters, index of its distance range or None if not known);
+        the distance is None when the venue is known not to deliver that far
+    """
+    if distance_index:
+        band = distance_index.band(venue_slug, venue, *user_coordinates)
+        if band == OUT_OF_RANGE:
+            return None, None
+        if band >= 0:
+            return band_distance_engine.distance(user_coordinates, venue[0]), band
+    return calculate_distance(user_coordinates, venue[0]), None
+
+def calculate_distances(origin, points):
+    """
+    Calculate the distances from one coordinate to many in meters.
+    :param origin: Tuple (latitude, longitude)
+    :param points: Sequence of (latitude, longitude) tuples
+    :return: List of distances in meters
+    """
+    return batch_distance_engine.distances(origin, points)
+
+_upstream_settings = getattr(settings, 'DOPC_UPSTREAM', {})
+
+BASE_URL = _upstream_settings.get(
+    'BASE_URL', "https://consumer-api.development.dev.woltapi.com/home-assignment-api/v1/venues/"
+)
+TIMEOUT = (_upstream_settings.get('CONNECT_TIMEOUT', 1.0), _upstream_settings.get('READ_TIMEOUT', 2.0))
+# Longest a request waits for venue data, retries included. Loads still running
+# after that finish in the background and are cached for later requests.
+REQUEST_BUDGET = _upstream_settings.get('REQUEST_BUDGET', 2.0)
+RETRIES = _upstream_settings.get('RETRIES', 2)
+BACKOFF_FACTOR = _upstream_settings.get('BACKOFF_FACTOR', 0.1)
+# Responses retried like failed connects
+RETRY_STATUSES = (502, 503, 504)
+
+def _build_session():
+    """
+    Build the HTTP session shared by all upstream calls.
+
+    Connections are kept alive in a pool per host, and failed connects, reads and
+    5xx responses are retried with exponential backoff.
+    :return: requests.Session
+    """
+    pool_size = _upstream_settings.get('POOL_SIZE', 32)
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+session = _build_session()
+
+# Runs the static fetch alongside the dynamic one so a cache miss costs one upstream round trip.
+_fetch_executor = ThreadPoolExecutor(
+    max_workers=_upstream_settings.get('POOL_SIZE', 32), thread_name_prefix='dopc-fetch'
+)
+
+class UpstreamError(Exception):
+    """Raised when the venue API cannot be reached or answers with a server error."""
+
+_breaker_settings = getattr(settings, 'DOPC_CIRCUIT_BREAKER', {})
+
+# One circuit per venue API endpoint, so a failing dynamic endpoint does not
+# stop coordinates from being fetched and the other way round.
+breakers = {}
+if _breaker_settings.get('ENABLED', True):
+    breakers = {
+        endpoint: CircuitBreaker(
+            f"venue API {endpoint} endpoint",
+            failure_rate=_breaker_settings.get('FAILURE_RATE', 0.5),
+            min_calls=_breaker_settings.get('MIN_CALLS', 10),
+            window=_breaker_settings.get('WINDOW', 30),
+            slow_call=_breaker_settings.get('SLOW_CALL', 1.0),
+            open_seconds=_breaker_settings.get('OPEN_SECONDS', 10),
+            half_open_calls=_breaker_settings.get('HALF_OPEN_CALLS', 1),
+        )
+        for endpoint in ('static', 'dynamic')
+    }
+
+budget_exceeded = registry.counter(
+    'dopc_upstream_budget_exceeded', "Venue loads still running when a request's upstream budget ran out.")
+registry.callback(
+    'dopc_circuit_state', "Current state of the circuit of each venue API endpoint.", 'gauge',
+    ('endpoint', 'state'),
+    lambda: {(endpoint, state): int(breaker.state == state)
+             for endpoint, breaker in breakers.items() for state in ('closed', 'open', 'half_open')},
+)
+
+def _start_call(url):
+    """
+    Admit an upstream call through the circuit breaker of its endpoint.
+    :param url: Absolute URL
+    :return: Tuple (endpoint, breaker ticket or None, start time)
+    :raises UpstreamError: If the endpoint's circuit is open
+    """
+    endpoint = url.rpartition('/')[2]
+    breaker = breakers.get(endpoint)
+    ticket = None
+    if breaker:
+        ticket = breaker.start()
+        if ticket is None:
+            upstream_errors.inc(endpoint, 'circuit_open')
+            raise UpstreamError(url)
+    return endpoint, ticket, time.perf_counter()
+
+def _finish_call(call, failed):
+    """
+    Record the duration and outcome of a call admitted by ``_start_call``.
+    """
+    endpoint, ticket, started = call
+    duration = time.perf_counter() - started
+    upstream_seconds.observe(duration, endpoint)
+    if ticket is not None:
+        breakers[endpoint].record(ticket, failed, duration)
+
+def _fetch_json(url):
+    """
+    GET a JSON document from the upstream API.
+    :param url: Absolute URL
+    :return: Decoded JSON, or None on a non-200 response
+    :raises UpstreamError: On a network error, a 5xx response or an open circuit
+    """
+    call = _start_call(url)
+    failed = True
+    try:
+        response = session.get(url, timeout=TIMEOUT)
+        failed = response.status_code >= 500
+    except requests.RequestException as exc:
+        logger.warning("Venue API request to %s failed: %s", url, exc)
+        upstream_errors.inc(call[0], 'connection')
+        raise UpstreamError(url) from exc
+    finally:
+        _finish_call(call, failed)
+    if response.status_code >= 500:
+        logger.warning("Venue API request to %s failed with status %s", url, response.status_code)
+        upstream_errors.inc(call[0], 'status')
+        raise UpstreamError(url)
+    return response.json() if response.status_code == 200 else None
+
+class _RetryTransport(httpx.AsyncBaseTransport):
+    """
+    Async transport retrying like the sync session: failed connects, reads and
+    RETRY_STATUSES responses are retried with urllib3's exponential backoff.
+    """
+
+    def __init__(self, transport, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+        self.transport = transport
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+    async def handle_async_request(self, request):
+        for attempt in range(self.retries + 1):
+            # urllib3 retries the first failure at once
+            if attempt > 1:
+                await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            try:
+                response = await self.transport.handle_async_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError):
+                if attempt == self.retries:
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return response
+            await response.aclose()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+# One async client (and connection pool) per running event loop.
+_async_clients = weakref.WeakKeyDictionary()
+
+def _get_async_client():
+    """
+    Return the pooled async HTTP client bound to the running event loop.
+    :return: httpx.AsyncClient
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool_size = _upstream_settings.get('POOL_SIZE', 32)
+        # The client ignores its own limits when given a transport
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        client = _async_clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0]),
+            transport=_RetryTransport(httpx.AsyncHTTPTransport(limits=limits)),
+        )
+    return client
+
+async def _afetch_json(url):
+    """
+    Async version of ``_fetch_json``.
+    :param url: Absolute URL
+    :return: Decoded JSON, or None on a non-200 response
+    :raises UpstreamError: On a network error, a 5xx response or an open circuit
     """
-    static_url = f"{BASE_URL}{venue_slug}/static"
-    dynamic_url = f"{BASE_URL}{venue_slug}/dynamic"
+    call = _start_call(url)
+    failed = True
+    try:
+        response = await _get_async_client().get(url)
+        failed = response.status_code >= 500
+    except httpx.HTTPError as exc:
+        logger.warning("Venue API request to %s failed: %s", url, exc)
+        upstream_errors.inc(call[0], 'connection')
+        raise UpstreamError(url) from exc
+    finally:
+        _finish_call(call, failed)
+    if response.status_code >= 500:
+        logger.warning("Venue API request to %s failed with status %s", url, response.status_code)
+        upstream_errors.inc(call[0], 'status')
+        raise UpstreamError(url)
+    return response.json() if response.status_code == 200 else None
+
+def _fetch_static(venue_slug):
+    """
+    Fetch static data for a venue from the upstream API.
+    :param venue_slug: Venue slug identifier
+    :return: Static data, or None if the venue could not be fetched
+    """
+    return _fetch_json(f"{BASE_URL}{venue_slug}/static")
+
+def _fetch_dynamic(venue_slug):
+    """
+    Fetch dynamic data for a venue from the upstream API.
+    :param venue_slug: Venue slug identifier
+    :return: Dynamic data, or None if the venue could not be fetched
+    """
+    return _fetch_json(f"{BASE_URL}{venue_slug}/dynamic")
+
+async def _afetch_static(venue_slug):
+    """Async version of ``_fetch_static``."""
+    return await _afetch_json(f"{BASE_URL}{venue_slug}/static")
+
+async def _afetch_dynamic(venue_slug):
+    """Async version of ``_fetch_dynamic``."""
+    return await _afetch_json(f"{BASE_URL}{venue_slug}/dynamic")
+
+def _compile_static(static_data):
+    """
+    Extract what pricing needs from a venue's static data, once per load.
+    :param static_data: Static venue data, or None
+    :return: Tuple (latitude, longitude), or None
+    """
+    if static_data is None:
+        return None
+    try:
+        longitude, latitude = static_data['venue_raw']['location']['coordinates']
+        return float(latitude), float(longitude)
+    except (KeyError, TypeError, ValueError) as exc:
+        logger.error("Venue static data has no usable location: %r", exc)
+        return None
+
+def _compile_dynamic(dynamic_data):
+    """
+    Compile a venue's dynamic data into a PricingTable, once per load.
+    :param dynamic_data: Dynamic venue data, or None
+    :return: PricingTable, or None
+    """
+    if dynamic_data is None:
+        return None
+    try:
+        return compile_pricing(dynamic_data)
+    except PricingSpecError as exc:
+        logger.error("Venue delivery specs rejected: %s", exc)
+        return None
+
+_snapshot_settings = getattr(settings, 'DOPC_VENUE_SNAPSHOTS', {})
+_snapshots_enabled = _snapshot_settings.get('ENABLED', True)
+
+_cache_settings = getattr(settings, 'DOPC_VENUE_CACHE', {})
+_ttls = {
+    VenueSnapshot.STATIC: _cache_settings.get('STATIC_TTL', 3600),
+    VenueSnapshot.DYNAMIC: _cache_settings.get('DYNAMIC_TTL', 60),
+}
+_stale_ttl = _cache_settings.get('STALE_TTL', 300)
+
+# Second tier shared by all worker processes, see settings.CACHES.
+shared_store = None
+if _cache_settings.get('SHARED_ALIAS'):
+    shared_store = SharedVenueStore(
+        _cache_settings['SHARED_ALIAS'], {kind: ttl + _stale_ttl for kind, ttl in _ttls.items()}
+    )
+
+def _store_fetched(venue_slug, kind, payload, entry):
+    """
+    Share a venue payload just fetched from upstream with the other workers, and
+    snapshot it so later workers can start warm. The payload is not kept in
+    this process once it is compiled.
+    :param entry: The payload compiled, or None if it is missing or invalid
+    :return: The entry, unchanged
+    """
+    if entry is not None:
+        if shared_store:
+            shared_store.set(kind, venue_slug, payload)
+        if _snapshots_enabled:
+            save_snapshot(venue_slug, kind, payload)
+    return entry
+
+def _fetch_compiled(venue_slug, kind, fetch, compile_):
+    """
+    Fetch one half of a venue's data from upstream, compile it and share it.
+    :return: The compiled entry, or None
+    """
+    payload = fetch(venue_slug)
+    return _store_fetched(venue_slug, kind, payload, compile_(payload))
+
+async def _afetch_compiled(venue_slug, kind, fetch, compile_):
+    """Async version of ``_fetch_compiled``; ``fetch`` is a coroutine function."""
+    payload = await fetch(venue_slug)
+    return await _astore_fetched(venue_slug, kind, payload, compile_(payload))
+
+# Misses of the same venue in several workers share one upstream load: the
+# worker holding the lease fetches it, the others wait for it in the shared cache.
+_lease_timeout = _cache_settings.get('SHARED_LEASE_TIMEOUT', 5)
+
+shared_waits = registry.counter(
+    'dopc_venue_shared_waits', "Venue loads that waited for another worker's upstream fetch.", ('kind', 'result')
+)
+
+def _lease_delays():
+    """
+    Yield the pauses between reads of the shared cache while another worker
+    holds a lease: short at first, for venues the venue API returns quickly,
+    then backing off until the lease expires.
+    """
+    delay, waited = 0.005, 0.0
+    while waited < _lease_timeout:
+        yield delay
+        waited += delay
+        delay = min(delay * 2, 0.1)
+
+def _lease_outcome(kind, record, leased):
+    """
+    :return: The result of a wait on another worker's lease: 'loaded' once it
+        stored a fresh record, 'released' once the lease is gone without one, or None
+    """
+    if record and record[1] < _ttls[kind]:
+        return 'loaded'
+    return None if leased else 'released'
+
+def _wait_for_lease(kind, venue_slug):
+    """
+    Wait for the worker holding the lease on one half of a venue to load it.
+    :return: The fresh record it stored in the shared cache, or None
+    """
+    for delay in _lease_delays():
+        time.sleep(delay)
+        record, leased = shared_store.get_leased(kind, venue_slug)
+        outcome = _lease_outcome(kind, record, leased)
+        if outcome:
+            break
+    else:
+        outcome = 'expired'
+    shared_waits.inc(kind, outcome)
+    return record if outcome == 'loaded' else None
+
+async def _await_lease(kind, venue_slug):
+    """Async version of ``_wait_for_lease``."""
+    for delay in _lease_delays():
+        await asyncio.sleep(delay)
+        record, leased = await shared_store.aget_leased(kind, venue_slug)
+        outcome = _lease_outcome(kind, record, leased)
+        if outcome:
+            break
+    else:
+        outcome = 'expired'
+    shared_waits.inc(kind, outcome)
+    return record if outcome == 'loaded' else None
+
+def _load(venue_slug, kind, fetch, compile_):
+    """
+    Load one half of a venue's data for the in-process cache: from the shared
+    cache if another worker fetched it within its TTL or is fetching it now,
+    otherwise from upstream.
+    """
+    if not shared_store:
+        return _fetch_compiled(venue_slug, kind, fetch, compile_)
+    record = shared_store.get(kind, venue_slug)
+    if record and record[1] < _ttls[kind]:
+        return compile_(record[0])
+    if not _lease_timeout:
+        return _fetch_compiled(venue_slug, kind, fetch, compile_)
+    if not shared_store.lease(kind, venue_slug, _lease_timeout):
+        record = _wait_for_lease(kind, venue_slug)
+        if record:
+            return compile_(record[0])
+        # The other worker gave up; fetch without holding the lease.
+        return _fetch_compiled(venue_slug, kind, fetch, compile_)
+    try:
+        return _fetch_compiled(venue_slug, kind, fetch, compile_)
+    finally:
+        shared_store.release(kind, venue_slug)
+
+async def _aload(venue_slug, kind, fetch, compile_):
+    """Async version of ``_load``; ``fetch`` is a coroutine function."""
+    if not shared_store:
+        return await _afetch_compiled(venue_slug, kind, fetch, compile_)
+    record = await shared_store.aget(kind, venue_slug)
+    if record and record[1] < _ttls[kind]:
+        return compile_(record[0])
+    if not _lease_timeout:
+        return await _afetch_compiled(venue_slug, kind, fetch, compile_)
+    if not await shared_store.alease(kind, venue_slug, _lease_timeout):
+        record = await _await_lease(kind, venue_slug)
+        if record:
+            return compile_(record[0])
+        return await _afetch_compiled(venue_slug, kind, fetch, compile_)
+    try:
+        return await _afetch_compiled(venue_slug, kind, fetch, compile_)
+    finally:
+        await shared_store.arelease(kind, venue_slug)
 
-    static_response = requests.get(static_url)
-    dynamic_response = requests.get(dynamic_url)
+async def _astore_fetched(venue_slug, kind, payload, entry):
+    """Async version of ``_store_fetched``."""
+    if entry is not None:
+        if shared_store:
+            await shared_store.aset(kind, venue_slug, payload)
+        if _snapshots_enabled:
+            save_snapshot(venue_slug, kind, payload)
+    return entry
 
-    if static_response.status_code == 200 and dynamic_response.status_code == 200:
-        return static_response.json(), dynamic_response.json()
+_venue_index_settings = getattr(settings, 'DOPC_VENUE_INDEX', {})
+
+# Delivery areas of the venues this worker loaded, for the nearby venues endpoint.
+venue_index = VenueIndex(
+    cell_size=_venue_index_settings.get('CELL_SIZE', 0.02),
+    max_cells=_venue_index_settings.get('MAX_CELLS_PER_VENUE', 256),
+    max_venues=_venue_index_settings.get('MAX_VENUES', 20000),
+)
+registry.callback(
+    'dopc_venue_index_venues', "Venues in the venue index.", 'gauge', (), lambda: {(): len(venue_index)},
+)
+
+def _index_venue(venue_slug, static_entry=None, dynamic_entry=None):
+    """
+    Register a venue in the venue index once both halves of its data are cached.
+    :param static_entry: Static entry just loaded, if the cache does not hold it yet
+    :param dynamic_entry: Dynamic entry just loaded, if the cache does not hold it yet
+    """
+    static_entry = static_entry or static_cache.peek(venue_slug)
+    dynamic_entry = dynamic_entry or dynamic_cache.peek(venue_slug)
+    if static_entry and dynamic_entry:
+        venue_index.add(venue_slug, (static_entry, dynamic_entry))
+
+def _indexed(venue_slug, kind, entry):
+    """
+    Keep the venue index in step with a load, including background refreshes.
+    :return: The entry, unchanged
+    """
+    if entry is None:
+        venue_index.remove(venue_slug)
+    elif kind == VenueSnapshot.STATIC:
+        _index_venue(venue_slug, static_entry=entry)
     else:
+        _index_venue(venue_slug, dynamic_entry=entry)
+    return entry
+
+def _load_static(venue_slug):
+    return _indexed(venue_slug, VenueSnapshot.STATIC,
+                    _load(venue_slug, VenueSnapshot.STATIC, _fetch_static, _compile_static))
+
+def _load_dynamic(venue_slug):
+    return _indexed(venue_slug, VenueSnapshot.DYNAMIC,
+                    _load(venue_slug, VenueSnapshot.DYNAMIC, _fetch_dynamic, _compile_dynamic))
+
+async def _aload_static(venue_slug):
+    return _indexed(venue_slug, VenueSnapshot.STATIC,
+                    await _aload(venue_slug, VenueSnapshot.STATIC, _afetch_static, _compile_static))
+
+async def _aload_dynamic(venue_slug):
+    return _indexed(venue_slug, VenueSnapshot.DYNAMIC,
+                    await _aload(venue_slug, VenueSnapshot.DYNAMIC, _afetch_dynamic, _compile_dynamic))
+
+# Coordinates almost never change while delivery specs do, so each half of the
+# venue data is cached with its own TTL. Only the compiled halves are held:
+# (latitude, longitude) tuples and PricingTables shared by venues with the same
+# delivery specs; payloads go to the shared cache and the snapshot store.
+static_cache = VenueCache(
+    _load_static,
+    async_loader=_aload_static,
+    ttl=_ttls[VenueSnapshot.STATIC],
+    stale_ttl=_stale_ttl,
+    max_entries=_cache_settings.get('MAX_ENTRIES', 20000),
+    max_waiters=_cache_settings.get('MAX_WAITERS', 256),
+)
+dynamic_cache = VenueCache(
+    _load_dynamic,
+    async_loader=_aload_dynamic,
+    ttl=_ttls[VenueSnapshot.DYNAMIC],
+    stale_ttl=_stale_ttl,
+    max_entries=_cache_settings.get('MAX_ENTRIES', 20000),
+    max_waiters=_cache_settings.get('MAX_WAITERS', 256),
+)
+
+_venue_caches = {VenueSnapshot.STATIC: static_cache, VenueSnapshot.DYNAMIC: dynamic_cache}
+
+def _venue_cache_lookups():
+    lookups = {}
+    for kind, cache in _venue_caches.items():
+        stats = cache.stats()
+        lookups.update({(kind, 'hit'): stats['hits'], (kind, 'stale'): stats['stale_hits'],
+                        (kind, 'miss'): stats['misses']})
+    return lookups
+
+registry.callback(
+    'dopc_venue_cache_lookups', "In-process venue cache lookups by result.", 'counter',
+    ('kind', 'result'), _venue_cache_lookups,
+)
+registry.callback(
+    'dopc_venue_cache_entries', "Venues held in the in-process cache.", 'gauge',
+    ('kind',), lambda: {(kind,): len(cache) for kind, cache in _venue_caches.items()},
+)
+
+def _venue_load_stats(*fields):
+    def collect():
+        samples = {}
+        for kind, cache in _venue_caches.items():
+            stats = cache.stats()
+            samples.update({(kind, field): stats[field] for field in fields})
+        return samples
+    return collect
+
+registry.callback(
+    'dopc_venue_loads', "In-process venue cache misses that joined a running load (coalesced) or "
+    "were turned away because too many lookups were queued on it (rejected).", 'counter',
+    ('kind', 'result'), _venue_load_stats('coalesced', 'rejected'),
+)
+registry.callback(
+    'dopc_venue_loads_running', "Venue loads running (loading) and lookups queued on them (waiting).", 'gauge',
+    ('kind', 'state'), _venue_load_stats('loading', 'waiting'),
+)
+
+_invalidation_settings = getattr(settings, 'DOPC_INVALIDATION', {})
+
+# Invalidations reach the other worker processes through the shared cache when
+# there is one.
+if shared_store and _invalidation_settings.get('BROADCAST', 'cache') == 'cache':
+    invalidations = CachePublisher(
+        _cache_settings['SHARED_ALIAS'], poll_interval=_invalidation_settings.get('POLL_INTERVAL', 1.0)
+    )
+else:
+    invalidations = LocalPublisher()
+
+invalidations_applied = registry.counter(
+    'dopc_venue_invalidations', "Venue invalidations applied by this process, by scope.", ('scope',)
+)
+
+def _apply_invalidation(message):
+    """
+    Evict venues from the in-process caches when an invalidation is broadcast.
+    :param message: {'venue_slugs': [...]}, {'version': stamp}, or None to evict everything
+    """
+    if message is not None and 'venue_slugs' in message:
+        for venue_slug in message['venue_slugs']:
+            static_cache.invalidate(venue_slug)
+            dynamic_cache.invalidate(venue_slug)
+            venue_index.remove(venue_slug)
+        invalidations_applied.inc('venues')
+        return
+    if shared_store:
+        # A lost message may have been a new version stamp, so read it again
+        shared_store.version = message['version'] if message is not None else None
+    static_cache.clear()
+    dynamic_cache.clear()
+    venue_index.clear()
+    invalidations_applied.inc('all')
+
+invalidations.subscribe(_apply_invalidation)
+
+def invalidate_venues(venue_slugs=None, version=None, refresh=False):
+    """
+    Evict venues from every cache tier of every worker process: the in-process
+    caches, the shared cache and the snapshot store. Quotes cached by the views
+    and distance bands are keyed by the venue data itself, so they are never
+    served for data that changed.
+    :param venue_slugs: Iterable of venue slug identifiers to evict
+    :param version: New version stamp of the venue data, evicting every venue;
+        used when ``venue_slugs`` is None
+    :param refresh: Reload the evicted venues from upstream in the background
+    :return: List of futures of the reloads, one per venue and kind
+    """
+    if venue_slugs is None:
+        if shared_store:
+            shared_store.set_version(version)
+        if _snapshots_enabled:
+            delete_snapshots()
+        invalidations.publish({'version': version})
+        return []
+
+    venue_slugs = list(dict.fromkeys(venue_slugs))
+    if shared_store:
+        for venue_slug in venue_slugs:
+            for kind in _ttls:
+                shared_store.delete(kind, venue_slug)
+    if _snapshots_enabled:
+        delete_snapshots(venue_slugs)
+    invalidations.publish({'venue_slugs': venue_slugs})
+    if not refresh:
+        return []
+    # Each half is its own task: a task waiting on another one of the same pool
+    # deadlocks it once every thread waits.
+    return [_fetch_executor.submit(cache.refresh, venue_slug)
+            for venue_slug in venue_slugs for cache in (static_cache, dynamic_cache)]
+
+_warm_lock = threading.Lock()
+_warmed = not _snapshots_enabled
+
+def warm_from_snapshots():
+    """
+    Fill the venue caches from the snapshot store, once per process.
+
+    Snapshots are primed as due for refresh, so they are served immediately
+    while the first lookup of each venue refreshes it in the background.
+    Concurrent first lookups wait until the caches are filled.
+    """
+    global _warmed
+    with _warm_lock:
+        if _warmed:
+            return
+        try:
+            snapshots = load_snapshots(
+                max_age=_snapshot_settings.get('MAX_AGE', 86400),
+                limit=max(static_cache.max_entries, dynamic_cache.max_entries),
+            )
+            for kind, cache, compile_ in ((VenueSnapshot.STATIC, static_cache, _compile_static),
+                                          (VenueSnapshot.DYNAMIC, dynamic_cache, _compile_dynamic)):
+                for venue_slug, payload, age in snapshots[kind]:
+                    entry = compile_(payload)
+                    if entry is not None:
+                        cache.prime(venue_slug, entry, age)
+            for venue_slug, _, _ in snapshots[VenueSnapshot.STATIC]:
+                _index_venue(venue_slug)
+        finally:
+            # Set last, so lookups checking it without the lock never skip the snapshots
+            _warmed = True
+
+def _prime_from_shared(records):
+    """
+    Put venue payloads read from the shared cache into the in-process caches.
+    :param records: Dict mapping (kind, venue_slug) to a tuple (payload, age in seconds)
+    """
+    for (kind, venue_slug), (payload, age) in records.items():
+        if kind == VenueSnapshot.STATIC:
+            cache, entry = static_cache, _compile_static(payload)
+        else:
+            cache, entry = dynamic_cache, _compile_dynamic(payload)
+        if entry is not None:
+            cache.prime(venue_slug, entry, age)
+    for venue_slug in {venue_slug for _, venue_slug in records}:
+        _index_venue(venue_slug)
+
+def _cold_slugs(venue_slugs):
+    """
+    :return: The venue slugs missing from both in-process caches
+    """
+    return [slug for slug in venue_slugs if slug not in static_cache and slug not in dynamic_cache]
+
+def venue_is_cached(venue_slug):
+    """
+    :return: Whether both halves of a venue are held in process, however old, so quoting it rarely waits on the venue API
+    """
+    return venue_slug in static_cache and venue_slug in dynamic_cache
+
+def _entry_within_budget(cache, venue_slug, future):
+    """
+    Resolve a load started with ``VenueCache.submit`` once the request's upstream budget is spent.
+    :return: The loaded entry, the last known good entry if the load is still running, or None
+    """
+    if not future.done():
+        budget_exceeded.inc()
+        return cache.peek(venue_slug)
+    try:
+        return future.result()
+    except UpstreamError:
+        return None
+
+def _get_entries(venue_slug):
+    """
+    Look up both cache entries of a venue, loading missing ones concurrently
+    within the upstream budget.
+    :param venue_slug: Venue slug identifier
+    :return: Tuple (static_entry, dynamic_entry), or None if either is unavailable
+    """
+    invalidations.poll()
+    if not _warmed:
+        warm_from_snapshots()
+    if shared_store and _cold_slugs([venue_slug]):
+        _prime_from_shared(shared_store.get_many([venue_slug]))
+    static_future = static_cache.submit(venue_slug, _fetch_executor)
+    dynamic_future = dynamic_cache.submit(venue_slug, _fetch_executor)
+    wait((static_future, dynamic_future), timeout=REQUEST_BUDGET)
+    static_entry = _entry_within_budget(static_cache, venue_slug, static_future)
+    dynamic_entry = _entry_within_budget(dynamic_cache, venue_slug, dynamic_future)
+
+    if static_entry and dynamic_entry:
+        return static_entry, dynamic_entry
+    return None
+
+# Loads that outlive their request's budget, kept referenced until they finish.
+_background_loads = set()
+
+def _finish_background_load(task):
+    _background_loads.discard(task)
+    if not task.cancelled():
+        task.exception()  # Logged by the load itself
+
+async def _aget_entries(venue_slug):
+    """Async version of ``_get_entries``."""
+    # Reads the shared cache at most once per poll interval
+    await invalidations.apoll()
+    if not _warmed:
+        # The snapshot store is a sync database; keep it off the event loop.
+        await asyncio.wrap_future(_fetch_executor.submit(warm_from_snapshots))
+    if shared_store and _cold_slugs([venue_slug]):
+        _prime_from_shared(await shared_store.aget_many([venue_slug]))
+    loads = {
+        static_cache: asyncio.ensure_future(static_cache.aget(venue_slug)),
+        dynamic_cache: asyncio.ensure_future(dynamic_cache.aget(venue_slug)),
+    }
+    await asyncio.wait(loads.values(), timeout=REQUEST_BUDGET)
+    entries = []
+    for cache, load in loads.items():
+        if not load.done():
+            _background_loads.add(load)
+            load.add_done_callback(_finish_background_load)
+        entries.append(_entry_within_budget(cache, venue_slug, load))
+    static_entry, dynamic_entry = entries
+
+    if static_entry and dynamic_entry:
+        return static_entry, dynamic_entry
+    return None
+
+def _venue_documents(entries):
+    """
+    Rebuild the parts of a venue's static and dynamic data used for pricing, in
+    the venue API's layout.
+    :param entries: Tuple (static_entry, dynamic_entry), or None
+    :return: Tuple (static_data, dynamic_data)
+    """
+    if not entries:
         return None, None
+    (latitude, longitude), pricing = entries
+    return (
+        {'venue_raw': {'location': {'coordinates': [longitude, latitude]}}},
+        {'venue_raw': {'delivery_specs': pricing.delivery_specs()}},
+    )
+
+def fetch_venue_data(venue_slug):
+    """
+    Fetch static and dynamic data for a given venue, served from the venue cache when possible.
+
+    Only what pricing needs is kept once a venue is loaded, so the data holds the
+    venue's location and delivery specs; other fields of the venue API's
+    documents are left out.
+    :param venue_slug: Venue slug identifier
+    :return: Tuple (static_data, dynamic_data)
+    """
+    return _venue_documents(_get_entries(venue_slug))
+
+async def afetch_venue_data(venue_slug):
+    """
+    Async version of ``fetch_venue_data`` for ASGI deployments.
+    :param venue_slug: Venue slug identifier
+    :return: Tuple (static_data, dynamic_data)
+    """
+    return _venue_documents(await _aget_entries(venue_slug))
+
+def fetch_venue(venue_slug):
+    """
+    Fetch the compiled venue data used for pricing.
+    :param venue_slug: Venue slug identifier
+    :return: Tuple ((latitude, longitude), PricingTable), or None if the venue is unavailable
+    """
+    return _get_entries(venue_slug)
+
+async def afetch_venue(venue_slug):
+    """
+    Async version of ``fetch_venue`` for ASGI deployments.
+    :param venue_slug: Venue slug identifier
+    :return: Tuple ((latitude, longitude), PricingTable), or None if the venue is unavailable
+    """
+    return await _aget_entries(venue_slug)
+
+def refresh_venue(venue_slug):
+    """
+    Reload a venue from the upstream API into the caches and the snapshot store,
+    even if it is already cached. Waits on the fetch pool, so it must not run on it.
+    :param venue_slug: Venue slug identifier
+    :return: Tuple ((latitude, longitude), PricingTable), or None if the venue does not exist
+    :raises UpstreamError: If the venue API is unavailable
+    """
+    static_future = _fetch_executor.submit(static_cache.refresh, venue_slug)
+    dynamic_entry = dynamic_cache.refresh(venue_slug)
+    static_entry = static_future.result()
+    return (static_entry, dynamic_entry) if static_entry and dynamic_entry else None
+
+def fetch_many_venues(venue_slugs):
+    """
+    Fetch the compiled venue data of several venues concurrently.
+    :param venue_slugs: Iterable of venue slug identifiers
+    :return: Dict mapping each venue slug to a tuple ((latitude, longitude), PricingTable),
+        or None if the venue is unavailable
+    """
+    invalidations.poll()
+    if not _warmed:
+        warm_from_snapshots()
+    cold_slugs = _cold_slugs(venue_slugs)
+    if shared_store and cold_slugs:
+        _prime_from_shared(shared_store.get_many(cold_slugs))
+    futures = {
+        venue_slug: (
+            static_cache.submit(venue_slug, _fetch_executor),
+            dynamic_cache.submit(venue_slug, _fetch_executor),
+        )
+        for venue_slug in venue_slugs
+    }
+    wait([future for pair in futures.values() for future in pair], timeout=REQUEST_BUDGET)
+    venues = {}
+    for venue_slug, (static_future, dynamic_future) in futures.items():
+        static_entry = _entry_within_budget(static_cache, venue_slug, static_future)
+        dynamic_entry = _entry_within_budget(dynamic_cache, venue_slug, dynamic_future)
+        venues[venue_slug] = (static_entry, dynamic_entry) if static_entry and dynamic_entry else None
+    return venues
+
+def fetch_nearby_venues(latitude, longitude):
+    """
+    Fetch the compiled venue data of the loaded venues that may deliver to a location.
+
+    Candidates come from the venue index, so venues further away than they
+    deliver are neither fetched nor priced.
+    :param latitude: Latitude of the user's location
+    :param longitude: Longitude of the user's location
+    :return: Dict mapping each candidate venue slug to a tuple ((latitude, longitude),
+        PricingTable), or None if the venue is unavailable
+    """
+    invalidations.poll()
+    if not _warmed:
+        warm_from_snapshots()
+    candidates = venue_index.candidates(latitude, longitude)
+    return fetch_many_venues(candidates) if candidates else {}
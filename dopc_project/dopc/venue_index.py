@@ -0,0 +1,180 @@
+"""
+Spatial index of the venues a worker has loaded, for quoting many venues to one user.
+
+The world is divided into cells of ``cell_size`` degrees. Each venue is
+registered in every cell touched by the bounding box of its delivery area,
+the disc of radius ``PricingTable.max_distance`` around it, so looking up a
+user's location reads one cell and checks each candidate's box; venues further
+away than they deliver are pruned without computing a distance.
+
+Boxes are conservative. No point within ``d`` meters of a venue differs from
+it by more than ``d / 110 574 m`` degrees of latitude, the shortest meridian
+degree on the WGS-84 ellipsoid, nor by more than ``d / (111 319 m * cos(phi))``
+degrees of longitude, where ``phi`` is the highest latitude within that
+distance. Candidates can still be slightly out of range and are priced with the
+exact distance, which rejects them.
+
+Venues whose box would cover more than ``max_cells`` cells (very large
+delivery areas, or near the poles) are checked on every lookup instead. At
+most ``max_venues`` venues are indexed, evicting the least recently added.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+_MIN_METERS_PER_DEGREE_LATITUDE = 110_574
+_METERS_PER_DEGREE_LONGITUDE = 111_319.49  # At the equator, the minimum of N * pi / 180
+
+# Meters added to every radius, so the bounds never depend on rounding.
+_MARGIN = 1
+
+
+class VenueIndex:
+    """
+    Grid of venue delivery areas.
+
+    Safe to use from any thread. Indexed venues are tuples ((latitude,
+    longitude), PricingTable); callers re-fetch candidates before pricing, so a
+    venue whose data changed since it was indexed is priced with its current data.
+    """
+
+    def __init__(self, cell_size=0.02, max_cells=256, max_venues=20000):
+        """
+        :param cell_size: Cell edge in degrees; 360 must be a multiple of it
+        :param max_cells: Maximum number of cells a venue is registered in
+        :param max_venues: Maximum number of venues indexed
+        """
+        columns = 360 / cell_size
+        if cell_size <= 0 or abs(columns - round(columns)) > 1e-6:
+            raise ValueError(f"Cell size must divide 360 degrees, got {cell_size!r}")
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.max_venues = max_venues
+        self._columns = round(columns)
+        self._venues = OrderedDict()  # venue_slug -> (venue, spans of its box)
+        self._cells = {}  # row * columns + column -> list of venue slugs, smaller than sets
+        self._wide = set()  # Venue slugs checked on every lookup
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._venues)
+
+    def __contains__(self, venue_slug):
+        with self._lock:
+            return venue_slug in self._venues
+
+    def add(self, venue_slug, venue):
+        """
+        Index a venue, or update it if it is already indexed.
+        :param venue_slug: Venue slug identifier
+        :param venue: Tuple ((latitude, longitude), PricingTable)
+        """
+        with self._lock:
+            indexed = self._venues.get(venue_slug)
+            if indexed is not None:
+                # New pricing with the same location and reach keeps the cells
+                old, spans = indexed
+                if old[0] == venue[0] and old[1].max_distance == venue[1].max_distance:
+                    self._venues[venue_slug] = (venue, spans)
+                    self._venues.move_to_end(venue_slug)
+                    return
+                self._unregister(venue_slug)
+            spans = _spans(venue)
+            cells = self._box_cells(venue[0], spans)
+            if cells is None:
+                self._wide.add(venue_slug)
+            else:
+                for cell in cells:
+                    self._cells.setdefault(cell, []).append(venue_slug)
+            self._venues[venue_slug] = (venue, spans)
+            while len(self._venues) > self.max_venues:
+                self._unregister(next(iter(self._venues)))
+
+    def remove(self, venue_slug):
+        with self._lock:
+            if venue_slug in self._venues:
+                self._unregister(venue_slug)
+
+    def clear(self):
+        with self._lock:
+            self._venues.clear()
+            self._cells.clear()
+            self._wide.clear()
+
+    def cells(self):
+        """
+        :return: Number of cells holding at least one venue
+        """
+        with self._lock:
+            return len(self._cells)
+
+    def candidates(self, latitude, longitude):
+        """
+        Venues whose delivery area may include a location.
+        :return: Dict mapping venue slug to the indexed tuple ((latitude, longitude), PricingTable)
+        """
+        cell = self._cell(math.floor(latitude / self.cell_size), math.floor((longitude + 180) / self.cell_size))
+        candidates = {}
+        with self._lock:
+            for venue_slugs in (self._cells.get(cell, ()), self._wide):
+                for venue_slug in venue_slugs:
+                    venue, spans = self._venues[venue_slug]
+                    if _in_box(venue[0], spans, latitude, longitude):
+                        candidates[venue_slug] = venue
+        return candidates
+
+    def _unregister(self, venue_slug):
+        # Cells are found again from the box rather than kept per venue
+        venue, spans = self._venues.pop(venue_slug)
+        cells = self._box_cells(venue[0], spans)
+        if cells is None:
+            self._wide.discard(venue_slug)
+            return
+        for cell in cells:
+            venue_slugs = self._cells[cell]
+            venue_slugs.remove(venue_slug)
+            if not venue_slugs:
+                del self._cells[cell]
+
+    def _box_cells(self, coordinates, spans):
+        """
+        :return: Set of the cells the box touches, or None if there are more than ``max_cells``
+        """
+        (latitude, longitude), (latitude_span, longitude_span) = coordinates, spans
+        if longitude_span is None:
+            return None
+        size = self.cell_size
+        rows = range(math.floor((latitude - latitude_span) / size), math.floor((latitude + latitude_span) / size) + 1)
+        columns = range(math.floor((longitude - longitude_span + 180) / size),
+                        math.floor((longitude + longitude_span + 180) / size) + 1)
+        if len(rows) * len(columns) > self.max_cells:
+            return None
+        # A set, as a box almost as wide as the world could wrap onto its own first column
+        return {self._cell(row, column) for row in rows for column in columns}
+
+    def _cell(self, row, column):
+        # Columns wrap around the antimeridian
+        return row * self._columns + column % self._columns
+
+
+def _spans(venue):
+    """
+    :return: Tuple (latitude span, longitude span or None for every longitude) of
+        the box around the venue's delivery area, in degrees either side of it
+    """
+    (latitude, _), pricing = venue
+    radius = pricing.max_distance + _MARGIN
+    latitude_span = radius / _MIN_METERS_PER_DEGREE_LATITUDE
+    highest = abs(latitude) + latitude_span
+    if highest >= 90:
+        return latitude_span, None
+    longitude_span = radius / (_METERS_PER_DEGREE_LONGITUDE * math.cos(math.radians(highest)))
+    return latitude_span, longitude_span if longitude_span < 180 else None
+
+
+def _in_box(coordinates, spans, latitude, longitude):
+    (venue_latitude, venue_longitude), (latitude_span, longitude_span) = coordinates, spans
+    if abs(latitude - venue_latitude) > latitude_span:
+        return False
+    return longitude_span is None or abs((longitude - venue_longitude + 180) % 360 - 180) <= longitude_span
@@ -1,10 +1,122 @@
-from django.http import JsonResponse
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from .utils import calculate_distance
-from .utils import fetch_venue_data
-BASE_URL = "https://consumer-api.development.dev.woltapi.com/home-assignment-api/v1/venues/"
+from . import core
+from .encoding import get_backend
+from .metrics import instrument, registry, timed
+from .response_cache import ResponseCache
+from .utils import batch_distance_engine, calculate_delivery_distance
+from .utils import afetch_venue, fetch_venue, fetch_many_venues, fetch_nearby_venues, invalidate_venues
+
+_response_cache_settings = getattr(settings, 'DOPC_RESPONSE_CACHE', {})
+
+# Identical quotes within a few seconds (client retries and polling) reuse the
+# encoded response while the venue data they were priced with is unchanged.
+response_cache = None
+if _response_cache_settings.get('ENABLED', False):
+    response_cache = ResponseCache(
+        ttl=_response_cache_settings.get('TTL', 5),
+        precision=_response_cache_settings.get('COORDINATE_PRECISION', 6),
+        max_entries=_response_cache_settings.get('MAX_ENTRIES', 10000),
+    )
+    registry.callback(
+        'dopc_response_cache_lookups', "Response cache lookups by result.", 'counter', ('result',),
+        lambda: {('hit',): response_cache.hits, ('miss',): response_cache.misses},
+    )
+    registry.callback(
+        'dopc_response_cache_entries', "Responses held in the response cache.", 'gauge', (),
+        lambda: {(): response_cache.stats()['entries']},
+    )
+
+# Per-stage durations are always recorded for /metrics; the Server-Timing
+# header exposes them to clients and is meant for debugging.
+_server_timing = getattr(settings, 'DOPC_METRICS', {}).get('SERVER_TIMING', False)
+
+dumps, loads = get_backend(getattr(settings, 'DOPC_JSON', {}).get('BACKEND', 'auto'))
+
+# Every error message is a constant, so error bodies are encoded once.
+_error_bodies = {
+    message: dumps({'error': message})
+    for message in core.ERRORS + (
+        'Invalid request method',
+        'Invalid request body',
+        'Too many orders in batch',
+        'Invalid credentials',
+        'Invalidation is disabled',
+    )
+}
+
+def _json_response(body, status=200):
+    """
+    Build a JSON response from encoded bytes or a body to encode.
+    Args:
+        body (bytes | dict): The encoded body, or a JSON-serializable body.
+        status (int): The HTTP status code.
+    Returns:
+        HttpResponse: The JSON response.
+    """
+    if not isinstance(body, bytes):
+        body = dumps(body)
+    return HttpResponse(body, status=status, content_type='application/json')
+
+def _error_response(message, status=400):
+    """
+    Build the response for an error message.
+    Args:
+        message (str): The error message.
+        status (int): The HTTP status code.
+    Returns:
+        HttpResponse: A JSON response with the error message.
+    """
+    body = _error_bodies.get(message)
+    return _json_response(body if body is not None else {'error': message}, status)
+
+def _price_response(venue_slug, cart_value, user_lat, user_lon, venue):
+    """
+    Price an order against fetched venue data, reusing a recent identical quote when
+    the response cache is enabled.
+    Args:
+        venue_slug (str): The slug identifier for the venue.
+        cart_value (int): The value of the items in the cart.
+        user_lat (float): The latitude of the user's location.
+        user_lon (float): The longitude of the user's location.
+        venue (tuple): The venue's (coordinates, PricingTable), or None if it could not be fetched.
+    Returns:
+        HttpResponse: The price breakdown, or an error response.
+    """
+    if not venue:
+        return _error_response(core.VENUE_UNAVAILABLE)
+    pricing = venue[1]
+
+    if response_cache:
+        key = response_cache.key(venue_slug, cart_value, user_lat, user_lon)
+        # Compared by value: the coordinates and the interned PricingTable of the venue
+        cached = response_cache.get(key, venue)
+        if cached:
+            response = _json_response(cached[0], cached[1])
+            response['X-Cache'] = 'HIT'
+            return response
+
+    # Calculate distance
+    with timed('distance'):
+        delivery_distance, range_index = calculate_delivery_distance(venue_slug, venue, (user_lat, user_lon))
+    with timed('fee'):
+        body, status = core.price_order(cart_value, delivery_distance, pricing, range_index)
+    with timed('serialize'):
+        if status == 200:
+            response = _json_response(body)
+        else:
+            response = _error_response(body['error'], status)
+
+    if response_cache:
+        response_cache.set(key, venue, response.content, status)
+        response['X-Cache'] = 'MISS'
+    return response
 
 @csrf_exempt
+@instrument('price', server_timing=_server_timing)
 def calculate_price(request):
     """
     Calculate the total price for a delivery order based on the cart value, user location, and venue data.
@@ -15,7 +127,7 @@ def calculate_price(request):
             - user_lat (float): The latitude of the user's location.
             - user_lon (float): The longitude of the user's location.
     Returns:
-        JsonResponse: A JSON response containing:
+        HttpResponse: A JSON response containing:
             - total_price (int): The total price including cart value, small order surcharge, and delivery fee.
             - small_order_surcharge (int): The surcharge applied if the cart value is below the minimum order value.
             - cart_value (int): The value of the items in the cart.
@@ -23,7 +135,7 @@ def calculate_price(request):
                 - fee (int): The delivery fee based on the distance.
                 - distance (int): The calculated delivery distance.
     Raises:
-        JsonResponse: A JSON response with an error message and appropriate HTTP status code in case of:
+        HttpResponse: A JSON response with an error message and appropriate HTTP status code in case of:
             - Invalid parameter data type (400)
             - Invalid cart value (400)
             - Unable to fetch venue data (400)
@@ -32,62 +144,202 @@ def calculate_price(request):
             - Invalid request method (405)
     """
     if request.method == 'GET':
-        try:
-            # Get query parameters
-            venue_slug = request.GET.get('venue_slug')
-            cart_value = int(float(request.GET.get('cart_value')))
-            user_lat = float(request.GET.get('user_lat'))
-            user_lon = float(request.GET.get('user_lon'))
-        except Exception as e:
-            return JsonResponse({'error': 'Invalid parameter data type'}, status=400)
-
-        try:
-            if cart_value <= 0:
-                raise ValueError("Cart value must be a positive integer")
-            if user_lat < -90 or user_lat > 90 or user_lon < -180 or user_lon > 180:
-                raise ValueError("Invalid user location coordinates")
-        except (ValueError, TypeError):
-            return JsonResponse({'error': 'Invalid cart value'}, status=400)
+        order, error = core.parse_order(request.GET)
+        if error:
+            return _error_response(error)
+        venue_slug, cart_value, user_lat, user_lon = order
 
         # Fetch venue data
-        static_data, dynamic_data = fetch_venue_data(venue_slug)
-        if not static_data or not dynamic_data:
-            return JsonResponse({'error': 'Unable to fetch venue data'}, status=400)
-
-        # Extract relevant data
-        venue_coordinates = tuple(static_data['venue_raw']['location']['coordinates'][::-1])
-        order_minimum = dynamic_data['venue_raw']['delivery_specs']['order_minimum_no_surcharge']
-        base_price = dynamic_data['venue_raw']['delivery_specs']['delivery_pricing']['base_price']
-        distance_ranges = dynamic_data['venue_raw']['delivery_specs']['delivery_pricing']['distance_ranges']
-        max_distance = distance_ranges[-1]['min']
-        # Calculate distance
-        delivery_distance = calculate_distance((user_lat, user_lon), venue_coordinates)
-        if delivery_distance > max_distance:
-            return JsonResponse({'error': 'Delivery distance exceeds the allowed range.'}, status=400)
-
-        # Find the applicable range for the delivery fee
-        for range_ in distance_ranges:
-            if range_['min'] <= delivery_distance < range_['max'] or range_['max'] == 0:
-                delivery_fee = base_price + range_['a'] + round(range_['b'] * delivery_distance / 10)
-                break
-        else:
-            return JsonResponse({'error': 'Delivery not available for this distance'}, status=400)
-
-        # Calculate small order surcharge
-        small_order_surcharge = max(0, order_minimum - cart_value)
-
-        # Calculate total price
-        total_price = cart_value + small_order_surcharge + delivery_fee
-
-        response = {
-            'total_price': total_price,
-            'small_order_surcharge': small_order_surcharge,
-            'cart_value': cart_value,
-            'delivery': {
-                'fee': delivery_fee,
-                'distance': delivery_distance
-            }
-        }
-        return JsonResponse(response)
+        with timed('fetch'):
+            venue = fetch_venue(venue_slug)
+        return _price_response(venue_slug, cart_value, user_lat, user_lon, venue)
     else:
-        return JsonResponse({'error': 'Invalid request method'}, status=405)
+        return _error_response('Invalid request method', 405)
+
+@csrf_exempt
+@instrument('price', server_timing=_server_timing)
+async def calculate_price_async(request):
+    """
+    Async version of ``calculate_price`` for ASGI deployments.
+
+    Venue data is fetched without blocking the event loop, and the responses
+    are identical to the sync view.
+    Args:
+        request (HttpRequest): The HTTP request object, see ``calculate_price``.
+    Returns:
+        HttpResponse: See ``calculate_price``.
+    """
+    if request.method == 'GET':
+        order, error = core.parse_order(request.GET)
+        if error:
+            return _error_response(error)
+        venue_slug, cart_value, user_lat, user_lon = order
+
+        # Fetch venue data
+        with timed('fetch'):
+            venue = await afetch_venue(venue_slug)
+        return _price_response(venue_slug, cart_value, user_lat, user_lon, venue)
+    else:
+        return _error_response('Invalid request method', 405)
+
+@csrf_exempt
+@instrument('batch', server_timing=_server_timing)
+def calculate_price_batch(request):
+    """
+    Calculate delivery order prices for many orders in one request.
+
+    Orders are grouped by venue so each venue is fetched once, and the
+    distances of all orders for a venue are computed in one vectorized pass.
+    Args:
+        request (HttpRequest): A POST request whose body is a JSON array of objects with
+            the same fields as the ``calculate_price`` query parameters.
+    Returns:
+        HttpResponse: A JSON object with a ``results`` array in input order. Each result is
+            either the ``calculate_price`` response body or ``{"error": ..., "status": 400}``.
+    Raises:
+        HttpResponse: A JSON response with an error message and appropriate HTTP status code in case of:
+            - Invalid request body (400)
+            - Too many orders in batch (400)
+            - Invalid request method (405)
+    """
+    if request.method != 'POST':
+        return _error_response('Invalid request method', 405)
+
+    try:
+        items = loads(request.body)
+        if not isinstance(items, list):
+            raise ValueError("Batch must be a JSON array")
+    except ValueError:
+        return _error_response('Invalid request body')
+    if len(items) > getattr(settings, 'DOPC_BATCH_MAX_ITEMS', 1000):
+        return _error_response('Too many orders in batch')
+
+    results = [None] * len(items)
+    orders, indices = [], []
+    for index, item in enumerate(items):
+        if isinstance(item, dict) and isinstance(item.get('venue_slug'), str):
+            order, error = core.parse_order(item)
+        else:
+            order, error = None, core.INVALID_PARAMETERS
+        if error:
+            results[index] = {'error': error, 'status': 400}
+        else:
+            orders.append(order)
+            indices.append(index)
+
+    with timed('fetch'):
+        venues = fetch_many_venues(dict.fromkeys(order[0] for order in orders))
+    with timed('distance'):
+        quotes = core.quote_orders(orders, venues, batch_distance_engine)
+    for index, (body, status) in zip(indices, quotes):
+        results[index] = body if status == 200 else dict(body, status=status)
+
+    with timed('serialize'):
+        return _json_response({'results': results})
+
+_venue_index_settings = getattr(settings, 'DOPC_VENUE_INDEX', {})
+
+@instrument('nearby', server_timing=_server_timing)
+def nearby_venues(request):
+    """
+    Quote a cart at every loaded venue delivering to the user, cheapest or nearest first.
+
+    Venues are looked up in the venue index, which prunes the venues further
+    away than they deliver before any distance is computed.
+    Args:
+        request (HttpRequest): The HTTP request object containing query parameters:
+            - cart_value (int): The value of the items in the cart.
+            - user_lat (float): The latitude of the user's location.
+            - user_lon (float): The longitude of the user's location.
+            - order_by (str): Optional, 'price' (default) or 'distance'.
+            - limit (int): Optional, the maximum number of venues returned.
+    Returns:
+        HttpResponse: A JSON object with a ``venues`` array, each item the ``calculate_price``
+            response body with the ``venue_slug``.
+    Raises:
+        HttpResponse: A JSON response with an error message and appropriate HTTP status code in case of:
+            - Invalid parameter data type (400)
+            - Invalid cart value (400)
+            - Invalid request method (405)
+    """
+    if request.method != 'GET':
+        return _error_response('Invalid request method', 405)
+    order, error = core.parse_order(request.GET)
+    if error:
+        return _error_response(error)
+    _, cart_value, user_lat, user_lon = order
+    max_results = _venue_index_settings.get('MAX_RESULTS', 100)
+    order_by = request.GET.get('order_by', 'price')
+    try:
+        limit = int(request.GET.get('limit', max_results))
+    except ValueError:
+        return _error_response(core.INVALID_PARAMETERS)
+    if order_by not in core.ORDERINGS or limit <= 0:
+        return _error_response(core.INVALID_PARAMETERS)
+
+    with timed('fetch'):
+        venues = fetch_nearby_venues(user_lat, user_lon)
+    with timed('distance'):
+        quotes = core.quote_venues(venues, cart_value, user_lat, user_lon, order_by, min(limit, max_results),
+                                   batch_distance_engine)
+    with timed('serialize'):
+        return _json_response({'venues': [dict(venue_slug=venue_slug, **body) for venue_slug, body in quotes]})
+
+_invalidation_settings = getattr(settings, 'DOPC_INVALIDATION', {})
+
+@csrf_exempt
+def invalidate(request):
+    """
+    Evict venues from the caches of every worker process, for the venue data
+    service to call when venues change.
+    Args:
+        request (HttpRequest): A POST request with an ``Authorization: Bearer <token>`` header
+            and a JSON object body with either:
+            - venue_slugs (list): The slugs of the venues to evict, and optionally
+              refresh (bool) to reload them from the venue API right away.
+            - version (str): A new version stamp of the venue data, evicting every venue.
+    Returns:
+        HttpResponse: A 202 JSON response echoing ``venue_slugs`` or ``version``.
+    Raises:
+        HttpResponse: A JSON response with an error message and appropriate HTTP status code in case of:
+            - Invalid request body (400)
+            - Invalid credentials (401)
+            - Invalidation is disabled (403)
+            - Invalid request method (405)
+    """
+    if request.method != 'POST':
+        return _error_response('Invalid request method', 405)
+    token = _invalidation_settings.get('TOKEN')
+    if not token:
+        return _error_response('Invalidation is disabled', 403)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return _error_response('Invalid credentials', 401)
+
+    try:
+        body = loads(request.body)
+        venue_slugs, version = body.get('venue_slugs'), body.get('version')
+        if venue_slugs is not None:
+            if (not isinstance(venue_slugs, list) or not venue_slugs
+                    or len(venue_slugs) > _invalidation_settings.get('MAX_VENUES', 1000)
+                    or not all(isinstance(venue_slug, str) and venue_slug for venue_slug in venue_slugs)):
+                raise ValueError("venue_slugs must be a non-empty list of venue slugs")
+        elif not isinstance(version, str) or not 0 < len(version) <= 64:
+            raise ValueError("Either venue_slugs or a version stamp is required")
+    except (ValueError, AttributeError):
+        return _error_response('Invalid request body')
+
+    if venue_slugs is not None:
+        invalidate_venues(venue_slugs, refresh=body.get('refresh') is True)
+        return _json_response({'venue_slugs': venue_slugs}, 202)
+    invalidate_venues(version=version)
+    return _json_response({'version': version}, 202)
+
+def metrics(request):
+    """
+    Expose the metrics of this process to Prometheus.
+    Args:
+        request (HttpRequest): The HTTP request object.
+    Returns:
+        HttpResponse: Every metric in the Prometheus text exposition format.
+    """
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
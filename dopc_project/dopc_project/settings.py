@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'dopc.middleware.AdmissionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +88,42 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The 'venues' cache is shared by all worker processes. Point
+# DOPC_VENUE_CACHE_URL at Redis (redis://...) or Memcached (memcached://host:port)
+# in production; without it a file-based cache in the temp directory is shared
+# by the workers of one host.
+
+_venue_cache_url = os.environ.get('DOPC_VENUE_CACHE_URL', '')
+if _venue_cache_url.startswith(('redis://', 'rediss://')):
+    _venue_cache = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': _venue_cache_url,
+    }
+elif _venue_cache_url.startswith('memcached://'):
+    _venue_cache = {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': _venue_cache_url.removeprefix('memcached://'),
+    }
+else:
+    _venue_cache = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'dopc_venue_cache',
+        # Past MAX_ENTRIES files every write deletes a random third of them,
+        # invalidation log included. Room for both halves of the
+        # DOPC_VENUE_CACHE['MAX_ENTRIES'] venues, their leases and the log.
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'venues': _venue_cache,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -126,3 +164,189 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Serve the native async views. Enabled by asgi.py; WSGI deployments keep the
+# sync views.
+
+DOPC_ASYNC_VIEWS = os.environ.get('DOPC_ASYNC_VIEWS', '0') == '1'
+
+
+# Distance engine, see dopc/distance.py for the modes and their error bounds
+# MODE is used for single quotes and BATCH_MODE for batches. TOLERANCE is the
+# largest difference in whole meters allowed versus the exact geodesic.
+
+DOPC_DISTANCE = {
+    'MODE': 'geodesic',
+    'BATCH_MODE': 'vincenty',
+    'TOLERANCE': 0,
+}
+
+
+# Distance band index, see dopc/distance_index.py
+# Quantizes user locations into cells of CELL_SIZE degrees per venue. Quotes
+# from cells out of the venue's range skip the distance calculation, quotes
+# from cells within one distance range use the MODE engine. Each cell costs
+# about 80 bytes.
+
+DOPC_DISTANCE_INDEX = {
+    'ENABLED': False,
+    'CELL_SIZE': 0.0005,
+    'MODE': 'lambert',
+    'MAX_CELLS_PER_VENUE': 4096,
+    'MAX_VENUES': 256,
+}
+
+
+# Response cache for identical quotes, keyed on the request parameters with
+# coordinates rounded to COORDINATE_PRECISION decimals (6 is about 0.1 m).
+# Entries live for TTL seconds and are dropped as soon as the venue's location
+# or pricing changes. Responses carry X-Cache: HIT or MISS while enabled.
+
+DOPC_RESPONSE_CACHE = {
+    'ENABLED': False,
+    'TTL': 5,
+    'COORDINATE_PRECISION': 6,
+    'MAX_ENTRIES': 10000,
+}
+
+
+# Index of venue delivery areas for the nearby venues endpoint, see
+# dopc/venue_index.py. Venues loaded by a worker are registered in the cells of
+# CELL_SIZE degrees (a divisor of 360) that their delivery area touches; venues
+# needing more than MAX_CELLS_PER_VENUE cells are checked on every lookup.
+# A cell of 0.02 degrees is about 2.2 km by 1.4 km at 50 degrees latitude.
+# Responses list at most MAX_RESULTS venues.
+
+DOPC_VENUE_INDEX = {
+    'CELL_SIZE': 0.02,
+    'MAX_CELLS_PER_VENUE': 256,
+    'MAX_VENUES': 20000,
+    'MAX_RESULTS': 100,
+}
+
+
+# Admission control for the quote endpoint (dopc.middleware.AdmissionMiddleware)
+# Each process handles at most MAX_CONCURRENCY requests to PATHS at once.
+# Further requests queue, up to MAX_QUEUE of them, for at most QUEUE_TIMEOUT
+# seconds. Requests beyond that are answered at once with STATUS (503, or 429)
+# and a Retry-After of RETRY_AFTER seconds. With PRIORITIZE_CACHED, quotes for
+# venues held in process are admitted first, and take the place of queued
+# quotes that would fetch from the venue API when the queue is full.
+
+DOPC_ADMISSION = {
+    'ENABLED': True,
+    'PATHS': ['/api/v1/delivery-order-price'],
+    'MAX_CONCURRENCY': 64,
+    'MAX_QUEUE': 128,
+    'QUEUE_TIMEOUT': 0.5,
+    'RETRY_AFTER': 1,
+    'STATUS': 503,
+    'PRIORITIZE_CACHED': True,
+}
+
+
+# Maximum number of orders accepted by the batch pricing endpoint
+
+DOPC_BATCH_MAX_ITEMS = 1000
+
+
+# Metrics
+# Prometheus metrics are served at /metrics. Set DOPC_SERVER_TIMING=1 to also
+# return the duration of each stage of a quote in a Server-Timing header.
+
+DOPC_METRICS = {
+    'SERVER_TIMING': os.environ.get('DOPC_SERVER_TIMING', '0') == '1',
+}
+
+
+# JSON encoding of request and response bodies
+# BACKEND is 'orjson', 'json' (standard library) or 'auto' for orjson when it
+# is installed. Both produce the same compact JSON.
+
+DOPC_JSON = {
+    'BACKEND': 'auto',
+}
+
+
+# Venue API client used by dopc.utils.fetch_venue_data
+# Timeouts are in seconds. Failed requests are retried RETRIES times with
+# exponential backoff starting at BACKOFF_FACTOR seconds. A request waits at
+# most REQUEST_BUDGET seconds for venue data in total, then falls back to the
+# last known good data while the load finishes in the background.
+
+DOPC_UPSTREAM = {
+    'BASE_URL': 'https://consumer-api.development.dev.woltapi.com/home-assignment-api/v1/venues/',
+    'POOL_SIZE': 32,
+    'CONNECT_TIMEOUT': 1.0,
+    'READ_TIMEOUT': 2.0,
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.1,
+    'REQUEST_BUDGET': 2.0,
+}
+
+
+# Circuit breakers around the venue API, one per endpoint (static, dynamic)
+# A circuit opens when at least FAILURE_RATE of the last MIN_CALLS or more
+# calls within WINDOW seconds failed or took longer than SLOW_CALL seconds.
+# While open, fetches fail fast and quotes use the last known good venue data;
+# after OPEN_SECONDS, HALF_OPEN_CALLS probe calls decide whether it closes.
+
+DOPC_CIRCUIT_BREAKER = {
+    'ENABLED': True,
+    'FAILURE_RATE': 0.5,
+    'MIN_CALLS': 10,
+    'WINDOW': 30,
+    'SLOW_CALL': 1.0,
+    'OPEN_SECONDS': 10,
+    'HALF_OPEN_CALLS': 1,
+}
+
+
+# Venue data cache used by dopc.utils.fetch_venue_data
+# TTLs are in seconds. Entries past their TTL are still served for up to
+# STALE_TTL seconds while they are refreshed in the background. Each worker
+# keeps up to MAX_ENTRIES venues in memory in front of the SHARED_ALIAS cache
+# (set it to None to fetch straight from upstream). Venues are held compiled,
+# at under 1 KB each including the nearby venues index.
+# Concurrent misses of a venue share one upstream load: within a worker, at
+# most MAX_WAITERS requests queue on it and further ones get the last known
+# data or fail fast; across workers, the one holding a lease in the shared
+# cache fetches while the others wait up to SHARED_LEASE_TIMEOUT seconds for
+# its result (0 disables the lease).
+
+DOPC_VENUE_CACHE = {
+    'SHARED_ALIAS': 'venues',
+    'MAX_ENTRIES': 20000,
+    'MAX_WAITERS': 256,
+    'SHARED_LEASE_TIMEOUT': 5,
+    'STATIC_TTL': 3600,
+    'DYNAMIC_TTL': 60,
+    'STALE_TTL': 300,
+}
+
+
+# Venue invalidation webhook (POST /api/v1/venues/invalidate)
+# Requests must send "Authorization: Bearer <TOKEN>"; the endpoint is disabled
+# while TOKEN is empty. Evictions are broadcast to the other workers through
+# the shared venue cache ('cache'), which each worker reads at most every
+# POLL_INTERVAL seconds, or applied to the receiving process only ('local').
+# With invalidations pushed on every change, the venue TTLs can be long.
+
+DOPC_INVALIDATION = {
+    'TOKEN': os.environ.get('DOPC_INVALIDATION_TOKEN', ''),
+    'BROADCAST': 'cache',
+    'POLL_INTERVAL': 1.0,
+    'MAX_VENUES': 1000,
+}
+
+
+# Venue snapshot store (dopc.models.VenueSnapshot)
+# The last known payload of every venue is kept in the default database. New
+# workers load snapshots younger than MAX_AGE seconds on first use and serve
+# them while refreshing; they also cover for the venue API being down.
+
+DOPC_VENUE_SNAPSHOTS = {
+    'ENABLED': True,
+    'MAX_AGE': 86400,
+}
@@ -0,0 +1,30 @@
+"""
+API-only settings profile for dopc_project.
+
+Loads only what the pricing API needs: no admin, auth, sessions, messages,
+static files or templates, and only the admission control and security
+middleware. The endpoints are stateless JSON, so none of those apps contribute
+to a response. Select it with
+
+    DJANGO_SETTINGS_MODULE=dopc_project.settings_api
+
+See benchmarks/profile_settings.py for the cold start and per-request
+comparison with the full profile.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'dopc',
+]
+
+MIDDLEWARE = [
+    'dopc.middleware.AdmissionMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+]
+
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+USE_I18N = False
@@ -14,9 +14,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
 
+from dopc import views as dopc_views
+
 urlpatterns = [
     path('api/v1/', include('dopc.urls')),
+    path('metrics', dopc_views.metrics, name='metrics'),
 ]